@@ -1,38 +1,165 @@
-from boxsdk import Client, OAuth2, folder, file
-import hashlib, os
+from __future__ import annotations
+from remote_index import RemoteIndex
+from listing import RemoteItem
+from hash_cache import HashCache, compute_sha1, read_and_hash
+from upload_pool import UploadPool
+from chunked_upload import ResumableUpload, CHUNKED_UPLOAD_THRESHOLD
+from journal import BackupJournal
+from event_sync import EventSync, BoxEventSource
+from parallel_hash import ParallelHasher
+from planner import Planner, PlanExecutor, BackupPlan, COMPARE
+from metrics import RunMetrics, instrumented, instrumented_network
+from progress import BackupProgress
+from token_store import TokenStore
+from filters import FilterConfig
+from bundles import Bundler
+from restore import Restorer
+from verify import Verifier
+from scheduler import BandwidthBudget
+from typing import BinaryIO, Optional, TYPE_CHECKING
+import io, os
+
+if TYPE_CHECKING:
+    from boxsdk import Client, OAuth2, folder, file
+
+STATE_DIR = os.path.dirname(os.path.abspath(__file__))
+COPY_THRESHOLD = 256 * 1024
+PREFLIGHT_THRESHOLD = 1024 * 1024
+IN_MEMORY_THRESHOLD = 4 * 1024 * 1024
+
+def state_path(name: str, state_dir: Optional[str] = None) -> str:
+    '''
+    Location of the credentials and local state files (index, caches, journal), next to this module so the
+    app can be started from any working directory (e.g. cron or systemd), unless another state_dir is given.
+    '''
+    return os.path.join(state_dir or STATE_DIR, name)
+
+def conflicting_file(error) -> Optional[str]:
+    '''
+    Id of the file named in the conflicts of a 409 name conflict from box (None for other errors, or if the name is
+    taken by a folder).
+    '''
+    if error.status != 409 or not error.context_info:
+        return None
+    conflicts = error.context_info.get('conflicts')
+    if isinstance(conflicts, list):
+        conflicts = conflicts[0] if conflicts else None
+    if not conflicts or conflicts.get('type') != 'file':
+        return None
+    return conflicts.get('id')
 
 class Backup():
     '''
     Class to handle interactions with the boxapi to 
      - authenticate a client
      - upload/updates folders/files
+    boxsdk is only imported once authorization or a box call is needed, so local-only commands start fast.
     '''
-    oauth2: OAuth2
-    auth_url: str
-    csrf_token: str
-
+    index: RemoteIndex
+    hash_cache: HashCache
+    upload_pool: UploadPool
+    resumable_upload: ResumableUpload
+    journal: BackupJournal
+    event_sync: EventSync
+    metrics: RunMetrics
+    hasher: ParallelHasher
+    progress: Optional[BackupProgress]
+    token_store: TokenStore
+    filters: FilterConfig
+    bundler: Bundler
+    bandwidth: BandwidthBudget
 
-    def __init__(self):
+    def __init__(self, upload_workers: int = 4, credential_path: Optional[str] = None, state_dir: Optional[str] = None,
+                 max_bandwidth: Optional[float] = None):
         '''
-        - Intilizes the backup file with the proper values for the client id, secret token, and base box backup folder id.
-        - Creates OAuth2 object to generate the authorization url and associated csrf token.
-        - Sets the redirect url to localhost
+        - Intilizes the backup file with the proper values for the client id, secret token, base box backup folder id
+          and redirect url read from credential_path (credential.txt next to this module by default).
+        - The OAuth2 object generating the authorization url and associated csrf token is created when first needed.
+          Its tokens are saved in the token store whenever they are issued or refreshed, so later runs can skip the
+          browser authorization (see authenticate_stored).
+        - Every box request (api calls, uploads and token refreshes) goes through one network layer whose pool of
+          keep-alive connections is sized to the upload concurrency.
+        - Opens the persistent index of the remote backup tree and the cache of local file hashes, along with the
+          process pool hashing many files at once
+        - Creates the pool that runs up to upload_workers uploads/updates concurrently, and the budget of
+          max_bandwidth bytes per second (unlimited if None) shared by all the uploads
+        - Opens the journal used to resume interrupted backups
+        - Loads the include/exclude rules of the backup roots (filters.json), applied while planning
+        - The small files of the roots with a bundle threshold (see filters.py) are packed in per-folder tar bundles
+          (see bundles.py)
+        - Creates the collector of the timings, counts and bytes of each phase of a run (see write_metrics)
+        - progress -> set by the app while a run is shown, to report every file transferred
+        The local state is kept in state_dir if given (e.g. to keep the state of runs against a fake box apart).
         '''
-        with open('src/credential.txt', 'r') as credentials:
-            CLIENT_ID = credentials.readline().strip()
-            CLIENT_SECRET = credentials.readline().strip()
+        with open(credential_path or state_path('credential.txt'), 'r') as credentials:
+            self.CLIENT_ID = credentials.readline().strip()
+            self.CLIENT_SECRET = credentials.readline().strip()
             self.BACKUPFOLDERID = credentials.readline().strip()
-            REDIRECT_URL = credentials.readline().strip()
-        
-        self.oauth2 = OAuth2(
-            client_id=CLIENT_ID,
-            client_secret=CLIENT_SECRET
-            )
-                
-        self.auth_url, self.csrf_token = self.oauth2.get_authorization_url(REDIRECT_URL)
-        # print(self.csrf_token,'inner')
+            self.REDIRECT_URL = credentials.readline().strip()
+
+        self._oauth2 = None
+        self._auth_url = None
+        self._csrf_token = None
         self.authorized = False
+        self.auth_error = None
+        self.state_dir = state_dir
+        self.upload_workers = upload_workers
+        self._network = None
+        self.token_store = TokenStore(state_path('tokens.json', state_dir), self.CLIENT_ID)
+        self.metrics = RunMetrics()
+        self.progress = None
+        self.index = RemoteIndex(state_path('remote_index.db', state_dir))
+        self.hash_cache = HashCache(state_path('hash_cache.db', state_dir), metrics=self.metrics)
+        self.hasher = ParallelHasher(self.hash_cache, metrics=self.metrics)
+        self.upload_pool = UploadPool(max_workers=upload_workers)
+        self.bandwidth = BandwidthBudget(max_bandwidth)
+        self.journal = BackupJournal(state_path('backup_journal.jsonl', state_dir))
+        self.filters = FilterConfig(state_path('filters.json', state_dir))
+        self.bundler = Bundler(self, state_path('bundle_manifests', state_dir))
+
+    @property
+    def network(self):
+        '''
+        The network layer shared by every box request. Each upload worker may upload the parts of a large file
+        concurrently (4 at a time), plus a few connections for listings and events. Its 429s slow the upload pool
+        down.
+        '''
+        if self._network is None:
+            self._network = instrumented_network(self.metrics, pool_size=self.upload_workers * 4 + 4,
+                                                 on_throttled=self.upload_pool.throttled)
+        return self._network
+
+    @property
+    def oauth2(self) -> OAuth2:
+        if self._oauth2 is None:
+            self._oauth2 = self.create_oauth2()
+        return self._oauth2
+
+    def create_oauth2(self, access_token: Optional[str] = None, refresh_token: Optional[str] = None) -> OAuth2:
+        from boxsdk import OAuth2
+        from boxsdk.session.session import Session
+        return OAuth2(
+            client_id=self.CLIENT_ID,
+            client_secret=self.CLIENT_SECRET,
+            access_token=access_token,
+            refresh_token=refresh_token,
+            store_tokens=self.token_store.save,
+            session=Session(network_layer=self.network),
+            )
 
+    @property
+    def auth_url(self) -> str:
+        '''
+        The url of the box authorization page, with the redirect url set to localhost.
+        '''
+        if self._auth_url is None:
+            self._auth_url, self._csrf_token = self.oauth2.get_authorization_url(self.REDIRECT_URL)
+        return self._auth_url
+
+    @property
+    def csrf_token(self) -> str:
+        self.auth_url
+        return self._csrf_token
 
     def authenticate(self, code: str, csrf: str):
         '''
@@ -44,57 +171,173 @@ class Backup():
             if not self.authorized:
                 assert csrf == self.csrf_token
                 access_token, refresh_token = self.oauth2.authenticate(code)
-                self.client = Client(self.oauth2)
-                self.backup_folder = self.client.folder(self.BACKUPFOLDERID)
-                self.base_backup = self.client.folder(self.BACKUPFOLDERID)
-                self.authorized = True
+                self.connect()
                 return True
             return True
         except AssertionError:
             self.authorized = False
             return False
 
-    def sha1_hash(self, file_path: str) -> str:
+    def authenticate_with_tokens(self, access_token: str, refresh_token: Optional[str] = None) -> bool:
         '''
-        Generates a sha1 hash of a file using the bytes of a file.
+        Authenticates without the browser flow using existing tokens (e.g. for the command line entry point).
+        The tokens are stored, and replaced in the token store whenever boxsdk refreshes them.
         '''
-        sha1 = hashlib.sha1()
-        
-        with open(file_path, 'rb') as file:
-            for byte_block in iter(lambda: file.read(4096), b''):
-                sha1.update(byte_block)
+        self._oauth2 = self.create_oauth2(access_token, refresh_token)
+        self.token_store.save(access_token, refresh_token)
+        self.connect()
+        return True
+
+    def authenticate_stored(self) -> bool:
+        '''
+        Authenticates with the tokens stored by an earlier run, refreshing them if the access token expired.
+        Returns False (and forgets the tokens) if there are none or box no longer accepts them, in which case the
+        browser authorization is needed.
+        Returns False but keeps the tokens if box cannot be reached or fails (network error, timeout, 5xx, ...): the
+        reason is left in auth_error, and calling this again once box is back is enough.
+        '''
+        self.auth_error = None
+        access_token, refresh_token = self.token_store.load()
+        if not refresh_token:
+            return False
+        from boxsdk.exception import BoxAPIException, BoxNetworkException, BoxOAuthException
+        from requests.exceptions import RequestException
+        self._oauth2 = self.create_oauth2(access_token, refresh_token)
+        self.connect()
+        try:
+            self.base_backup.get(fields=['id'])
+        except (BoxOAuthException, BoxAPIException) as error:
+            self.authorized = False
+            if error.status not in (400, 401):
+                self.auth_error = f'Box could not be reached ({error.status}: {error.message})'
+                return False
+            self.token_store.clear()
+            self._oauth2 = None
+            return False
+        except (RequestException, BoxNetworkException) as error:
+            self.authorized = False
+            self.auth_error = f'Box could not be reached ({error})'
+            return False
+        return True
+
+    def connect(self, client: Optional[Client] = None) -> None:
+        '''
+        Creates the client once authorized, along with the resumable uploader for large files and the events stream
+        sync of the remote index. Another client with the same interface can be given instead (e.g. a FakeClient to
+        run backups without box). Every request of the boxsdk client is recorded in the run metrics.
+        '''
+        if client is None:
+            from boxsdk import Client
+            from boxsdk.session.session import AuthorizedSession
+            session = AuthorizedSession(self.oauth2, network_layer=self.network)
+            client = Client(self.oauth2, session=session)
+        self.client = client
+        self.backup_folder = self.client.folder(self.BACKUPFOLDERID)
+        self.base_backup = self.client.folder(self.BACKUPFOLDERID)
+        self.resumable_upload = ResumableUpload(self.client, state_path('upload_sessions', self.state_dir),
+                                                bandwidth=self.bandwidth)
+        self.event_sync = EventSync(self.index, BoxEventSource(self.client), self.BACKUPFOLDERID, self.client)
+        self.authorized = True
 
-        return sha1.hexdigest()
+    @instrumented('refresh_remote')
+    def refresh_remote(self) -> int:
+        '''
+        Applies the changes made on box since the last run (e.g. edits by collaborators in the web UI) to the remote
+        index using the events stream. The tree is only re-listed in full when the stored stream position expired.
+        '''
+        return self.event_sync.sync()
 
-    def is_same_version(self, file_path: str, item: file.File) -> bool:
+    def sha1_hash(self, file_path: str) -> str:
         '''
-        Checks if two files are the same by comparing their sha1 hashes.
+        Generates a sha1 hash of a file using the bytes of a file. Files that have not changed (same size, mtime and
+        inode) since they were last hashed are answered from the hash cache with a single stat call.
         '''
+        return self.hash_cache.sha1(file_path)
+
+    def is_same_version(self, file_path: str, item: RemoteItem) -> bool:
+        '''
+        Checks if two files are the same by comparing their sha1 hashes. Files of different sizes are known to differ
+        without being hashed, so they are only read once, by the upload.
+        '''
+        if item.size is not None and os.path.getsize(file_path) != item.size:
+            return False
         file_sha1 = self.sha1_hash(file_path)
         return file_sha1 == item.sha1
 
+    def backup_folder_id(self) -> str:
+        '''
+        Id of the box folder backups go to (the one chosen in BoxNav, or the base backup folder).
+        '''
+        backup_folder = getattr(self, 'backup_folder', None)
+        return backup_folder.object_id if backup_folder is not None else self.BACKUPFOLDERID
+
+    def find_indexed_folder(self, path: str) -> Optional[RemoteItem]:
+        '''
+        Looks up the box folder matching a local folder by name in the remote index (the backup folder itself or
+        any folder below it), without contacting box.
+        '''
+        root_id = self.backup_folder_id()
+        dir_name = os.path.split(os.path.normpath(path))[-1]
+        root = self.index.get(root_id)
+        if root and root.name == dir_name:
+            return root
+        return self.index.find(dir_name, 'folder', root_id)
+
+    def estimate_transfer(self, path: str) -> int:
+        '''
+        Quick estimate of the bytes a backup of path would transfer, from the local tree and the remote index only
+        (without hashing: files that would have to be compared are counted as changed). Only the counts are kept
+        while the tree is walked, so estimating a huge tree costs its stat calls and no memory.
+        '''
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        planner = Planner(self, offline=True)
+        folder = self.find_indexed_folder(path)
+        entries = planner.iter_folder(path, folder.id) if folder else planner.iter_folder(path, None, self.backup_folder_id())
+        plan = planner.count(entries, compare=False)
+        return plan.transfer_bytes() + plan.bytes[COMPARE]
+
+    def local_plan(self, path: str, keep_entries: bool = True) -> BackupPlan:
+        '''
+        Plans the backup of a local file/folder against the remote index only (no box calls).
+        Unchanged files only cost a stat call thanks to the hash cache.
+        Used for dry runs and to skip runs with nothing to do without connecting to box. Without keep_entries only
+        the counts are kept while the tree is walked (see Planner.count), which is enough to tell whether there is
+        anything to do.
+        '''
+        planner = Planner(self, offline=True)
+        if os.path.isfile(path):
+            root_id = self.backup_folder_id()
+            item = self.index.find(os.path.split(path)[-1], 'file', root_id)
+            entry = planner.plan_file(path, item.parent_id if item else root_id, None, item)
+            if not keep_entries:
+                return planner.count([entry])
+            plan = BackupPlan()
+            plan.add(entry)
+            return planner.compare_all(plan)
+
+        folder = self.find_indexed_folder(path)
+        if not keep_entries:
+            entries = planner.iter_folder(path, folder.id) if folder else planner.iter_folder(path, None, self.backup_folder_id())
+            return planner.count(entries)
+        if folder:
+            return planner.compare_all(planner.plan_folder(path, folder.id))
+        return planner.compare_all(planner.plan_folder(path, None, self.backup_folder_id()))
+
+    @instrumented('file_exists')
     def file_exists(self, path: str):
         '''
-        Recursively checks a file exists in box starting at the set backup directory by matching names
+        Checks a file exists in box anywhere under the set backup directory by matching names in the remote index.
         '''
         if os.path.exists(path):
             file_name = os.path.split(path)[-1]
         else:
             return "File not found in local drive"
-        
-        def find_file(cur_item):
-            if cur_item.get().type == 'file':
-                if cur_item.get().name == file_name:
-                    return cur_item
-            elif cur_item.get().type == 'folder':
-                for child_item in cur_item.get_items():
-                    result = find_file(child_item)
-                    if result:
-                        return result
-            return False        
-
-        return find_file(self.backup_folder)
 
+        self.index.ensure_tree(self.client, self.BACKUPFOLDERID)
+        return self.index.find(file_name, 'file', self.backup_folder.object_id) or False
+
+    @instrumented('backup_files')
     def backup_files(self, path: str):
         '''
         Backs up files:
@@ -103,97 +346,346 @@ class Backup():
             3) If file does not exist, uploads it to the box backup directory. 
         '''
         file = self.file_exists(path)
-        if file == "file not found in local drive":
+        if file == "File not found in local drive":
             return file
         elif file:
             if self.is_same_version(path, file):
                 return("Already backed up with same version.")
-            else:
-                file.update_contents(path)
+            elif self.update_file(file, path):
                 return("Updated version.")
+        size = os.path.getsize(path)
+        source = self.find_copy_source(self.sha1_hash(path), size) if self.may_copy(size) else None
+        if self.progress is not None:
+            self.progress.planned(1, 0 if source else size)
+        if source:
+            self.copy_file(source, self.backup_folder, path)
+            return("Backed up (copied on box).")
+        self.upload_file(self.backup_folder, path)
+        return("Backed up.")
+
+    def upload_file(self, box_folder: folder.Folder, path: str) -> RemoteItem:
+        '''
+        Uploads a new file into box_folder and records it in the remote index.
+        Files above CHUNKED_UPLOAD_THRESHOLD go through a resumable chunked upload session.
+        '''
+        self.journal.planned('upload', path, parent_id=box_folder.object_id)
+        with self.metrics.timed('upload', os.path.getsize(path)):
+            uploaded = self.send_file(path, box_folder=box_folder)
+        item = self.index.record(uploaded, box_folder.object_id)
+        self.journal.completed_file(path, item.id)
+        if self.progress is not None:
+            self.progress.file_done(path, item.size or 0, 'uploaded')
+        return item
+
+    def send_file(self, path: str, box_folder: Optional[folder.Folder] = None,
+                  box_file: Optional[file.File] = None) -> file.File:
+        '''
+        Uploads path as a new file in box_folder or as a new version of box_file:
+            - Files below IN_MEMORY_THRESHOLD are read whole, hashed from that buffer and uploaded from it.
+            - Files up to CHUNKED_UPLOAD_THRESHOLD are hashed first (unless the hash is cached) and uploaded straight
+              from the file, so no more than a read buffer of them is held in memory.
+            - Larger files go through a resumable chunked upload session, which hashes the parts as it reads them
+              (unless the hash is already cached).
+        The sha1 is sent along so box verifies the content, and the sha1 box reports is cached for the file.
+        '''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if stat.st_size >= CHUNKED_UPLOAD_THRESHOLD:
+            box_file = self.preflight(stat.st_size, os.path.basename(path), box_folder, box_file)
+            sha1 = self.hash_cache.lookup(path, stat)
+            if box_file is not None:
+                sent = self.resumable_upload.upload(path, sha1, file_id=box_file.object_id)
+            else:
+                sent = self.resumable_upload.upload(path, sha1, folder_id=box_folder.object_id)
+        elif stat.st_size >= IN_MEMORY_THRESHOLD:
+            sha1 = self.hash_cache.lookup(path, stat)
+            if sha1 is None:
+                with self.metrics.timed('hash', stat.st_size):
+                    sha1 = compute_sha1(path)
+            with open(path, 'rb') as stream:
+                sent = self.send_stream(stream, stat.st_size, sha1, os.path.basename(path), box_folder, box_file)
         else:
-            self.backup_folder.upload(path)
-            return("Backed up.")
+            with self.metrics.timed('read', stat.st_size):
+                content, sha1 = read_and_hash(path)
+            sent = self.send_content(content, sha1, os.path.basename(path), box_folder, box_file)
+
+        new_stat = os.stat(path)
+        if getattr(sent, 'sha1', None) and (new_stat.st_size, new_stat.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            self.hash_cache.store(path, sent.sha1, stat)
+        return sent
+
+    def preflight(self, size: int, name: str, box_folder: Optional[folder.Folder] = None,
+                  box_file: Optional[file.File] = None) -> Optional[file.File]:
+        '''
+        Asks box whether an upload of size bytes as the file name of box_folder (or as a new version of box_file) will
+        be accepted, before any of it is sent. Capacity errors (e.g. storage_limit_exceeded, file_size_limit_exceeded)
+        are raised right away. Returns the box file to upload to: box_file, or the file of box_folder already called
+        name (unknown to the index, e.g. uploaded by another client), to be updated instead.
+        Uploads below PREFLIGHT_THRESHOLD are not checked (the check would cost as much as the upload): box rejects
+        them before storing anything and send_stream handles their name conflicts.
+        '''
+        from boxsdk.exception import BoxAPIException
+        if size < PREFLIGHT_THRESHOLD:
+            return box_file
+        try:
+            with self.metrics.timed('preflight'):
+                if box_file is not None:
+                    box_file.preflight_check(size)
+                else:
+                    box_folder.preflight_check(size, name)
+        except BoxAPIException as e:
+            conflict = conflicting_file(e) if box_file is None else None
+            if conflict is None:
+                raise
+            return self.client.file(conflict)
+        return box_file
+
+    def send_content(self, content: bytes, sha1: str, name: str, box_folder: Optional[folder.Folder] = None,
+                     box_file: Optional[file.File] = None) -> file.File:
+        '''
+        Uploads content as the file name of box_folder or as a new version of box_file (see send_stream).
+        '''
+        return self.send_stream(io.BytesIO(content), len(content), sha1, name, box_folder, box_file)
+
+    def send_stream(self, stream: BinaryIO, size: int, sha1: str, name: str, box_folder: Optional[folder.Folder] = None,
+                    box_file: Optional[file.File] = None) -> file.File:
+        '''
+        Uploads the size bytes of stream as the file name of box_folder or as a new version of box_file, after its
+        preflight check. A name conflict updates the conflicting box file instead, sending the stream again.
+        '''
+        from boxsdk.exception import BoxAPIException
+        box_file = self.preflight(size, name, box_folder, box_file)
+        self.bandwidth.consume(size)
+        if box_file is not None:
+            return box_file.update_contents_with_stream(stream, sha1=sha1)
+        try:
+            return box_folder.upload_stream(stream, name, sha1=sha1)
+        except BoxAPIException as e:
+            conflict = conflicting_file(e)
+            if conflict is None:
+                raise
+            stream.seek(0)
+            return self.client.file(conflict).update_contents_with_stream(stream, sha1=sha1)
+
+    def may_copy(self, size: int) -> bool:
+        '''
+        Checks if a new file of this size is worth hashing to look for the same content on box: it is at least
+        COPY_THRESHOLD bytes (smaller files upload about as fast as they are copied) and a box file has its size.
+        '''
+        return size >= COPY_THRESHOLD and self.index.has_file_size(size)
+
+    def find_copy_source(self, sha1: str, size: int) -> Optional[RemoteItem]:
+        '''
+        Looks up a file with the same content anywhere under the base backup folder in the remote index.
+        '''
+        return self.index.find_by_content(sha1, size, self.BACKUPFOLDERID)
+
+    def copy_file(self, source: RemoteItem, box_folder: folder.Folder, path: str) -> RemoteItem:
+        '''
+        Backs up a new file by copying the box file with the same content into box_folder (a single metadata call,
+        e.g. for files renamed or moved locally) and records it in the remote index. The source is left in place,
+        so the backup of its own path is unaffected. Falls back to uploading if the source no longer exists.
+        '''
+        from boxsdk.exception import BoxAPIException
+        self.journal.planned('copy', path, file_id=source.id, parent_id=box_folder.object_id)
+        try:
+            with self.metrics.timed('copy', source.size or 0):
+                copied = self.client.file(source.id).copy(parent_folder=box_folder, name=os.path.basename(path))
+        except BoxAPIException as e:
+            if e.status != 404:
+                raise
+            self.index.remove(source.id)
+            return self.upload_file(box_folder, path)
+        item = self.index.record(copied, box_folder.object_id)
+        self.journal.completed_file(path, item.id)
+        if self.progress is not None:
+            self.progress.file_done(path, 0, 'copied')
+        return item
+
+    def update_file(self, item: RemoteItem, path: str):
+        '''
+        Uploads a new version of an indexed file and records it in the remote index.
+        Returns False if the file no longer exists on box (the index was stale) so the caller can upload it instead.
+        '''
+        from boxsdk.exception import BoxAPIException
+        self.journal.planned('update', path, file_id=item.id)
+        try:
+            with self.metrics.timed('update', os.path.getsize(path)):
+                updated = self.send_file(path, box_file=self.client.file(item.id))
+            updated_item = self.index.record(updated, item.parent_id)
+            self.journal.completed_file(path, updated_item.id)
+            if self.progress is not None:
+                self.progress.file_done(path, updated_item.size or 0, 'updated')
+            return updated_item
+        except BoxAPIException as e:
+            if e.status != 404:
+                raise
+            self.index.remove(item.id)
+            return False
+
+    @instrumented('create_folder')
+    def create_folder(self, box_folder: folder.Folder, name: str, path: Optional[str] = None) -> folder.Folder:
+        '''
+        Creates a subfolder in box_folder and records it in the remote index. If the local path of the folder is given,
+        the journal is checked first so a folder created by an interrupted run is reused instead of created again.
+        '''
+        if path:
+            done = self.journal.is_done('folder', path)
+            if done and self.index.get(done['remote_id']):
+                return self.client.folder(done['remote_id'])
+            self.journal.planned('folder', path, parent_id=box_folder.object_id)
+        new_folder = box_folder.create_subfolder(name)
+        self.index.record(new_folder, box_folder.object_id)
+        if path:
+            self.journal.completed('folder', path, new_folder.object_id)
+        return new_folder
         
+    @instrumented('folder_exists')
     def folder_exists(self, path: str):
         '''
-        Recursively checks a folder exists in box starting at the set backup directory by matching names
+        Checks a folder exists in box starting at the set backup directory by matching names in the remote index.
         '''
-        if os.path.exists(path):
-            dir_name = os.path.split(path)[-1]
-        else:
+        if not os.path.exists(path):
             return "Folder not found in local drive"
-        
-        def find_folder(cur_item):
-            if cur_item.get().name == dir_name:
-                return cur_item
-            
-            for child_item in cur_item.get_items():
-                if child_item.get().type == "folder":
-                    result = find_folder(child_item)
-                    if result:
-                        return result
-            return False        
-
-        return find_folder(self.backup_folder)
+
+        self.index.ensure_tree(self.client, self.BACKUPFOLDERID)
+        item = self.find_indexed_folder(path)
+        if item and item.id == self.backup_folder.object_id:
+            return self.backup_folder
+        return self.client.folder(item.id) if item else False
     
+    def sync_file(self, box_folder: folder.Folder, box_file: Optional[RemoteItem], path: str):
+        '''
+        Brings a single file in box_folder up to date: uploads it if box_file is None, otherwise updates it
+        if its version differs. Runs on the upload pool. Files already backed up by the interrupted run being resumed
+        are skipped without being compared.
+        '''
+        if self.journal.file_is_done(path):
+            return
+        if box_file:
+            if self.is_same_version(path, box_file) or self.update_file(box_file, path):
+                return
+        self.upload_file(box_folder, path)
+
     def recursive_folder_backup(self, box_folder: folder.Folder, cur_path: str):
         '''
         If the folder exists, recursively 
             1) Update all the contents of the local folder are found with different version online
             2) Upload all the contents of the local folder not found in the online version
 
-        This is done in a BFS fashion to ensure the hierarchical structure of the local folder is kept.
+        The Planner walks the folder and decides what to do with each item (folders to create, files to
+        upload/update/skip) while the PlanExecutor runs its decisions as they come: folders are created before their
+        contents and the transfers are queued on the upload pool while the rest of the tree is still walked. Files
+        that have to be hashed to be compared are hashed in parallel, and queued once found changed.
         '''
-        root, dirs, files = next(os.walk(cur_path))
-    
-        box_files = {item.get().name: item for item in box_folder.get_items() if item.get().type == "file"}
-        
-        for file in files:
-            box_file = box_files.get(file, None)
-            if box_file:
-                if not self.is_same_version(os.path.join(root, file), box_file):
-                    box_file.update_contents(os.path.join(root, file))
-            else:
-                box_folder.upload(os.path.join(root, file))
-
-        sub_folders = {item.get().name: item for item in box_folder.get_items() if item.get().type == "folder"}
-    
-        for dir in dirs:
-
-            sub_folder = sub_folders.get(dir, None)
-
-            if sub_folder:
-                self.recursive_folder_backup(sub_folder, os.path.join(root, dir))
-            else:
-                new_folder = box_folder.create_subfolder(dir)
-                self.recursive_folder_backup(new_folder, os.path.join(root, dir))
+        planner = Planner(self)
+        with self.metrics.timed('walk'):
+            return PlanExecutor(self).stream(planner, planner.iter_folder(cur_path, box_folder.object_id))
 
     def new_folder_backup(self, box_folder: folder.Folder, cur_path: str):
         '''
         When a folder is not in the box backup directory, creates a new folder at the box backup directory and 
-        recursively uploads all the contents of the local folder.
+        recursively uploads all the contents of the local folder, planned then executed like recursive_folder_backup.
         '''
-        root, dirs, files = next(os.walk(cur_path))
-        new_folder = box_folder.create_subfolder(os.path.split(cur_path)[1])
-        for file in files:
-            new_folder.upload(os.path.join(root, file))
-
-        for dir in dirs:
-            self.new_folder_backup(new_folder, os.path.join(root, dir))
-
+        planner = Planner(self)
+        with self.metrics.timed('walk'):
+            return PlanExecutor(self).stream(planner, planner.iter_folder(cur_path, None, box_folder.object_id))
 
+    @instrumented('backup_folders')
     def backup_folders(self, path: str):
         '''
         Checks if a folder exists in the box backup directory or any subfolders and chooses the appropriate upload method.
+        Waits for the upload pool to finish the queued transfers before reporting.
         '''
         folder = self.folder_exists(path)
         if folder == "Folder not found in local drive":
             return(folder)
         elif folder == False:
             self.new_folder_backup(self.backup_folder, path)
-            return "New folder created"
+            return "New folder created" + self.failed_uploads()
         elif folder:
             self.recursive_folder_backup(folder, path)
-            return "Existing folder updated"
+            return "Existing folder updated" + self.failed_uploads()
+
+    def backup_changed(self, root: str, path: str):
+        '''
+        Backs up a single changed path below the selected folder root (used by the watch mode) without re-walking root:
+            1) Resolves the box folder matching the parent of path from the remote index, creating missing folders.
+            2) Updates/uploads the file, or backs up the new directory.
+        '''
+        box_folder = self.folder_exists(root)
+        if box_folder == "Folder not found in local drive":
+            return box_folder
+        elif box_folder == False:
+            return self.backup_folders(root)
+
+        if self.filters.excludes(path, root):
+            return "Excluded by the filters of " + root
+
+        if path == root:
+            self.recursive_folder_backup(box_folder, root)
+            return "Existing folder updated" + self.failed_uploads()
+
+        cur_path = root
+        relative_dirs = os.path.relpath(os.path.dirname(path), root).split(os.sep)
+        for name in [name for name in relative_dirs if name != '.']:
+            cur_path = os.path.join(cur_path, name)
+            self.index.ensure_folder(self.client, box_folder.object_id)
+            sub_folder = self.index.child(box_folder.object_id, name, 'folder')
+            box_folder = self.client.folder(sub_folder.id) if sub_folder else self.create_folder(box_folder, name, cur_path)
+
+        self.index.ensure_folder(self.client, box_folder.object_id)
+        name = os.path.basename(path)
+        if os.path.isdir(path):
+            sub_folder = self.index.child(box_folder.object_id, name, 'folder')
+            if sub_folder:
+                self.recursive_folder_backup(self.client.folder(sub_folder.id), path)
+            else:
+                self.new_folder_backup(box_folder, path)
+        else:
+            box_file = self.index.child(box_folder.object_id, name, 'file')
+            if box_file is None and self.filters.for_path(path, root)[1].bundles(os.stat(path)):
+                planner = Planner(self)
+                PlanExecutor(self).stream(planner, planner.iter_folder(os.path.dirname(path), box_folder.object_id,
+                                                                       recursive=False))
+            else:
+                self.upload_pool.submit(self.sync_file, box_folder, box_file, path)
+        return "Backed up changes" + self.failed_uploads()
+
+    @instrumented('restore')
+    def restore_folder(self, folder_id: str, destination: str, workers: Optional[int] = None) -> str:
+        '''
+        Downloads the box folder folder_id (e.g. the backup folder or one selected in BoxNav) into the local folder
+        destination, with concurrent verified downloads (see Restorer). Files already restored are skipped, so an
+        interrupted restore is resumed by running it again.
+        '''
+        return Restorer(self, workers).restore(folder_id, destination)
+
+    @instrumented('verify')
+    def verify(self, paths: list[str], report_path: Optional[str] = None) -> dict[str, str]:
+        '''
+        Audits the backup of the local paths without changing anything on box and returns the status of each path.
+        The missing, stale and extra items are written to report_path (verify_report.jsonl by default) as they are
+        found (see Verifier).
+        '''
+        return Verifier(self, report_path or state_path('verify_report.jsonl', self.state_dir)).verify(paths)
+
+    def write_metrics(self) -> list[str]:
+        '''
+        Writes the metrics of the run as a JSON report (metrics.json) and a Prometheus textfile (metrics.prom) next to
+        the local state, and returns their summary for the log. The cache hits of the run are saved along.
+        '''
+        self.hash_cache.flush()
+        self.metrics.write(state_path('metrics.json', self.state_dir), state_path('metrics.prom', self.state_dir))
+        return self.metrics.summary()
+
+    def failed_uploads(self) -> str:
+        '''
+        Waits for the upload pool (only for the tasks of the current scope, within one) and returns a note about the
+        transfers that failed, if any.
+        '''
+        errors = self.upload_pool.wait()
+        if errors:
+            return f" ({len(errors)} files failed to upload)"
+        return ""
         
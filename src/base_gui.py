@@ -1,9 +1,13 @@
 from tkinter import filedialog, Tk, Menu, ttk, Toplevel, Listbox, Text, scrolledtext
 from tkinter.constants import *
 from backup import Backup
-from werkzeug import Request, Response, run_simple
 import threading, time, os, webbrowser, ctypes
 from box_dialog_gui import BoxNav
+from watcher import WatchDaemon
+from progress import BackupProgress
+from listing import ListingCache
+from scheduler import JobScheduler, BackupJob
+from typing import Callable
 
 class BaseGui:
     '''
@@ -21,6 +25,8 @@ class BaseGui:
     auth_button: ttk.Button
     retry: ttk.Label
     box_nav: BoxNav
+    watch_daemon: WatchDaemon
+    listing_cache: ListingCache
 
     def __init__(self, backup: Backup) -> None:
         '''
@@ -34,6 +40,9 @@ class BaseGui:
         - base -> Base Window
         - v_scroll -> the vertical scroll bar
         - auth_button -> the authentication button that triggers the start of the oauth_server thread and open authentication website
+        The authentication page is skipped when the tokens stored by an earlier session are still accepted by box,
+        checked in a worker thread while the window shows that it is connecting.
+        If box cannot be reached at startup, the stored tokens are kept and the page shows why, with a Reconnect button.
         '''
 
         self.backup = backup
@@ -43,15 +52,53 @@ class BaseGui:
         self.oauth_server.daemon = True
         self.selected_folders = []
         self.selected_files = []
+        self.watch_daemon = None
+        self.watch_message = ''
+        self.listing_cache = None
 
         self.base = Tk('BSci Backup')
         self.base.protocol("WM_DELETE_WINDOW", self._on_closing)
         self.base.title('BSci Backup Application')
         self.base.geometry("600x510")
         self.base.minsize(600,510)
-    
+
         self.frm = ttk.Frame(self.base, padding=10)
         self.frm.pack()
+        self.connecting_label = ttk.Label(self.frm, text="Connecting to Box...", padding=5)
+        self.connecting_label.pack()
+        self.authenticate_stored(self.stored_checked)
+
+        self.base.mainloop()
+
+    def authenticate_stored(self, on_done: Callable[[bool], None]) -> None:
+        '''
+        Tries the tokens stored by an earlier session in a worker thread, so the window stays responsive while box is
+        slow or unreachable, and polls for the result on the tkinter main loop every 200ms. on_done is called there
+        with whether box accepted the tokens.
+        '''
+        result = {}
+
+        def check():
+            result['authorized'] = self.backup.authenticate_stored()
+
+        threading.Thread(target=check, daemon=True).start()
+        self.base.after(200, self.poll_authentication, result, on_done)
+
+    def poll_authentication(self, result: dict, on_done: Callable[[bool], None]) -> None:
+        if 'authorized' not in result:
+            self.base.after(200, self.poll_authentication, result, on_done)
+            return
+        on_done(result['authorized'])
+
+    def stored_checked(self, authorized: bool) -> None:
+        '''
+        Opens the backup_page() if box accepted the stored tokens at startup, otherwise the authentication page.
+        '''
+        self.connecting_label.destroy()
+        if authorized:
+            self.frm.destroy()
+            self.backup_page()
+            return
 
         self.auth_button = ttk.Button(self.frm,text="Authenticate", command=self.open_link, padding=5)
         self.auth_button.pack()
@@ -59,7 +106,12 @@ class BaseGui:
         self.retry = ttk.Label(self.frm, text="Retry Authorization")
         self.retry.pack_forget()
 
-        self.base.mainloop()
+        if self.backup.auth_error:
+            self.offline_label = ttk.Label(self.frm, text=self.backup.auth_error + ', the stored sign-in is kept.',
+                                           padding=5, wraplength=500)
+            self.offline_label.pack()
+            self.reconnect_button = ttk.Button(self.frm, text="Reconnect", command=self.reconnect, padding=5)
+            self.reconnect_button.pack()
 
     def handle_redirect(self) -> None:
         '''
@@ -67,6 +119,7 @@ class BaseGui:
         to authorize the user to use the BOX app.
         '''
         # print(threading.current_thread())
+        from werkzeug import Request, Response, run_simple
 
         @Request.application
         def app(request: Request) -> Response:
@@ -114,6 +167,27 @@ class BaseGui:
             self.oauth_server.start()
         self.check_thread()
 
+    def reconnect(self):
+        '''
+        Tries the tokens stored by an earlier session again (in a worker thread) after box could not be reached at
+        startup. Opens the backup_page() once box accepts them, otherwise displays the new error (or only the
+        authentication button if box no longer accepts the tokens).
+        '''
+        self.reconnect_button['state'] = 'disabled'
+        self.offline_label['text'] = 'Reconnecting to Box...'
+        self.authenticate_stored(self.reconnected)
+
+    def reconnected(self, authorized: bool) -> None:
+        if authorized:
+            self.frm.destroy()
+            self.backup_page()
+        elif self.backup.auth_error:
+            self.offline_label['text'] = self.backup.auth_error + ', the stored sign-in is kept.'
+            self.reconnect_button['state'] = 'normal'
+        else:
+            self.offline_label.destroy()
+            self.reconnect_button.destroy()
+
     def check_thread(self):
         '''
         Every second checks the status of the thread. If the authentication was sucessful and the application
@@ -185,6 +259,34 @@ class BaseGui:
 
         self.backup_button = ttk.Button(frm_buttons, text="Backup", padding=5, command=self.call_backup)
         self.backup_button.pack(side='left', pady=5)
+
+        self.watch_button = ttk.Button(frm_buttons, text="Watch", padding=5, command=self.toggle_watch)
+        self.watch_button.pack(side='left', pady=5)
+        self.watch_status = ttk.Label(frm, text='', padding=5)
+        self.watch_status.pack()
+
+        self.resume_interrupted(frm)
+
+    def resume_interrupted(self, frm: ttk.Frame):
+        '''
+        If the journal holds a backup run that was interrupted, selects its unfinished folders and files again
+        so pressing Backup continues it, skipping the work that was already completed.
+        '''
+        unfinished = self.backup.journal.unfinished_run()
+        if not unfinished or not (unfinished['folders'] or unfinished['files']):
+            return
+
+        for folder in unfinished['folders']:
+            if folder not in self.selected_folders:
+                self.selected_folders.append(folder)
+                self.folder_list.insert(END, os.path.split(folder)[1])
+
+        for file in unfinished['files']:
+            if file not in self.selected_files:
+                self.selected_files.append(file)
+                self.file_list.insert(END, os.path.split(file)[1])
+
+        ttk.Label(frm, text='An interrupted backup was found. Press Backup to resume it.', padding=5).pack()
     
     def remove_selected(self):
         '''
@@ -256,7 +358,9 @@ class BaseGui:
         Creates an instance of the BoxNav object to open a dialog box for navigating box and selecting a new backup directory.
         '''
         if self.state != "Backing Up":
-            self.box_nav = BoxNav(self.backup, self.base, selected_backup_folder)
+            if self.listing_cache is None:
+                self.listing_cache = ListingCache(self.backup.client)
+            self.box_nav = BoxNav(self.backup, self.base, selected_backup_folder, self.listing_cache, self.call_restore)
             self.box_nav.display_folders()
 
     def call_backup(self):
@@ -268,61 +372,185 @@ class BaseGui:
             self.remove_button['state'] = 'disabled'
 
             self.state = 'Backing Up'
-            backup_thread = threading.Thread(target=self.handle_backup)
+            progress = BackupProgress()
+            self.backup.progress = progress
+            log_text, progress_status = self.open_log()
+            backup_thread = threading.Thread(target=self.handle_backup, args=(progress,))
             backup_thread.start()
-        
+            self.poll_progress(progress, log_text, progress_status)
 
-    def handle_backup(self):
+    def call_restore(self, box_folder):
         '''
-        Uses the backup instance of the Backup class to back up each selected folder and file. 
-        Updates the logs and prints the status of the latest backedup folder/file.
+        Asks for the local folder to restore the box folder selected in BoxNav into, then starts the restore_thread,
+        shown in the log like a backup.
+        '''
+        if self.state == 'Backing Up':
+            return
+        destination = filedialog.askdirectory(title=f'Restore {box_folder.name} to')
+        if not destination:
+            return
+        self.backup_button['state'] = 'disabled'
+        self.remove_button['state'] = 'disabled'
+
+        self.state = 'Backing Up'
+        progress = BackupProgress()
+        self.backup.progress = progress
+        log_text, progress_status = self.open_log()
+        restore_thread = threading.Thread(target=self.handle_restore,
+                                          args=(progress, box_folder.folder.object_id, box_folder.name, destination))
+        restore_thread.start()
+        self.poll_progress(progress, log_text, progress_status)
+
+    def open_log(self) -> tuple[Text, ttk.Label]:
+        '''
+        Opens the log dialog box of a backup run, with a status line showing the throughput and ETA.
         '''
         log_dialog = Toplevel(self.base)
         log_dialog.geometry('500x400')
         log_dialog.title('Log')
 
+        progress_status = ttk.Label(log_dialog, text='Planning...', padding=5)
+        progress_status.pack(fill='x')
         log_text = Text(log_dialog, height=250, wrap='none', padx=5, pady=5, font=("Arial", 11), state='disabled')
         log_text.pack(ipadx=5, ipady=5)
+        return log_text, progress_status
 
-        temp_folders = self.selected_folders[:]
-        if len(temp_folders) > 0:
-            log_text.configure(state='normal')
-            log_text.insert(END, "Folders:\n" )
-            log_text.configure(state='disabled')
-
-        for folder in temp_folders:
-            response = self.backup.backup_folders(folder)
-            self.selected_folders.remove(folder)
-            log_text.configure(state='normal')
-            log_text.insert(END, "\t- " + os.path.split(folder)[-1] + ": " + response + '\n')
-            log_text.configure(state='disabled')
-
-        
-        temp_files = self.selected_files[:]
-        if len(temp_files) > 0:
-            log_text.configure(state='normal')
-            log_text.insert(END, "Files:\n" )
-            log_text.configure(state='disabled')
-        
-        for file in temp_files:
-            response = self.backup.backup_files(file)
-            self.selected_files.remove(file)
-            log_text.configure(state='normal')
-            log_text.insert(END, "\t- " + os.path.split(file)[-1] + ": " + response + '\n')
-            log_text.configure(state='disabled')
-
-        log_text.configure(state='normal')
-        log_text.insert(END, "\n\t\tCOMPLETED!\n")
-        log_text.configure(state='disabled')
-
+    def poll_progress(self, progress: BackupProgress, log_text: Text, progress_status: ttk.Label):
+        '''
+        Runs on the tkinter main loop every 200ms while backing up: drains the progress events queued by the backup
+        threads, appends the new log lines in a single insert (keeping only the last lines of the ring buffer in the
+        widget) and refreshes the status line. Once the run finished, re-enables the main page.
+        '''
+        lines = progress.drain()
+        if log_text.winfo_exists():
+            if lines:
+                log_text.configure(state='normal')
+                log_text.insert(END, '\n'.join(lines) + '\n')
+                line_count = int(log_text.index('end-1c').split('.')[0])
+                if line_count > progress.lines.maxlen:
+                    log_text.delete('1.0', f'{line_count - progress.lines.maxlen}.0')
+                log_text.see(END)
+                log_text.configure(state='disabled')
+            progress_status['text'] = progress.status()
+
+        if not progress.finished:
+            self.base.after(200, self.poll_progress, progress, log_text, progress_status)
+            return
+
+        self.backup.progress = None
         self.backup_button['state'] = 'normal'
         self.remove_button['state'] = 'normal'
 
         self.folder_list.delete(0, 'end')
         self.file_list.delete(0, 'end')
-        
+        for folder in self.selected_folders:
+            self.folder_list.insert(END, os.path.split(folder)[1])
+        for file in self.selected_files:
+            self.file_list.insert(END, os.path.split(file)[1])
+
         self.state = "Processing"
 
+
+    def toggle_watch(self):
+        '''
+        Starts or stops the continuous backup of the selected folders. While watching, every file saved in the
+        selected folders is backed up within seconds, without re-walking the folders.
+        '''
+        if self.watch_daemon is not None:
+            self.watch_daemon.stop()
+            self.watch_daemon = None
+            self.watch_button['text'] = 'Watch'
+            self.watch_status['text'] = ''
+            return
+
+        if not self.selected_folders or self.state == 'Backing Up':
+            return
+
+        def backed_up(path: str, response: str):
+            self.watch_message = os.path.split(path)[-1] + ": " + response
+
+        self.watch_daemon = WatchDaemon(self.backup, self.selected_folders[:], on_backed_up=backed_up)
+        self.watch_daemon.start()
+        self.watch_button['text'] = 'Stop Watching'
+        self.update_watch_status()
+
+    def update_watch_status(self):
+        '''
+        Every second shows the latest change backed up by the watch mode (the daemon threads never touch tkinter).
+        '''
+        if self.watch_daemon is not None:
+            unwatched = self.watch_daemon.unwatched
+            polled = [path for path in unwatched if path in self.watch_daemon.roots]
+            status = f'Watching {len(self.watch_daemon.roots)} folders'
+            if polled:
+                status += f' ({len(polled)} rescanned every {int(self.watch_daemon.poll_interval)}s: {unwatched[polled[0]]})'
+            if len(unwatched) > len(polled):
+                status += f', {len(unwatched) - len(polled)} subfolders not watched'
+            self.watch_status['text'] = f'{status}. {self.watch_message}'
+            self.base.after(1000, self.update_watch_status)
+
+    def handle_backup(self, progress: BackupProgress):
+        '''
+        Uses the backup instance of the Backup class to back up each selected folder and file. 
+        Each selected folder/file is a job of a JobScheduler: the jobs run side by side sharing the upload pool,
+        the smallest ones first, and each is reported as soon as it completes.
+        Runs on the backup thread, so it never touches tkinter: the status of each backed up folder/file (and every
+        file transferred, reported by the backup) goes through progress, which poll_progress shows in the log.
+        '''
+        temp_folders = self.selected_folders[:]
+        temp_files = self.selected_files[:]
+
+        def job_done(job: BackupJob):
+            if job.status == 'done':
+                if job.path in self.selected_folders:
+                    self.selected_folders.remove(job.path)
+                if job.path in self.selected_files:
+                    self.selected_files.remove(job.path)
+            progress.log(f"\t- {os.path.split(job.path)[-1]}: {job.response} ({job.duration():.1f}s)")
+
+        try:
+            self.backup.metrics.start_run()
+            self.backup.journal.start_run(temp_folders, temp_files)
+            self.backup.refresh_remote()
+
+            scheduler = JobScheduler(self.backup, shortest_first=True, on_done=job_done)
+            for path in temp_folders + temp_files:
+                scheduler.add(path)
+            progress.log("Backing up:")
+            scheduler.run()
+
+            if not self.selected_folders and not self.selected_files:
+                self.backup.journal.finish_run()
+
+            progress.log("Timings:")
+            for line in self.backup.write_metrics():
+                progress.log("\t- " + line)
+            progress.log("\n\t\tCOMPLETED!")
+        except Exception as e:
+            progress.log(f"\n\t\tFAILED: {e}")
+        finally:
+            progress.finish()
+
+    def handle_restore(self, progress: BackupProgress, folder_id: str, name: str, destination: str):
+        '''
+        Restores a box folder into destination on the restore thread, reporting through progress like handle_backup.
+        '''
+        try:
+            self.backup.metrics.start_run()
+            self.backup.refresh_remote()
+            self.backup.metrics.set_root(destination)
+            response = self.backup.restore_folder(folder_id, destination)
+            progress.log("\t- " + name + ": " + response)
+
+            progress.log("Timings:")
+            for line in self.backup.write_metrics():
+                progress.log("\t- " + line)
+            progress.log("\n\t\tCOMPLETED!")
+        except Exception as e:
+            progress.log(f"\n\t\tFAILED: {e}")
+        finally:
+            progress.finish()
+
     def _on_closing(self):
         '''
         When the app is closed, ensures that all the threads are closed.
@@ -333,6 +561,7 @@ class BaseGui:
                     ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(active_thread), ctypes.py_object(SystemExit))
                 except:
                     pass
-            
+
+        self.backup.hasher.shutdown(wait=False)
         self.base.destroy()
     
\ No newline at end of file
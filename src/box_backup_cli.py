@@ -0,0 +1,276 @@
+from backup import Backup, state_path
+from planner import format_bytes
+from scheduler import JobScheduler
+from watcher import WatchDaemon
+import argparse, os, signal, sys
+
+'''
+Headless entry point sharing the Backup engine with the app, for cron/systemd:
+    - run [PATH ...] -> backs up the given files/folders (or resumes the interrupted run when no path is given)
+    - run --dry-run PATH ... -> shows the backup plan (with byte counts and an ETA) without contacting box
+    - watch FOLDER ... -> backs up the folders, then every change in them until stopped (Ctrl+C or SIGTERM), each
+      batch of changes as a journal run so an interrupted or failed batch is resumed
+    - status -> shows the state of the local index, hash cache and journal
+    - verify PATH ... [--report FILE] -> checks the backup of the given paths without changing box, reporting the
+      missing, stale and extra items
+    - restore DESTINATION [--folder-id ID] -> downloads the backup folder (or another box folder) to DESTINATION
+    - filter ROOT [--exclude PATTERN ...] -> shows or sets the include/exclude rules of a backup root ('*' for all)
+Each run writes its timings, call counts and bytes per phase to metrics.json and metrics.prom next to the local state.
+run exits with 1 if a path was not found or some of it could not be backed up, and 2 if box could not be authorized.
+Only the modules needed by the command are imported: tkinter and werkzeug never are, and boxsdk only once a
+backup actually has work to do. Box tokens are read from the BOX_ACCESS_TOKEN and BOX_REFRESH_TOKEN variables, or
+else the ones stored (and kept refreshed) by the app or an earlier run are used.
+With --fake-box DIR the backup runs against an in-process fake box kept in DIR instead (with optional latency,
+rate limiting and failures), to measure and compare backups without a box account or network.
+'''
+
+def authenticate(backup: Backup, args) -> bool:
+    if args.fake_box:
+        from fake_box import FakeBox, FakeClient
+        box = FakeBox(root_id=backup.BACKUPFOLDERID, root_name='Backup', store_dir=os.path.join(args.fake_box, 'box'),
+                      latency=args.fake_latency, rate_limit_rate=args.fake_rate_limit, failure_rate=args.fake_failure_rate,
+                      on_call=backup.metrics.box_call, on_throttled=backup.upload_pool.throttled)
+        backup.connect(FakeClient(box))
+        return True
+    access_token = os.environ.get('BOX_ACCESS_TOKEN')
+    if access_token:
+        return backup.authenticate_with_tokens(access_token, os.environ.get('BOX_REFRESH_TOKEN'))
+    if backup.authenticate_stored():
+        return True
+    if backup.auth_error:
+        print(f'{backup.auth_error}, try again later.', file=sys.stderr)
+        return False
+    print('No stored box tokens: authorize once in the app, or set BOX_ACCESS_TOKEN (and BOX_REFRESH_TOKEN).',
+          file=sys.stderr)
+    return False
+
+def run(backup: Backup, args) -> int:
+    paths = [os.path.abspath(path) for path in args.paths]
+    if args.bundle_below is not None:
+        for path in paths:
+            if os.path.isdir(path):
+                backup.filters.set_bundle_below(path, int(args.bundle_below * 1024) or None)
+    if not paths:
+        unfinished = backup.journal.unfinished_run()
+        if not unfinished:
+            print('Nothing to back up.')
+            return 0
+        paths = unfinished['folders'] + unfinished['files']
+
+    # only the dry run lists the entries: otherwise the counts tell whether there is anything to do, and the run
+    # itself streams the tree again
+    plans = {path: backup.local_plan(path, keep_entries=args.dry_run) for path in paths if os.path.exists(path)}
+    missing = [path for path in paths if path not in plans]
+    for path in missing:
+        print(f'{path}: Not found in local drive')
+
+    if args.dry_run:
+        for path, plan in plans.items():
+            print(f'{path}: {plan.summary()}')
+            for entry in plan.changes():
+                print(f'\t{entry}')
+            eta = plan.eta(args.bandwidth * 1024 * 1024)
+            print(f'\t{format_bytes(plan.transfer_bytes())} to transfer, about {eta / 60:.1f} minutes at {args.bandwidth} MB/s')
+        return 1 if missing else 0
+
+    changes = {path: plan.changed() for path, plan in plans.items()}
+    if not args.refresh and not any(changes.values()):
+        print('Everything is up to date.')
+        return 1 if missing else 0
+
+    if not authenticate(backup, args):
+        return 2
+
+    folders = [path for path in plans if os.path.isdir(path)]
+    files = [path for path in plans if not os.path.isdir(path)]
+    backup.journal.start_run(folders, files)
+    backup.refresh_remote()
+    priorities = {os.path.abspath(path): int(priority) for path, priority in args.priority}
+    scheduler = JobScheduler(backup, max_jobs=args.jobs, shortest_first=args.shortest_first,
+                             on_done=lambda job: print(f'{job.path}: {job.response} ({job.duration():.1f}s)', flush=True))
+    for path in folders + files:
+        if not changes[path] and not args.refresh:
+            backup.journal.completed('root', path)
+            print(f'{path}: Already backed up with same version.')
+        else:
+            scheduler.add(path, priorities.get(path, 0), plans[path].transfer_bytes())
+    jobs = scheduler.run()
+    if all(job.status == 'done' for job in jobs):
+        backup.journal.finish_run()
+    if args.fake_box:
+        backup.client.box.save()
+    for line in backup.write_metrics():
+        print(f'\t{line}')
+    return 1 if missing or any(job.status != 'done' for job in jobs) else 0
+
+def watch(backup: Backup, args) -> int:
+    roots = [os.path.abspath(path) for path in args.paths]
+    missing = [root for root in roots if not os.path.isdir(root)]
+    for root in missing:
+        print(f'{root}: Not found in local drive', file=sys.stderr)
+    if missing:
+        return 1
+    if not authenticate(backup, args):
+        return 2
+    backup.refresh_remote()
+
+    daemon = WatchDaemon(backup, roots, on_backed_up=lambda path, response: print(f'{path}: {response}', flush=True),
+                         quiet=args.quiet, poll_interval=args.poll_interval, journal_runs=True)
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    daemon.start()
+    try:
+        # catch up on the changes made while not watching (and resume the batches left unfinished)
+        daemon.backup_batch(roots)
+        print(f'Watching {len(roots)} folders.', flush=True)
+        while not daemon.stop_event.wait(1):
+            pass
+    except KeyboardInterrupt:
+        daemon.stop()
+    for thread in daemon.threads:
+        thread.join()
+    if args.fake_box:
+        backup.client.box.save()
+    for line in backup.write_metrics():
+        print(f'\t{line}')
+    return 0 if backup.journal.unfinished_run() is None else 1
+
+def verify(backup: Backup, args) -> int:
+    if not authenticate(backup, args):
+        return 2
+    backup.refresh_remote()
+    report_path = os.path.abspath(args.report or state_path('verify_report.jsonl', backup.state_dir))
+    responses = backup.verify([os.path.abspath(path) for path in args.paths], report_path)
+    for path, response in responses.items():
+        print(f'{path}: {response}')
+    print(f'Report: {report_path}')
+    for line in backup.write_metrics():
+        print(f'\t{line}')
+    return 0
+
+def restore(backup: Backup, args) -> int:
+    if not authenticate(backup, args):
+        return 2
+    backup.refresh_remote()
+    destination = os.path.abspath(args.destination)
+    print(f'{destination}: {backup.restore_folder(args.folder_id or backup.BACKUPFOLDERID, destination)}')
+    for line in backup.write_metrics():
+        print(f'\t{line}')
+    return 0
+
+def status(backup: Backup, args) -> int:
+    print(f'Remote index: {backup.index.count()} items')
+    position = backup.index.get_meta(f'stream_position:{backup.BACKUPFOLDERID}')
+    print(f'Events stream position: {position or "not synced yet"}')
+    print(f'Hash cache: {backup.hash_cache.count()} files')
+    sessions_dir = state_path('upload_sessions', backup.state_dir)
+    sessions = [name for name in os.listdir(sessions_dir) if name.endswith('.json')] if os.path.isdir(sessions_dir) else []
+    print(f'Resumable uploads in progress: {len(sessions)}')
+    unfinished = backup.journal.unfinished_run()
+    if unfinished:
+        print('Interrupted run:')
+        for path in unfinished['folders'] + unfinished['files']:
+            print(f'\t{path}')
+    else:
+        print('No interrupted run.')
+    return 0
+
+def filter_rules(backup: Backup, args) -> int:
+    root = args.root if args.root == '*' else os.path.abspath(args.root)
+    if args.clear:
+        backup.filters.set(root, None)
+    elif args.exclude or args.include or args.max_size is not None or args.max_age is not None or args.min_age is not None:
+        bundle_below = backup.filters.roots.get(root, {}).get('bundle_below')
+        backup.filters.set(root, {
+            'exclude': args.exclude,
+            'include': args.include,
+            'max_size': int(args.max_size * 1024 * 1024) if args.max_size is not None else None,
+            'max_age': args.max_age * 24 * 3600 if args.max_age is not None else None,
+            'min_age': args.min_age * 60 if args.min_age is not None else None,
+            'bundle_below': bundle_below,
+        })
+    if args.bundle_below is not None:
+        backup.filters.set_bundle_below(root, int(args.bundle_below * 1024) or None)
+    rules = backup.filters.roots.get(root)
+    if not rules:
+        print(f'{root}: no rules' + (', the ones of * apply' if root != '*' and '*' in backup.filters.roots else ''))
+        return 0
+    print(f'{root}:')
+    for key, value in rules.items():
+        print(f'\t{key}: {value}')
+    return 0
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Back up local files and folders to Box without the GUI.')
+    parser.add_argument('--credentials', help='path of credential.txt (defaults to the one next to the app)')
+    parser.add_argument('--fake-box', metavar='DIR', help='back up to a fake box kept in DIR instead of box')
+    parser.add_argument('--fake-latency', type=float, default=0.0, help='seconds added to every fake box call')
+    parser.add_argument('--fake-rate-limit', type=float, default=0.0, help='share of fake box calls failing with a 429')
+    parser.add_argument('--fake-failure-rate', type=float, default=0.0, help='share of fake box calls failing with a 500')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='back up files/folders')
+    run_parser.add_argument('paths', nargs='*')
+    run_parser.add_argument('--dry-run', action='store_true', help='only list what would be backed up')
+    run_parser.add_argument('--refresh', action='store_true',
+                            help='contact box even if nothing changed locally (e.g. to repair files changed on box)')
+    run_parser.add_argument('--workers', type=int, default=4, help='number of concurrent uploads')
+    run_parser.add_argument('--jobs', type=int, default=2, help='number of paths backed up at once')
+    run_parser.add_argument('--shortest-first', action='store_true', help='back up the paths with the least to transfer first')
+    run_parser.add_argument('--priority', nargs=2, action='append', default=[], metavar=('PATH', 'N'),
+                            help='back up PATH before the paths with a lower priority (0 by default)')
+    run_parser.add_argument('--max-bandwidth', type=float, metavar='MB/s', help='limit the upload speed of all the paths')
+    run_parser.add_argument('--bandwidth', type=float, default=10.0, help='upload speed in MB/s used for the dry run ETA')
+    run_parser.add_argument('--bundle-below', type=float, metavar='KB',
+                            help='pack the files smaller than this in per-folder tar bundles with a manifest, from '
+                                 'now on for every run of the paths (0 to stop bundling)')
+    run_parser.set_defaults(handler=run)
+
+    watch_parser = commands.add_parser('watch', help='back up folders, then every change in them until stopped')
+    watch_parser.add_argument('paths', nargs='+')
+    watch_parser.add_argument('--workers', type=int, default=4, help='number of concurrent uploads')
+    watch_parser.add_argument('--quiet', type=float, default=2.0,
+                              help='seconds without changes before a burst of changes is backed up')
+    watch_parser.add_argument('--poll-interval', type=float, default=10.0,
+                              help='seconds between rescans of the folders inotify cannot watch')
+    watch_parser.set_defaults(handler=watch)
+
+    verify_parser = commands.add_parser('verify', help='check that files/folders are fully backed up, read-only')
+    verify_parser.add_argument('paths', nargs='+')
+    verify_parser.add_argument('--report', help='JSON lines report of the findings (verify_report.jsonl by default)')
+    verify_parser.set_defaults(handler=verify, workers=4)
+
+    restore_parser = commands.add_parser('restore', help='download a box folder of the backup to a local folder')
+    restore_parser.add_argument('destination')
+    restore_parser.add_argument('--folder-id', help='box folder to restore (the backup folder by default)')
+    restore_parser.add_argument('--workers', type=int, default=4, help='number of concurrent uploads (downloads use twice as many)')
+    restore_parser.set_defaults(handler=restore)
+
+    status_parser = commands.add_parser('status', help='show the local state of the backup')
+    status_parser.set_defaults(handler=status, workers=1)
+
+    filter_parser = commands.add_parser('filter', help='show or set the include/exclude rules of a backup root')
+    filter_parser.add_argument('root', help="the backup root, or '*' for the roots without rules of their own")
+    filter_parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                               help='gitignore-style pattern of the paths to leave out (!PATTERN re-includes)')
+    filter_parser.add_argument('--include', action='append', default=[], metavar='PATTERN',
+                               help='only back up the files matching one of these patterns')
+    filter_parser.add_argument('--max-size', type=float, metavar='MB', help='skip files larger than this')
+    filter_parser.add_argument('--max-age', type=float, metavar='DAYS', help='skip files not modified for this long')
+    filter_parser.add_argument('--min-age', type=float, metavar='MINUTES', help='skip files modified more recently')
+    filter_parser.add_argument('--bundle-below', type=float, metavar='KB',
+                               help='pack the files smaller than this in per-folder tar bundles (0 to stop bundling)')
+    filter_parser.add_argument('--clear', action='store_true', help='remove the rules of the root')
+    filter_parser.set_defaults(handler=filter_rules, workers=1)
+
+    args = parser.parse_args(argv)
+    state_dir = os.path.join(args.fake_box, 'state') if args.fake_box else None
+    if state_dir:
+        os.makedirs(state_dir, exist_ok=True)
+    max_bandwidth = getattr(args, 'max_bandwidth', None)
+    backup = Backup(upload_workers=args.workers, credential_path=args.credentials, state_dir=state_dir,
+                    max_bandwidth=max_bandwidth * 1024 * 1024 if max_bandwidth else None)
+    return args.handler(backup, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,40 @@
 from tkinter import Tk, ttk, Toplevel
-from typing import Optional
+from typing import Callable, Optional
 from backup import Backup
+from listing import ListingCache
 from boxsdk import folder
 
+PAGE_SIZE = 40
+COLUMNS = 4
+
 class BoxFolder():
     '''
     BoxFolder objects help navigate forward and backward. Act as linkedlist to go back to parent.
+    The name comes from the folder listing so displaying a folder needs no extra API call.
     '''
-    def __init__(self, parent: Optional['BoxFolder'], cur_folder: folder.Folder) -> None:
+    __slots__ = ('parent', 'folder', 'name')
+
+    def __init__(self, parent: Optional['BoxFolder'], cur_folder: Optional[folder.Folder], name: str = '') -> None:
         self.parent = parent
         self.folder = cur_folder
+        self.name = name
 
 class BoxNav():
     '''
     Box Navigation dialog window class. 
      
+    Listings come from a ListingCache shared by the dialogs of the session, and the subfolders shown are prefetched
+    in the background, so a folder visited before (or shown in the dialog) opens instantly. Large folders are shown
+    PAGE_SIZE subfolders at a time, so only the widgets of the visible page exist.
+
     Methods: 
         - nav_back() -> navigates back to parent folder
         - nav_forward() -> navigates forward to double clicked folder's directory
-        - display_folders() -> displays all the subfolders in a directory
+        - display_folders() -> displays the current page of subfolders in a directory
+        - change_page() -> shows the previous/next page of subfolders
         - highlight() -> highlights folders when clicked
         - set_backup_dir() -> sets the backup directory to the selected file
+        - restore_selected() -> restores the selected folder to a local folder (through on_restore)
         - closing_box_dialog() -> ensures that highlighted is reset 
     '''
     backup: Backup
@@ -28,18 +42,30 @@ class BoxNav():
     selected_backup_folder: ttk.Label
     dialog: Toplevel
     dialog_frm: ttk.Frame
+    base_name: str
     cur_folder: list[BoxFolder]
     back: ttk.Button
     select: ttk.Button
-
-    def __init__(self, backup: Backup, base: Tk, selected_backup_folder: ttk.Label) -> None:
+    restore: ttk.Button
+    listing_cache: ListingCache
+    page: int
+    folder_icons: list[ttk.Label]
+
+    def __init__(self, backup: Backup, base: Tk, selected_backup_folder: ttk.Label,
+                 listing_cache: Optional[ListingCache] = None,
+                 on_restore: Optional[Callable[[BoxFolder], None]] = None) -> None:
         '''
         - backup -> passed by pointer from the base_gui object instance.
         - base -> the base window for the app
         - selected_backup_folder -> the label that displays the current box directory that files/folders will be backedup to
+        - base_name -> name of the root backup folder, fetched once
         - cur_folder -> list keeping track of all the folders in a directory
         - back -> button to navigate back
         - select -> button to set folder as the backup directory
+        - listing_cache -> cache of the folder listings, kept by the app for the whole session
+        - on_restore -> called with the folder to restore when the Restore button is pressed (hidden if None)
+        - page -> index of the page of subfolders displayed
+        - folder_icons -> the labels of the displayed subfolders
         '''
         self.backup = backup
         self.highlighted = None
@@ -52,58 +78,100 @@ class BoxNav():
         self.dialog_frm = ttk.Frame(self.dialog)
         self.dialog_frm.grid()
 
-        self.cur_folder = [BoxFolder(None, self.backup.base_backup)]
+        self.base_name = self.backup.base_backup.get(fields=['name']).name
+        self.cur_folder = [BoxFolder(None, self.backup.base_backup, self.base_name)]
+
+        self.listing_cache = listing_cache or ListingCache(self.backup.client)
+        self.page = 0
+        self.folder_icons = []
 
         self.back = ttk.Button(self.dialog_frm, text="Back", padding=2, width=10)
         self.back.grid(row=0, column=0, padx=2)
         
         self.select = ttk.Button(self.dialog_frm, text='Select', padding=2, width=10)
         self.select.grid(row = 0, column= 1) 
+
+        self.on_restore = on_restore
+        self.restore = ttk.Button(self.dialog_frm, text='Restore', padding=2, width=10)
+        if on_restore is not None:
+            self.restore.grid(row=0, column=2)
+
+        page_frm = ttk.Frame(self.dialog_frm)
+        page_frm.grid(row=0, column=3)
+        self.prev_page = ttk.Button(page_frm, text="<", width=2, command=lambda: self.change_page(-1))
+        self.prev_page.pack(side='left')
+        self.page_label = ttk.Label(page_frm, text='', padding=2)
+        self.page_label.pack(side='left')
+        self.next_page = ttk.Button(page_frm, text=">", width=2, command=lambda: self.change_page(1))
+        self.next_page.pack(side='left')
     
     def nav_back(self):
         '''
         Checks if the current folder is not the root BSCi folder, otherwise navigates back.
         '''
         if self.cur_folder[0].parent is not None and self.cur_folder[0].parent.parent is not None:
-            parent = self.cur_folder[0].parent.parent.folder
-            self.cur_folder = [BoxFolder(self.cur_folder[0].parent.parent, item) for item in parent.get_items() if item.get().type == 'folder']
+            parent = self.cur_folder[0].parent.parent
+            self.cur_folder = self.list_subfolders(parent)
         else: 
-            self.cur_folder = [BoxFolder(None, self.backup.base_backup)]
+            self.cur_folder = [BoxFolder(None, self.backup.base_backup, self.base_name)]
 
+        self.page = 0
         self.display_folders()
 
     def nav_forward(self, folder: BoxFolder):
         '''
         Navigates into the double clicked folder and updates the cur_folder to 
         '''
-        self.cur_folder = [BoxFolder(folder, item) for item in folder.folder.get_items() if item.get().type == 'folder']
+        self.cur_folder = self.list_subfolders(folder)
         if not self.cur_folder:
             self.cur_folder = [BoxFolder(folder, None)]
+        self.page = 0
         self.display_folders()
 
+    def list_subfolders(self, parent: BoxFolder) -> list[BoxFolder]:
+        '''
+        Lists the subfolders of parent from the listing cache (a single paged, field-selected listing on a miss).
+        '''
+        return [BoxFolder(parent, self.backup.client.folder(item.id), item.name)
+                for item in self.listing_cache.get(parent.folder.object_id)]
+
+    def change_page(self, step: int):
+        pages = max(1, -(-len(self.cur_folder) // PAGE_SIZE))
+        self.page = min(max(self.page + step, 0), pages - 1)
+        self.display_folders()
 
     def display_folders(self):
         '''
         1) Destroys all the displayed folders if any are displayed.
-        2) Iterates over all the folders in the current directory and prints them into a grid with 4 columns
+        2) Iterates over the folders of the current page and prints them into a grid with 4 columns
             - each folder has a click (<Button-1>) and double-click (<Double-Button-1>) event bound to it
-            
+        3) Prefetches the listings of the displayed folders in the background
         '''
-        for widget in self.dialog_frm.winfo_children():
-            if isinstance(widget, ttk.Label):
-                widget.destroy()
+        for widget in self.folder_icons:
+            widget.destroy()
+        self.folder_icons = []
+        self.highlighted = None
 
         self.back['command'] = lambda: self.nav_back()
         self.select['state'] = 'disabled'
+        self.restore['state'] = 'disabled'
+
+        pages = max(1, -(-len(self.cur_folder) // PAGE_SIZE))
+        self.page_label['text'] = f'{self.page + 1}/{pages}'
+        self.prev_page['state'] = 'normal' if self.page > 0 else 'disabled'
+        self.next_page['state'] = 'normal' if self.page < pages - 1 else 'disabled'
 
-        for ind, folder in enumerate(self.cur_folder):
+        visible = self.cur_folder[self.page * PAGE_SIZE:(self.page + 1) * PAGE_SIZE]
+        for ind, folder in enumerate(visible):
             if folder.folder:
-                folder_icon = ttk.Label(self.dialog_frm, text= folder.folder.get().name, padding=15, border=5, relief='solid')           
-                folder_icon['width'] = max(10, len(folder.folder.get().name))
-                # print((ind // 4) + 1, ind % 4)
-                folder_icon.grid(row= (ind // 4) + 1, column = ind % 4, padx=5, pady=5)
+                folder_icon = ttk.Label(self.dialog_frm, text= folder.name, padding=15, border=5, relief='solid')           
+                folder_icon['width'] = max(10, len(folder.name))
+                folder_icon.grid(row= (ind // COLUMNS) + 1, column = ind % COLUMNS, padx=5, pady=5)
                 folder_icon.bind("<Button-1>", lambda e, folder = folder: self.highlight(e, folder))
                 folder_icon.bind("<Double-Button-1>", lambda e, folder = folder: self.nav_forward(folder))
+                self.folder_icons.append(folder_icon)
+
+        self.listing_cache.prefetch(folder.folder.object_id for folder in visible if folder.folder)
 
     def highlight(self, e, folder: BoxFolder):
         '''
@@ -116,6 +184,7 @@ class BoxNav():
         if color != '':
             pressed['background'] = ''
             self.select['state'] = 'disabled'
+            self.restore['state'] = 'disabled'
             self.highlighted = None
         else:
             if isinstance(self.highlighted, ttk.Widget) and self.highlighted.winfo_exists() == 1:
@@ -128,6 +197,8 @@ class BoxNav():
             self.highlighted = pressed
             self.select['state'] = 'normal'
             self.select['command'] = lambda: self.set_backup_dir(folder)
+            self.restore['state'] = 'normal'
+            self.restore['command'] = lambda: self.restore_selected(folder)
 
     def set_backup_dir(self, curfolder: BoxFolder):
         '''
@@ -135,8 +206,16 @@ class BoxNav():
         '''
         if self.backup.backup_folder != curfolder.folder:
             self.backup.backup_folder = curfolder.folder
-            self.selected_backup_folder['text'] = self.backup.backup_folder.get().name
+            self.selected_backup_folder['text'] = curfolder.name
 
         self.highlighted = None
         self.dialog.destroy()
 
+    def restore_selected(self, curfolder: BoxFolder):
+        '''
+        Closes the dialog and hands the selected folder over to be restored.
+        '''
+        self.highlighted = None
+        self.dialog.destroy()
+        self.on_restore(curfolder)
+
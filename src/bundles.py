@@ -0,0 +1,211 @@
+from __future__ import annotations
+from listing import RemoteItem
+from typing import Optional, TYPE_CHECKING
+import hashlib, io, json, os, tarfile
+
+if TYPE_CHECKING:
+    from backup import Backup
+    from planner import PlanEntry
+
+'''
+Optional bundling of small files: in a directory of many tiny files, the files below the size threshold of the backup
+root (bundle_below in filters.json) are packed into a few tar bundles uploaded next to the other files, instead of
+costing one upload (and its latency) each.
+Every such box folder also gets a manifest listing each bundled file with its size, mtime, sha1, bundle and offset
+in the bundle, so a file can be found in (and read from) its bundle, and an incremental run can tell what changed
+without downloading the bundles: only the bundles whose members changed are built and uploaded again.
+A small file already backed up on its own stays a separate file, so no file is ever both on box and in a bundle
+(once bundling is turned off, restore prefers the separate files to the abandoned bundles).
+'''
+
+BUNDLE_PREFIX = '.box-backup-bundle-'
+MANIFEST_NAME = '.box-backup-manifest.json'
+BUNDLE_MAX_BYTES = 16 * 1024 * 1024
+
+def bundle_name(number: int) -> str:
+    return f'{BUNDLE_PREFIX}{number:04d}.tar'
+
+class DirectoryBundles():
+    '''
+    The bundling plan of a single directory:
+     - path -> the local directory
+     - members -> the bundled files of each bundle, as (name, stat) sorted by name
+     - previous -> the manifest found on box (or an empty one)
+     - changed -> the bundles to build and upload, the others are kept as they are on box
+    '''
+    path: str
+    members: dict[str, list[tuple[str, os.stat_result]]]
+    previous: dict
+    changed: list[str]
+
+    def __init__(self, path: str, previous: dict) -> None:
+        self.path = path
+        self.previous = previous
+        self.members = {}
+        self.changed = []
+
+    def size(self) -> int:
+        return sum(stat.st_size for bundle in self.changed for _, stat in self.members[bundle])
+
+class Bundler():
+    '''
+    Plans, builds and uploads the bundles of small files (see the module docstring).
+     - max_bytes -> a new bundle is started once a bundle holds this many bytes (bundles stay below the size of a
+       chunked upload and are built in memory)
+    The manifests last uploaded are kept locally as well, so planning only downloads one when it changed on box.
+    '''
+    backup: Backup
+    max_bytes: int
+
+    def __init__(self, backup: Backup, cache_dir: str, max_bytes: int = BUNDLE_MAX_BYTES) -> None:
+        self.backup = backup
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, folder_id: str) -> str:
+        return os.path.join(self.cache_dir, f'{folder_id}.json')
+
+    def load_manifest(self, folder_id: Optional[str], manifest_item: Optional[RemoteItem], offline: bool = False) -> dict:
+        '''
+        The manifest of a box folder: the local copy if it matches the one on box (or if offline), else downloaded.
+        '''
+        if folder_id is None or manifest_item is None:
+            return {}
+        try:
+            with open(self.cache_path(folder_id), 'rb') as cached:
+                content = cached.read()
+            if offline or hashlib.sha1(content).hexdigest() == manifest_item.sha1:
+                return json.loads(content)
+        except (OSError, ValueError):
+            if offline:
+                return {}
+        with self.backup.metrics.timed('download manifest'):
+            content = self.backup.client.file(manifest_item.id).content()
+        self.save_manifest(folder_id, content)
+        return json.loads(content)
+
+    def save_manifest(self, folder_id: str, content: bytes) -> None:
+        temp_path = self.cache_path(folder_id) + '.tmp'
+        with open(temp_path, 'wb') as cached:
+            cached.write(content)
+        os.replace(temp_path, self.cache_path(folder_id))
+
+    def plan(self, path: str, files: list[tuple[str, os.stat_result]], previous: dict) -> Optional[DirectoryBundles]:
+        '''
+        Assigns the small files of a directory to bundles and decides which bundles changed. Files keep the bundle
+        they were in and new files go in the last bundle with room left (or a new one), so adding or removing a
+        file only changes one bundle. A file with a new mtime but the same sha1 only changes the manifest.
+        Returns None when neither the bundles nor the manifest changed.
+        '''
+        plan = DirectoryBundles(path, previous)
+        recorded = {member['path']: (name, member)
+                    for name, bundle in previous.get('bundles', {}).items() for member in bundle['members']}
+        changed = set()
+        touched = False
+        new_files = []
+        for name, stat in sorted(files):
+            if name not in recorded:
+                new_files.append((name, stat))
+                continue
+            bundle, member = recorded.pop(name)
+            plan.members.setdefault(bundle, []).append((name, stat))
+            if member['size'] != stat.st_size:
+                changed.add(bundle)
+            elif member['mtime'] != stat.st_mtime:
+                touched = True
+                if self.backup.sha1_hash(os.path.join(path, name)) != member['sha1']:
+                    changed.add(bundle)
+        for bundle, _ in recorded.values():
+            # removed files
+            changed.add(bundle)
+
+        names = sorted(previous.get('bundles', {}))
+        number = int(names[-1][len(BUNDLE_PREFIX):-4]) if names else 0
+        current = names[-1] if names else bundle_name(number)
+        filled = sum(stat.st_size for _, stat in plan.members.get(current, []))
+        for name, stat in new_files:
+            if filled and filled + stat.st_size > self.max_bytes:
+                number += 1
+                current, filled = bundle_name(number), 0
+            plan.members.setdefault(current, []).append((name, stat))
+            filled += stat.st_size
+            changed.add(current)
+
+        plan.members = {bundle: sorted(members) for bundle, members in plan.members.items() if members}
+        plan.changed = sorted(bundle for bundle in changed if bundle in plan.members)
+        if not changed and not touched:
+            return None
+        return plan
+
+    def build(self, plan: DirectoryBundles, bundle: str) -> tuple[bytes, list[dict]]:
+        '''
+        Builds a bundle in memory and returns it with the manifest records of its members.
+        '''
+        buffer = io.BytesIO()
+        members = []
+        with tarfile.open(fileobj=buffer, mode='w', format=tarfile.PAX_FORMAT) as tar:
+            for name, _ in plan.members[bundle]:
+                file_path = os.path.join(plan.path, name)
+                try:
+                    stat = os.stat(file_path)
+                    with open(file_path, 'rb') as file:
+                        content = file.read()
+                except OSError:
+                    continue
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mtime = int(stat.st_mtime)
+                info.mode = stat.st_mode & 0o777
+                tar.addfile(info, io.BytesIO(content))
+                # the data ends the member, padded to whole blocks
+                offset = tar.offset - -(-len(content) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                members.append({'path': name, 'size': len(content), 'mtime': stat.st_mtime,
+                                'sha1': hashlib.sha1(content).hexdigest(), 'offset': offset})
+        return buffer.getvalue(), members
+
+    def put(self, folder_id: str, name: str, content: bytes) -> RemoteItem:
+        '''
+        Uploads content as the file name of a box folder, as a new version if the file is already there.
+        '''
+        from boxsdk.exception import BoxAPIException
+        sha1 = hashlib.sha1(content).hexdigest()
+        existing = self.backup.index.child(folder_id, name, 'file')
+        if existing is not None:
+            try:
+                sent = self.backup.send_content(content, sha1, name, box_file=self.backup.client.file(existing.id))
+                return self.backup.index.record(sent, folder_id)
+            except BoxAPIException as e:
+                if e.status != 404:
+                    raise
+                self.backup.index.remove(existing.id)
+        sent = self.backup.send_content(content, sha1, name, box_folder=self.backup.client.folder(folder_id))
+        return self.backup.index.record(sent, folder_id)
+
+    def upload(self, entry: PlanEntry) -> None:
+        '''
+        Builds and uploads the changed bundles of a planned directory, then its manifest (last, so an interrupted
+        run leaves the previous manifest in place and the bundles are planned again).
+        '''
+        plan = entry.bundle
+        folder_id = entry.folder_id()
+        bundles = {name: bundle for name, bundle in plan.previous.get('bundles', {}).items() if name in plan.members}
+        for name in plan.changed:
+            content, members = self.build(plan, name)
+            with self.backup.metrics.timed('bundle', len(content)):
+                item = self.put(folder_id, name, content)
+            bundles[name] = {'sha1': item.sha1, 'size': len(content), 'members': members}
+            if self.backup.progress is not None:
+                self.backup.progress.file_done(os.path.join(plan.path, name), len(content), f'bundled {len(members)} files')
+
+        for name, bundle in bundles.items():
+            if name not in plan.changed:
+                # unchanged bundles, with the mtimes of the files touched without changing
+                stats = dict(plan.members[name])
+                for member in bundle['members']:
+                    if member['path'] in stats:
+                        member['mtime'] = stats[member['path']].st_mtime
+        content = json.dumps({'version': 1, 'bundles': dict(sorted(bundles.items()))}, indent=1).encode()
+        with self.backup.metrics.timed('bundle', len(content)):
+            self.put(folder_id, MANIFEST_NAME, content)
+        self.save_manifest(folder_id, content)
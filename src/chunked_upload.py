@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import collections, contextvars, hashlib, json, os, threading, time
+
+CHUNKED_UPLOAD_THRESHOLD = 50 * 1024 * 1024
+
+class ResumableUpload():
+    '''
+    Uploads large files through box chunked upload sessions.
+     - The file is read once, in order: each part is hashed into the sha1 of the whole file as it is read and then
+       uploaded in parallel by part_workers threads (with at most twice as many parts held in memory).
+     - The session state (session id, uploaded parts, file sha1) is saved in state_dir after every part, so an
+       interrupted upload continues from the parts already committed, even after the app restarts.
+    Box only keeps the parts of a session for a limited time; an expired session is started over.
+    '''
+    client: object
+    state_dir: str
+    part_workers: int
+
+    def __init__(self, client, state_dir: str, part_workers: int = 4, bandwidth=None) -> None:
+        '''
+        - client -> authenticated boxsdk client
+        - state_dir -> directory holding one json state file per file being uploaded
+        - part_workers -> number of parts uploaded at once
+        - bandwidth -> optional BandwidthBudget the parts are sent within
+        '''
+        self.client = client
+        self.state_dir = state_dir
+        self.part_workers = part_workers
+        self.bandwidth = bandwidth
+        os.makedirs(state_dir, exist_ok=True)
+
+    def state_path(self, path: str) -> str:
+        return os.path.join(self.state_dir, hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + '.json')
+
+    def load_state(self, path: str, stat: os.stat_result, target: dict) -> Optional[dict]:
+        '''
+        Returns the saved state of an unfinished upload of path, if the file and destination are unchanged since.
+        '''
+        try:
+            with open(self.state_path(path), 'r') as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return None
+        if state.get('size') != stat.st_size or state.get('mtime_ns') != stat.st_mtime_ns or state.get('target') != target:
+            return None
+        return state
+
+    def save_state(self, path: str, state: dict) -> None:
+        temp_path = self.state_path(path) + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temp_path, self.state_path(path))
+
+    def clear_state(self, path: str) -> None:
+        try:
+            os.remove(self.state_path(path))
+        except FileNotFoundError:
+            pass
+
+    def open_session(self, path: str, stat: os.stat_result, target: dict, sha1: Optional[str]) -> tuple:
+        '''
+        Resumes the saved upload session of path if box still has it, otherwise creates a new one.
+        Returns the session and its state.
+        '''
+        from boxsdk.exception import BoxAPIException
+        state = self.load_state(path, stat, target)
+        if state:
+            try:
+                session = self.client.upload_session(state['session_id']).get()
+                return session, state
+            except BoxAPIException as e:
+                if e.status not in (404, 410):
+                    raise
+
+        if 'file_id' in target:
+            session = self.client.file(target['file_id']).create_upload_session(stat.st_size)
+        else:
+            session = self.client.folder(target['folder_id']).create_upload_session(stat.st_size, os.path.basename(path))
+        state = {
+            'session_id': session.object_id,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'target': target,
+            'part_size': session.part_size,
+            'sha1': sha1,
+            'parts': {},
+        }
+        self.save_state(path, state)
+        return session, state
+
+    def upload(self, path: str, sha1: Optional[str] = None, folder_id: Optional[str] = None,
+               file_id: Optional[str] = None):
+        '''
+        Uploads path as a new file in folder_id, or as a new version of file_id, and returns the boxsdk File.
+        sha1 is the hex sha1 of the whole file if already known; otherwise it is computed from the parts as they are
+        read for the upload. Box checks it when the session is committed.
+        '''
+        stat = os.stat(path)
+        target = {'file_id': file_id} if file_id else {'folder_id': folder_id}
+        session, state = self.open_session(path, stat, target, sha1)
+        sha1 = sha1 or state['sha1']
+        hasher = None if sha1 else hashlib.sha1()
+        part_size = state['part_size']
+        lock = threading.Lock()
+
+        def upload_part(offset: int, part_bytes: bytes) -> None:
+            if self.bandwidth is not None:
+                self.bandwidth.consume(len(part_bytes))
+            part = session.upload_part_bytes(part_bytes, offset, stat.st_size)
+            with lock:
+                state['parts'][str(offset)] = part
+                self.save_state(path, state)
+
+        with open(path, 'rb') as file, ThreadPoolExecutor(max_workers=self.part_workers) as executor:
+            in_flight = collections.deque()
+            for offset in range(0, stat.st_size, part_size):
+                uploaded_part = str(offset) in state['parts']
+                if uploaded_part and hasher is None:
+                    continue
+                file.seek(offset)
+                part_bytes = file.read(part_size)
+                if hasher is not None:
+                    hasher.update(part_bytes)
+                if not uploaded_part:
+                    in_flight.append(executor.submit(contextvars.copy_context().run, upload_part, offset, part_bytes))
+                    if len(in_flight) >= 2 * self.part_workers:
+                        in_flight.popleft().result()
+            for future in in_flight:
+                future.result()
+
+        if hasher is not None:
+            sha1 = hasher.hexdigest()
+            with lock:
+                state['sha1'] = sha1
+                self.save_state(path, state)
+        parts = [state['parts'][key] for key in sorted(state['parts'], key=int)]
+        uploaded = None
+        for attempt in range(10):
+            uploaded = session.commit(bytes.fromhex(sha1), parts=parts)
+            if uploaded is not None:
+                break
+            time.sleep(2 ** attempt)
+        if uploaded is None:
+            raise TimeoutError(f'Box is still processing the upload of {path}, it will be resumed on the next run.')
+        self.clear_state(path)
+        return uploaded
@@ -0,0 +1,179 @@
+from listing import RemoteItem
+from remote_index import RemoteIndex
+from typing import Optional
+
+REMOVING_EVENTS = {'ITEM_TRASH', 'ITEM_DELETE'}
+CHANGING_EVENTS = {'ITEM_CREATE', 'ITEM_UPLOAD', 'ITEM_COPY', 'ITEM_MOVE', 'ITEM_RENAME', 'ITEM_UNDELETE_VIA_TRASH'}
+
+def field(obj, name: str, default=None):
+    '''
+    Reads a field of an event or event source, which are boxsdk objects from box and plain dicts from a stand-in source.
+    '''
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+class BoxEventSource():
+    '''
+    Event source reading the 'changes' events stream of the authenticated box user.
+    '''
+    def __init__(self, client) -> None:
+        self.client = client
+
+    def latest_position(self) -> str:
+        return str(self.client.events().get_latest_stream_position(stream_type='changes'))
+
+    def get_events(self, stream_position: str, limit: int) -> dict:
+        '''
+        Returns {'entries': [...], 'next_stream_position': ...} for the events after stream_position.
+        '''
+        return self.client.events().get_events(limit=limit, stream_position=stream_position, stream_type='changes')
+
+class ListEventSource():
+    '''
+    Local stand-in event source replaying a list of event dicts, where the stream position is the index in the list.
+    Lets the sync be exercised without box.
+    '''
+    def __init__(self, events: Optional[list[dict]] = None) -> None:
+        self.events = events or []
+
+    def latest_position(self) -> str:
+        return str(len(self.events))
+
+    def get_events(self, stream_position: str, limit: int) -> dict:
+        from boxsdk.exception import BoxAPIException
+        start = int(stream_position)
+        if start > len(self.events):
+            raise BoxAPIException(400, code='invalid_stream_position')
+        entries = self.events[start:start + limit]
+        return {'entries': entries, 'next_stream_position': str(start + len(entries))}
+
+class EventSync():
+    '''
+    Keeps the remote index of the BACKUPFOLDERID subtree up to date by applying only the box events since the last
+    sync. The events stream_position is stored in the index; the subtree is only re-listed in full when there is no
+    stored position yet or box no longer accepts it (expired).
+    '''
+    index: RemoteIndex
+    source: object
+    root_id: str
+    page_size: int
+
+    def __init__(self, index: RemoteIndex, source, root_id: str, client=None, page_size: int = 500) -> None:
+        '''
+        - index -> the remote index to update
+        - source -> where the events come from (BoxEventSource or a stand-in with the same methods)
+        - root_id -> id of the box backup root; events outside of it are ignored
+        - client -> boxsdk client used to re-list the subtree when a full refresh is needed
+        '''
+        self.index = index
+        self.source = source
+        self.root_id = root_id
+        self.client = client
+        self.page_size = page_size
+        self.unlisted_folders: list[str] = []
+
+    @property
+    def position_key(self) -> str:
+        return f'stream_position:{self.root_id}'
+
+    def sync(self) -> int:
+        '''
+        Applies the events since the stored stream position to the index. Returns the number of events applied,
+        or -1 if the subtree had to be re-listed in full.
+        '''
+        from boxsdk.exception import BoxAPIException
+        position = self.index.get_meta(self.position_key)
+        if position is None:
+            return self.full_refresh()
+
+        applied = 0
+        while True:
+            try:
+                page = self.source.get_events(position, self.page_size)
+            except BoxAPIException as e:
+                if e.status in (400, 404, 410):
+                    return self.full_refresh()
+                raise
+            entries = page['entries']
+            for event in entries:
+                applied += self.apply(event)
+            self.list_new_folders()
+            position = str(page['next_stream_position'])
+            self.index.set_meta(self.position_key, position)
+            if not entries:
+                return applied
+
+    def full_refresh(self) -> int:
+        '''
+        Re-lists the whole subtree. The stream position is taken before listing so no change is missed.
+        '''
+        position = self.source.latest_position()
+        if self.client is not None:
+            if self.index.is_listed(self.root_id):
+                self.index.sync_tree(self.client, self.root_id, force=True)
+            else:
+                self.index.ensure_tree(self.client, self.root_id)
+        self.index.set_meta(self.position_key, position)
+        return -1
+
+    def in_subtree(self, source) -> Optional[str]:
+        '''
+        Returns the parent id of an event source if it lies under the backup root, otherwise None.
+        '''
+        parent = field(source, 'parent')
+        parent_id = field(parent, 'id') if parent else None
+        if parent_id is None:
+            return None
+        path_collection = field(source, 'path_collection') or {}
+        path_ids = [field(entry, 'id') for entry in field(path_collection, 'entries', [])]
+        if self.root_id in path_ids or self.index.is_under(parent_id, self.root_id):
+            return parent_id
+        return None
+
+    def apply(self, event) -> int:
+        '''
+        Applies a single event to the index. Returns 1 if the index changed, otherwise 0.
+        A folder created empty is known to have no children; a folder copied, moved or restored into the subtree
+        is queued to be listed.
+        '''
+        event_type = field(event, 'event_type')
+        source = field(event, 'source')
+        if source is None or field(source, 'type') not in ('file', 'folder'):
+            return 0
+        item_id = field(source, 'id')
+
+        if event_type in REMOVING_EVENTS:
+            if self.index.get(item_id):
+                self.index.remove(item_id)
+                return 1
+            return 0
+
+        if event_type in CHANGING_EVENTS:
+            parent_id = self.in_subtree(source)
+            if parent_id is None:
+                if self.index.get(item_id):
+                    self.index.remove(item_id)
+                    return 1
+                return 0
+            known = self.index.get(item_id)
+            if known and known.parent_id != parent_id:
+                self.index.remove(item_id)
+            self.index.upsert(RemoteItem(item_id, parent_id, field(source, 'name'), field(source, 'type'),
+                                         field(source, 'sha1'), field(source, 'size'), field(source, 'etag')))
+            if field(source, 'type') == 'folder' and not self.index.is_listed(item_id):
+                if event_type == 'ITEM_CREATE':
+                    self.index.mark_listed(item_id, field(source, 'etag'))
+                else:
+                    self.unlisted_folders.append(item_id)
+            return 1
+        return 0
+
+    def list_new_folders(self) -> None:
+        '''
+        Lists the folders that entered the subtree with unknown contents.
+        '''
+        if self.client is not None:
+            for folder_id in self.unlisted_folders:
+                self.index.sync_tree(self.client, folder_id)
+        self.unlisted_folders = []
@@ -0,0 +1,580 @@
+from typing import Optional, Iterator, Callable
+import collections, hashlib, itertools, json, os, random, threading, time
+
+'''
+In-process stand-in for the subset of the box API used by the app (Client, Folder, File, upload sessions and the
+events stream), so backups can be run, measured and compared without a box account or network:
+    box = FakeBox(root_id=backup.BACKUPFOLDERID, latency=0.05, rate_limit_rate=0.01)
+    backup.connect(FakeClient(box))
+Errors are raised as boxsdk BoxAPIException with the statuses, codes and headers box uses, so the retry, resume and
+fallback paths of the app run exactly as they would against box. Like the boxsdk Session, the fake retries the calls
+failing with a 429 or a 5xx before raising them.
+'''
+
+MiB = 1024 * 1024
+
+class FakeBox():
+    '''
+    State of the fake box account: the item tree, the file contents, upload sessions and the events stream.
+     - Contents are kept in memory, or in store_dir (along with the item tree, see save) so they survive restarts.
+     - Every call sleeps latency seconds (plus the transfer time at bandwidth bytes/s) and is counted in calls.
+     - rate_limit_rate of the calls fail with a 429 and a Retry-After header, failure_rate of them with a 500.
+     - inject schedules specific failures for the next calls of a kind.
+     - A failed call is retried up to max_retry_attempts times, after its Retry-After delay (429) or an exponential
+       backoff (5xx) as the boxsdk Session does, and only raised once the retries are used up.
+    '''
+    items: dict[str, dict]
+    calls: collections.Counter
+
+    def __init__(self, root_id: str = '0', root_name: str = 'All Files', store_dir: Optional[str] = None,
+                 latency: float = 0.0, bandwidth: float = 0.0, rate_limit_rate: float = 0.0, retry_after: int = 1,
+                 failure_rate: float = 0.0, part_size: int = 8 * MiB, quota: Optional[int] = None,
+                 seed: Optional[int] = None, on_call: Optional[Callable[[str, float, int, bool], None]] = None,
+                 max_retry_attempts: Optional[int] = None, retry_base_interval: float = 1.0,
+                 on_throttled: Optional[Callable[[Optional[float]], None]] = None) -> None:
+        '''
+        - root_id/root_name -> the folder every other item lives under (BACKUPFOLDERID for the app)
+        - store_dir -> directory keeping the contents and the item tree, in memory if None
+        - latency -> seconds added to every call
+        - bandwidth -> bytes/s of uploads and downloads, unlimited if 0
+        - rate_limit_rate -> probability of a call failing with 429 Too Many Requests
+        - retry_after -> seconds sent in the Retry-After header of the 429s
+        - failure_rate -> probability of a call failing with 500 Internal Server Error
+        - part_size -> part size of chunked upload sessions
+        - quota -> storage limit in bytes, unlimited if None
+        - seed -> seed of the injected failures, for repeatable runs
+        - on_call -> called with the kind, seconds, bytes and failure of every call (e.g. RunMetrics.box_call)
+        - max_retry_attempts -> retries of a failed call (API.MAX_RETRY_ATTEMPTS of boxsdk by default)
+        - retry_base_interval -> seconds of the first backoff of a 5xx, doubled at every attempt
+        - on_throttled -> called with the Retry-After delay of every 429, as the app's network layer does
+          (e.g. UploadPool.throttled)
+        '''
+        self.store_dir = store_dir
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.failure_rate = failure_rate
+        self.part_size = part_size
+        self.quota = quota
+        self.random = random.Random(seed)
+        self.on_call = on_call
+        if max_retry_attempts is None:
+            from boxsdk.config import API
+            max_retry_attempts = API.MAX_RETRY_ATTEMPTS
+        self.max_retry_attempts = max_retry_attempts
+        self.retry_base_interval = retry_base_interval
+        self.on_throttled = on_throttled
+        self.lock = threading.RLock()
+        self.calls = collections.Counter()
+        self.injected: dict[str, collections.deque] = collections.defaultdict(collections.deque)
+        self.items = {}
+        self.contents: dict[str, bytes] = {}
+        self.sessions: dict[str, dict] = {}
+        self.events: list[dict] = []
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+            self.load()
+        if root_id not in self.items:
+            self.items[root_id] = {'id': root_id, 'type': 'folder', 'name': root_name, 'parent_id': None, 'etag': '0'}
+        self.child_ids: dict[str, set] = collections.defaultdict(set)
+        for item in self.items.values():
+            self.child_ids[item['parent_id']].add(item['id'])
+        numeric_ids = [int(item_id) for item_id in self.items if item_id.isdigit()]
+        self.ids = itertools.count(max(numeric_ids + [100000]) + 1)
+
+    def items_path(self) -> str:
+        return os.path.join(self.store_dir, 'items.json')
+
+    def load(self) -> None:
+        try:
+            with open(self.items_path(), 'r') as items_file:
+                state = json.load(items_file)
+        except (OSError, ValueError):
+            return
+        self.items = state['items']
+        self.events = state['events']
+
+    def save(self) -> None:
+        '''
+        Writes the item tree and events stream to store_dir (the contents are written as they are uploaded).
+        '''
+        if not self.store_dir:
+            return
+        with self.lock:
+            temp_path = self.items_path() + '.tmp'
+            with open(temp_path, 'w') as items_file:
+                json.dump({'items': self.items, 'events': self.events}, items_file)
+            os.replace(temp_path, self.items_path())
+
+    def inject(self, kind: str, status: int, times: int = 1) -> None:
+        '''
+        Makes the next `times` calls of a kind (e.g. 'upload', 'get_items') fail with status. Retried failures only
+        reach the app after max_retry_attempts + 1 of them in a row.
+        '''
+        with self.lock:
+            self.injected[kind].extend([status] * times)
+
+    def call(self, kind: str, size: int = 0) -> None:
+        '''
+        Simulates a request to box through the boxsdk Session: the 429s and 5xx are retried up to
+        max_retry_attempts times, and the last failure is raised.
+        '''
+        from boxsdk.exception import BoxAPIException
+        attempt = 0
+        while True:
+            try:
+                return self.attempt(kind, size)
+            except BoxAPIException as e:
+                if (e.status != 429 and e.status < 500) or attempt >= self.max_retry_attempts:
+                    raise
+                if e.status == 429:
+                    delay = float(self.retry_after)
+                    if self.on_throttled:
+                        self.on_throttled(delay)
+                else:
+                    delay = 2 ** attempt * self.retry_base_interval * self.random.uniform(0.5, 1.5)
+                time.sleep(delay)
+                attempt += 1
+
+    def attempt(self, kind: str, size: int = 0) -> None:
+        '''
+        A single round trip to box: counts the call, waits for the latency and transfer time, and raises the
+        injected failures.
+        '''
+        from boxsdk.exception import BoxAPIException
+        with self.lock:
+            self.calls[kind] += 1
+            status = self.injected[kind].popleft() if self.injected[kind] else None
+            if status is None and self.rate_limit_rate and self.random.random() < self.rate_limit_rate:
+                status = 429
+            if status is None and self.failure_rate and self.random.random() < self.failure_rate:
+                status = 500
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+        if self.on_call:
+            self.on_call(kind, delay, size, status is not None)
+        if status == 429:
+            raise BoxAPIException(429, code='rate_limit_exceeded', message='Request rate limit exceeded, please try again later',
+                                  headers={'Retry-After': str(self.retry_after)})
+        if status is not None:
+            raise BoxAPIException(status, code='injected_failure', message=f'Injected failure of {kind}')
+
+    def error(self, status: int, code: str, message: str, context_info: Optional[dict] = None):
+        from boxsdk.exception import BoxAPIException
+        return BoxAPIException(status, code=code, message=message, context_info=context_info)
+
+    def new_id(self) -> str:
+        return str(next(self.ids))
+
+    def item(self, item_id: str, item_type: Optional[str] = None) -> dict:
+        with self.lock:
+            item = self.items.get(item_id)
+        if item is None or (item_type and item['type'] != item_type):
+            raise self.error(404, 'not_found', f'Not Found: {item_type or "item"} {item_id}')
+        return item
+
+    def children(self, folder_id: str) -> list[dict]:
+        '''
+        Children of a folder in box listing order: folders first, then by name.
+        '''
+        with self.lock:
+            children = [self.items[child_id] for child_id in self.child_ids.get(folder_id, ())]
+        return sorted(children, key=lambda item: (item['type'] != 'folder', item['name'].lower(), item['id']))
+
+    def child(self, folder_id: str, name: str) -> Optional[dict]:
+        for item in self.children(folder_id):
+            if item['name'] == name:
+                return item
+        return None
+
+    def path_ids(self, item_id: str) -> list[str]:
+        ids = []
+        parent_id = self.items[item_id]['parent_id']
+        while parent_id is not None:
+            ids.append(parent_id)
+            parent_id = self.items[parent_id]['parent_id']
+        return ids[::-1]
+
+    def used_bytes(self) -> int:
+        with self.lock:
+            return sum(item.get('size') or 0 for item in self.items.values() if item['type'] == 'file')
+
+    def fields(self, item: dict) -> dict:
+        '''
+        The fields box returns for an item.
+        '''
+        fields = {key: value for key, value in item.items() if key != 'parent_id'}
+        if item['parent_id'] is not None:
+            fields['parent'] = {'type': 'folder', 'id': item['parent_id']}
+        fields['path_collection'] = {'entries': [{'type': 'folder', 'id': folder_id} for folder_id in self.path_ids(item['id'])]}
+        if item['type'] == 'folder':
+            fields['item_collection'] = {'total_count': len(self.children(item['id']))}
+        return fields
+
+    def add_event(self, event_type: str, item: dict) -> None:
+        self.events.append({'event_type': event_type, 'source': self.fields(item)})
+
+    def read_content(self, file_id: str) -> bytes:
+        if self.store_dir:
+            with open(os.path.join(self.store_dir, file_id), 'rb') as content_file:
+                return content_file.read()
+        return self.contents[file_id]
+
+    def write_content(self, file_id: str, content: bytes) -> None:
+        if self.store_dir:
+            with open(os.path.join(self.store_dir, file_id), 'wb') as content_file:
+                content_file.write(content)
+        else:
+            self.contents[file_id] = content
+
+    def check_quota(self, size: int) -> None:
+        if self.quota is not None and self.used_bytes() + size > self.quota:
+            raise self.error(403, 'storage_limit_exceeded', 'Account storage limit reached')
+
+    def check_name(self, folder_id: str, name: str, conflicts_as_list: bool = False) -> None:
+        '''
+        Raises the 409 box returns when folder_id already has an item called name.
+        '''
+        existing = self.child(folder_id, name)
+        if existing:
+            conflicts = self.fields(existing)
+            raise self.error(409, 'item_name_in_use', 'Item with the same name already exists',
+                             {'conflicts': [conflicts] if conflicts_as_list else conflicts})
+
+    def check_sha1(self, content: bytes, sha1: Optional[str]) -> str:
+        content_sha1 = hashlib.sha1(content).hexdigest()
+        if sha1 and sha1 != content_sha1:
+            raise self.error(400, 'sha1_mismatch', 'The SHA1 of the uploaded content does not match the one sent')
+        return content_sha1
+
+    def add_item(self, item: dict) -> None:
+        self.items[item['id']] = item
+        self.child_ids[item['parent_id']].add(item['id'])
+
+    def create_file(self, folder_id: str, name: str, content: bytes, sha1: Optional[str] = None) -> dict:
+        with self.lock:
+            self.item(folder_id, 'folder')
+            self.check_name(folder_id, name)
+            self.check_quota(len(content))
+            item = {'id': self.new_id(), 'type': 'file', 'name': name, 'parent_id': folder_id,
+                    'sha1': self.check_sha1(content, sha1), 'size': len(content), 'etag': '0'}
+            self.write_content(item['id'], content)
+            self.add_item(item)
+            self.add_event('ITEM_UPLOAD', item)
+            return item
+
+    def update_file(self, file_id: str, content: bytes, sha1: Optional[str] = None, etag: Optional[str] = None) -> dict:
+        with self.lock:
+            item = self.item(file_id, 'file')
+            if etag is not None and etag != item['etag']:
+                raise self.error(412, 'precondition_failed', 'The resource has been modified')
+            self.check_quota(len(content) - item['size'])
+            item['sha1'] = self.check_sha1(content, sha1)
+            item['size'] = len(content)
+            item['etag'] = str(int(item['etag']) + 1)
+            self.write_content(file_id, content)
+            self.add_event('ITEM_UPLOAD', item)
+            return item
+
+    def create_folder(self, parent_id: str, name: str) -> dict:
+        with self.lock:
+            self.item(parent_id, 'folder')
+            self.check_name(parent_id, name, conflicts_as_list=True)
+            item = {'id': self.new_id(), 'type': 'folder', 'name': name, 'parent_id': parent_id, 'etag': '0'}
+            self.add_item(item)
+            self.add_event('ITEM_CREATE', item)
+            return item
+
+    def copy_file(self, file_id: str, folder_id: str, name: Optional[str] = None) -> dict:
+        with self.lock:
+            source = self.item(file_id, 'file')
+            self.item(folder_id, 'folder')
+            name = name or source['name']
+            self.check_name(folder_id, name)
+            self.check_quota(source['size'])
+            item = dict(source, id=self.new_id(), name=name, parent_id=folder_id, etag='0')
+            self.write_content(item['id'], self.read_content(file_id))
+            self.add_item(item)
+            self.add_event('ITEM_COPY', item)
+            return item
+
+    def delete(self, item_id: str) -> None:
+        with self.lock:
+            item = self.item(item_id)
+            self.add_event('ITEM_TRASH', item)
+            for child in self.children(item_id):
+                self.delete(child['id'])
+            del self.items[item_id]
+            self.child_ids[item['parent_id']].discard(item_id)
+            self.contents.pop(item_id, None)
+            if self.store_dir and item['type'] == 'file':
+                os.remove(os.path.join(self.store_dir, item_id))
+
+class FakeObject():
+    '''
+    Base of the fake boxsdk objects: the fields of the last response are attributes, like on boxsdk objects.
+    '''
+    object_type = ''
+
+    def __init__(self, box: FakeBox, object_id: str, fields: Optional[dict] = None) -> None:
+        self.box = box
+        self.object_id = object_id
+        if fields:
+            self.__dict__.update(fields)
+
+    def __repr__(self) -> str:
+        return f'<Fake {self.object_type.capitalize()} - {self.object_id}>'
+
+class FakeItem(FakeObject):
+    def get(self, fields: Optional[list[str]] = None, etag: Optional[str] = None) -> 'FakeItem':
+        self.box.call('get')
+        return as_object(self.box, self.box.item(self.object_id, self.object_type), fields)
+
+    def delete(self, recursive: bool = True, etag: Optional[str] = None) -> bool:
+        self.box.call('delete')
+        self.box.delete(self.object_id)
+        return True
+
+class FakeFolder(FakeItem):
+    object_type = 'folder'
+
+    def get_items(self, limit: Optional[int] = None, offset: int = 0, marker: Optional[str] = None,
+                  use_marker: bool = False, sort: Optional[str] = None, direction: Optional[str] = None,
+                  fields: Optional[list[str]] = None) -> Iterator[FakeItem]:
+        '''
+        Lists the folder page by page (one call per page of limit items), with offset or marker paging.
+        '''
+        limit = limit or 100
+        position = int(marker or 0) if use_marker else offset
+        while True:
+            self.box.call('get_items')
+            children = self.box.children(self.box.item(self.object_id, 'folder')['id'])
+            page = children[position:position + limit]
+            for child in page:
+                yield as_object(self.box, child, fields)
+            position += len(page)
+            if len(page) < limit or position >= len(children):
+                return
+
+    def create_subfolder(self, name: str) -> 'FakeFolder':
+        self.box.call('create_subfolder')
+        return as_object(self.box, self.box.create_folder(self.object_id, name))
+
+    def preflight_check(self, size: int, name: str) -> None:
+        self.box.call('preflight_check')
+        with self.box.lock:
+            self.box.item(self.object_id, 'folder')
+            self.box.check_name(self.object_id, name)
+            self.box.check_quota(size)
+        return None
+
+    def upload_stream(self, file_stream, file_name: str, file_description: Optional[str] = None,
+                      preflight_check: bool = False, preflight_expected_size: int = 0,
+                      upload_using_accelerator: bool = False, content_created_at: Optional[str] = None,
+                      content_modified_at: Optional[str] = None, additional_attributes: Optional[dict] = None,
+                      sha1: Optional[str] = None, etag: Optional[str] = None) -> 'FakeFile':
+        if preflight_check:
+            self.preflight_check(preflight_expected_size, file_name)
+        content = file_stream.read()
+        self.box.call('upload', len(content))
+        return as_object(self.box, self.box.create_file(self.object_id, file_name, content, sha1))
+
+    def upload(self, file_path: str, file_name: Optional[str] = None, file_description: Optional[str] = None,
+               preflight_check: bool = False, preflight_expected_size: int = 0,
+               upload_using_accelerator: bool = False, content_created_at: Optional[str] = None,
+               content_modified_at: Optional[str] = None, additional_attributes: Optional[dict] = None,
+               sha1: Optional[str] = None, etag: Optional[str] = None) -> 'FakeFile':
+        with open(file_path, 'rb') as file_stream:
+            return self.upload_stream(file_stream, file_name or os.path.basename(file_path), file_description,
+                                      preflight_check, preflight_expected_size, sha1=sha1)
+
+    def create_upload_session(self, file_size: int, file_name: str) -> 'FakeUploadSession':
+        self.box.call('create_upload_session')
+        with self.box.lock:
+            self.box.item(self.object_id, 'folder')
+            self.box.check_name(self.object_id, file_name)
+            self.box.check_quota(file_size)
+        return new_session(self.box, file_size, folder_id=self.object_id, file_name=file_name)
+
+class FakeFile(FakeItem):
+    object_type = 'file'
+
+    def preflight_check(self, size: int, name: Optional[str] = None) -> None:
+        self.box.call('preflight_check')
+        with self.box.lock:
+            item = self.box.item(self.object_id, 'file')
+            self.box.check_quota(size - item['size'])
+        return None
+
+    def update_contents_with_stream(self, file_stream, etag: Optional[str] = None, preflight_check: bool = False,
+                                    preflight_expected_size: int = 0, upload_using_accelerator: bool = False,
+                                    file_name: Optional[str] = None, content_modified_at: Optional[str] = None,
+                                    additional_attributes: Optional[dict] = None,
+                                    sha1: Optional[str] = None) -> 'FakeFile':
+        if preflight_check:
+            self.preflight_check(preflight_expected_size)
+        content = file_stream.read()
+        self.box.call('update_contents', len(content))
+        return as_object(self.box, self.box.update_file(self.object_id, content, sha1, etag))
+
+    def update_contents(self, file_path: str, etag: Optional[str] = None, preflight_check: bool = False,
+                        preflight_expected_size: int = 0, upload_using_accelerator: bool = False,
+                        file_name: Optional[str] = None, content_modified_at: Optional[str] = None,
+                        additional_attributes: Optional[dict] = None, sha1: Optional[str] = None) -> 'FakeFile':
+        with open(file_path, 'rb') as file_stream:
+            return self.update_contents_with_stream(file_stream, etag, preflight_check, preflight_expected_size,
+                                                    sha1=sha1)
+
+    def content(self, byte_range: Optional[tuple[int, int]] = None) -> bytes:
+        '''
+        The file contents, or the inclusive byte_range (start, end) of them.
+        '''
+        self.box.item(self.object_id, 'file')
+        content = self.box.read_content(self.object_id)
+        if byte_range:
+            start, end = byte_range
+            content = content[start:end + 1] if end is not None else content[start:]
+        self.box.call('download', len(content))
+        return content
+
+    def download_to(self, writeable_stream, byte_range: Optional[tuple[int, int]] = None) -> None:
+        writeable_stream.write(self.content(byte_range))
+
+    def copy(self, parent_folder: FakeFolder, name: Optional[str] = None) -> 'FakeFile':
+        self.box.call('copy')
+        return as_object(self.box, self.box.copy_file(self.object_id, parent_folder.object_id, name))
+
+    def create_upload_session(self, file_size: int, file_name: Optional[str] = None) -> 'FakeUploadSession':
+        self.box.call('create_upload_session')
+        with self.box.lock:
+            item = self.box.item(self.object_id, 'file')
+            self.box.check_quota(file_size - item['size'])
+        return new_session(self.box, file_size, file_id=self.object_id)
+
+class FakeUploadSession(FakeObject):
+    '''
+    Chunked upload session: parts are kept until the session is committed or aborted.
+    '''
+    object_type = 'upload_session'
+
+    def state(self) -> dict:
+        with self.box.lock:
+            state = self.box.sessions.get(self.object_id)
+        if state is None:
+            raise self.box.error(404, 'not_found', f'Not Found: upload session {self.object_id}')
+        return state
+
+    def get(self, fields: Optional[list[str]] = None) -> 'FakeUploadSession':
+        self.box.call('get_upload_session')
+        return FakeUploadSession(self.box, self.object_id, session_fields(self.state()))
+
+    def upload_part_bytes(self, part_bytes: bytes, offset: int, total_size: int,
+                          part_content_sha1: Optional[bytes] = None) -> dict:
+        self.box.call('upload_part', len(part_bytes))
+        state = self.state()
+        if total_size != state['file_size'] or (len(part_bytes) != state['part_size'] and offset + len(part_bytes) != total_size):
+            raise self.box.error(416, 'range_not_satisfiable', 'The part does not match the session')
+        part = {'part_id': hashlib.sha1(str(offset).encode()).hexdigest()[:8].upper(), 'offset': offset,
+                'size': len(part_bytes), 'sha1': hashlib.sha1(part_bytes).hexdigest()}
+        with self.box.lock:
+            state['parts'][offset] = (part, part_bytes)
+        return part
+
+    def get_parts(self, limit: Optional[int] = None, offset: Optional[int] = None) -> Iterator[dict]:
+        self.box.call('get_parts')
+        state = self.state()
+        with self.box.lock:
+            parts = [state['parts'][part_offset][0] for part_offset in sorted(state['parts'])]
+        return iter(parts)
+
+    def commit(self, content_sha1: bytes, parts: Optional[list[dict]] = None, file_attributes: Optional[dict] = None,
+               etag: Optional[str] = None) -> FakeFile:
+        self.box.call('commit')
+        state = self.state()
+        with self.box.lock:
+            content = b''.join(state['parts'][offset][1] for offset in sorted(state['parts']))
+            if len(content) != state['file_size']:
+                raise self.box.error(400, 'missing_parts', 'The session is missing parts')
+            sha1 = content_sha1.hex()
+            if state.get('file_id'):
+                item = self.box.update_file(state['file_id'], content, sha1, etag)
+            else:
+                item = self.box.create_file(state['folder_id'], state['file_name'], content, sha1)
+            del self.box.sessions[self.object_id]
+        return as_object(self.box, item)
+
+    def abort(self) -> bool:
+        self.box.call('abort')
+        with self.box.lock:
+            return self.box.sessions.pop(self.object_id, None) is not None
+
+def session_fields(state: dict) -> dict:
+    return {'id': state['id'], 'type': 'upload_session', 'part_size': state['part_size'],
+            'total_parts': -(-state['file_size'] // state['part_size']), 'num_parts_processed': len(state['parts'])}
+
+def new_session(box: FakeBox, file_size: int, folder_id: Optional[str] = None, file_id: Optional[str] = None,
+                file_name: Optional[str] = None) -> FakeUploadSession:
+    state = {'id': box.new_id(), 'file_size': file_size, 'part_size': box.part_size, 'folder_id': folder_id,
+             'file_id': file_id, 'file_name': file_name, 'parts': {}}
+    with box.lock:
+        box.sessions[state['id']] = state
+    return FakeUploadSession(box, state['id'], session_fields(state))
+
+def as_object(box: FakeBox, item: dict, fields: Optional[list[str]] = None) -> FakeItem:
+    '''
+    Builds the fake boxsdk object of an item, with only the requested fields (plus type and id) like box returns.
+    '''
+    with box.lock:
+        all_fields = box.fields(item)
+    if fields:
+        all_fields = {key: value for key, value in all_fields.items() if key in fields or key in ('type', 'id', 'etag')}
+    for key in ('parent',):
+        if isinstance(all_fields.get(key), dict):
+            all_fields[key] = FakeFolder(box, all_fields[key]['id'], all_fields[key])
+    object_class = FakeFolder if item['type'] == 'folder' else FakeFile
+    return object_class(box, item['id'], all_fields)
+
+class FakeEvents():
+    '''
+    The events stream of the fake account, where the stream position is the index of the next event.
+    '''
+    def __init__(self, box: FakeBox) -> None:
+        self.box = box
+
+    def get_latest_stream_position(self, stream_type: str = 'changes') -> str:
+        self.box.call('events')
+        with self.box.lock:
+            return str(len(self.box.events))
+
+    def get_events(self, limit: int = 100, stream_position: str = '0', stream_type: str = 'changes') -> dict:
+        self.box.call('events')
+        with self.box.lock:
+            start = len(self.box.events) if stream_position == 'now' else int(stream_position)
+            if start > len(self.box.events):
+                raise self.box.error(400, 'invalid_stream_position', 'Invalid stream position')
+            entries = self.box.events[start:start + limit]
+        return {'chunk_size': len(entries), 'entries': entries, 'next_stream_position': str(start + len(entries))}
+
+class FakeClient():
+    '''
+    Drop-in replacement of the boxsdk Client backed by a FakeBox.
+    '''
+    def __init__(self, box: Optional[FakeBox] = None) -> None:
+        self.box = box or FakeBox()
+
+    def folder(self, folder_id: str) -> FakeFolder:
+        return FakeFolder(self.box, folder_id)
+
+    def file(self, file_id: str) -> FakeFile:
+        return FakeFile(self.box, file_id)
+
+    def upload_session(self, session_id: str) -> FakeUploadSession:
+        return FakeUploadSession(self.box, session_id)
+
+    def events(self) -> FakeEvents:
+        return FakeEvents(self.box)
+
+    def root_folder(self) -> FakeFolder:
+        return self.folder('0')
@@ -0,0 +1,225 @@
+from typing import Optional, Iterable
+import json, os, re, threading, time
+
+'''
+Include/exclude rules of the backup roots, so caches, .git directories, temp files and large intermediate outputs are
+neither hashed nor uploaded. The rules are kept in filters.json next to the local state, keyed by root path
+('*' holds the rules of the roots without their own):
+    {"/home/me/project": {"exclude": [".git/", "__pycache__/", "*.tmp", "!keep.tmp", "/build/"],
+                          "include": [], "max_size": 1073741824, "max_age": null, "min_age": 60}}
+ - exclude -> gitignore-style patterns, the last matching one wins and a leading ! re-includes
+ - include -> if given, only files matching one of these patterns are backed up
+ - max_size -> files larger than this many bytes are skipped
+ - max_age/min_age -> files modified more than max_age seconds ago, or less than min_age seconds ago (e.g. still
+   being written), are skipped
+ - bundle_below -> files smaller than this many bytes are packed in per-folder bundles (see bundles.py)
+The bundle threshold is kept with the rules so every run of the root (app, command line or watcher) stores its small
+files the same way. Each rule set is compiled once into a few regular expressions and applied while walking, so excluded directories
+are never entered.
+'''
+
+def translate(pattern: str) -> str:
+    '''
+    Regular expression matching the paths (relative to the root, with / separators) matched by a gitignore pattern:
+    a pattern with a / in it is anchored at the root, otherwise it matches a name at any depth. * and ? do not match
+    /, and ** matches any number of directories.
+    '''
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        elif char == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            inner = pattern[i + 1:end]
+            if inner.startswith('!'):
+                inner = '^' + inner[1:]
+            regex += '[' + inner.replace('\\', '\\\\') + ']'
+            i = end
+        else:
+            regex += re.escape(char)
+        i += 1
+    return ('' if anchored else '(?:.*/)?') + regex
+
+def combine(regexes: list[str]) -> Optional[re.Pattern]:
+    return re.compile('^(?:' + '|'.join(regexes) + ')$') if regexes else None
+
+class PathFilter():
+    '''
+    The compiled rules of a backup root. Paths are given relative to the root, with / separators.
+    The exclude patterns are grouped in runs of the same polarity, each compiled into one regular expression for
+    files and one for directories (patterns ending with / only match directories), checked from the last run back.
+    '''
+    def __init__(self, exclude: Iterable[str] = (), include: Iterable[str] = (), max_size: Optional[int] = None,
+                 max_age: Optional[float] = None, min_age: Optional[float] = None,
+                 bundle_below: Optional[int] = None) -> None:
+        self.rules = {'exclude': list(exclude), 'include': list(include), 'max_size': max_size,
+                      'max_age': max_age, 'min_age': min_age, 'bundle_below': bundle_below}
+        self.bundle_below = bundle_below
+        self.max_size = max_size
+        self.max_age = max_age
+        self.min_age = min_age
+
+        self.runs = []
+        for line in self.rules['exclude']:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            pattern = line[1:] if negate else line
+            directory_only = pattern.endswith('/')
+            regex = translate(pattern.rstrip('/'))
+            if not self.runs or self.runs[-1][0] != negate:
+                self.runs.append((negate, [], []))
+            if not directory_only:
+                self.runs[-1][1].append(regex)
+            self.runs[-1][2].append(regex)
+        self.runs = [(negate, combine(file_regexes), combine(dir_regexes))
+                     for negate, file_regexes, dir_regexes in reversed(self.runs)]
+        self.include = combine([translate(pattern.rstrip('/')) for pattern in self.rules['include']
+                                if pattern.strip() and not pattern.startswith('#')])
+        self.active = bool(self.runs or self.include or max_size is not None or max_age is not None
+                           or min_age is not None)
+
+    def excluded(self, relative: str, is_dir: bool) -> bool:
+        '''
+        Whether the exclude patterns exclude the path itself (its parent directories are not checked).
+        '''
+        for negate, file_regex, dir_regex in self.runs:
+            regex = dir_regex if is_dir else file_regex
+            if regex is not None and regex.match(relative):
+                return not negate
+        return False
+
+    def skip_dir(self, relative: str) -> bool:
+        return bool(self.runs) and self.excluded(relative, True)
+
+    def skip_file(self, relative: str, stat: Optional[os.stat_result] = None) -> bool:
+        if not self.active:
+            return False
+        if self.excluded(relative, False):
+            return True
+        if self.include is not None and not self.include.match(relative):
+            return True
+        if stat is not None:
+            if self.max_size is not None and stat.st_size > self.max_size:
+                return True
+            if self.max_age is not None or self.min_age is not None:
+                age = time.time() - stat.st_mtime
+                if (self.max_age is not None and age > self.max_age) or (self.min_age is not None and age < self.min_age):
+                    return True
+        return False
+
+    def bundles(self, stat: os.stat_result) -> bool:
+        '''
+        Whether a file is small enough to be bundled.
+        '''
+        return self.bundle_below is not None and stat.st_size < self.bundle_below
+
+    def skip_path(self, relative: str, is_dir: bool, stat: Optional[os.stat_result] = None) -> bool:
+        '''
+        Whether a path found without walking down to it (e.g. a change reported by the watcher) is skipped, checking
+        its parent directories as well.
+        '''
+        if not self.active or relative in ('', '.'):
+            return False
+        parts = relative.split('/')
+        for depth in range(1, len(parts)):
+            if self.skip_dir('/'.join(parts[:depth])):
+                return True
+        return self.skip_dir(relative) if is_dir else self.skip_file(relative, stat)
+
+def relative_path(root: str, path: str) -> str:
+    relative = os.path.relpath(path, root)
+    return '' if relative == '.' else relative.replace(os.sep, '/')
+
+class FilterConfig():
+    '''
+    The rules of every backup root, read from a JSON file and compiled once per root.
+    '''
+    path: str
+    roots: dict[str, dict]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.compiled = {}
+        try:
+            with open(path, 'r') as config:
+                self.roots = json.load(config)
+        except FileNotFoundError:
+            self.roots = {}
+
+    def get(self, root: str) -> PathFilter:
+        '''
+        The compiled rules of root, or the default ones ('*') if root has none.
+        '''
+        key = root if root in self.roots else '*'
+        with self.lock:
+            if key not in self.compiled:
+                self.compiled[key] = PathFilter(**self.roots.get(key, {}))
+            return self.compiled[key]
+
+    def for_path(self, path: str, root: Optional[str] = None) -> tuple[str, PathFilter]:
+        '''
+        Returns the backup root whose rules apply to path (the deepest configured root containing it, else root
+        or path itself) along with the rules.
+        '''
+        path = os.path.abspath(path)
+        configured = [key for key in self.roots if key != '*' and (path == key or path.startswith(key.rstrip(os.sep) + os.sep))]
+        if configured:
+            root = max(configured, key=len)
+        return root or path, self.get(root or path)
+
+    def excludes(self, path: str, root: Optional[str] = None) -> bool:
+        '''
+        Whether path (below root, if given) is excluded by the rules that apply to it.
+        '''
+        root, path_filter = self.for_path(path, root)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return path_filter.skip_path(relative_path(root, path), os.path.isdir(path), stat)
+
+    def set(self, root: str, rules: Optional[dict]) -> None:
+        '''
+        Replaces (or removes, if rules is None) the rules of root and saves the file.
+        '''
+        root = root if root == '*' else os.path.abspath(root)
+        with self.lock:
+            if rules is None:
+                self.roots.pop(root, None)
+            else:
+                self.roots[root] = {key: value for key, value in PathFilter(**rules).rules.items() if value not in (None, [])}
+            self.compiled = {}
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as config:
+                json.dump(self.roots, config, indent=2)
+            os.replace(temp_path, self.path)
+
+    def set_bundle_below(self, root: str, bundle_below: Optional[int]) -> None:
+        '''
+        Sets (or removes, if None) the bundle threshold of root, keeping its other rules. A root without rules of its
+        own starts from the ones that applied to it.
+        '''
+        root = root if root == '*' else os.path.abspath(root)
+        rules = dict(self.roots.get(root) or self.get(root).rules)
+        rules['bundle_below'] = bundle_below
+        self.set(root, rules)
@@ -0,0 +1,221 @@
+from typing import Optional
+import argparse, hashlib, mmap, os, sqlite3, threading, time
+
+READ_BUFFER_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 8 * 1024 * 1024
+
+def compute_sha1(file_path: str) -> str:
+    '''
+    Generates a sha1 hash of a file using the bytes of a file.
+    Large files are memory-mapped and hashed without copying; smaller ones (or files that cannot be mapped, e.g. on
+    some network filesystems) are read into a reused READ_BUFFER_SIZE buffer, so each block is a single large read.
+    '''
+    sha1 = hashlib.sha1()
+
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            try:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mapped, 'madvise'):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    with memoryview(mapped) as view:
+                        sha1.update(view)
+                return sha1.hexdigest()
+            except (OSError, ValueError):
+                sha1 = hashlib.sha1()
+                file.seek(0)
+
+        buffer = bytearray(READ_BUFFER_SIZE)
+        with memoryview(buffer) as view:
+            while read := file.readinto(buffer):
+                sha1.update(view[:read])
+
+    return sha1.hexdigest()
+
+def read_and_hash(file_path: str) -> tuple[bytes, str]:
+    '''
+    Reads a whole file in a single pass and returns its contents with their sha1, so a file can be hashed and
+    uploaded from the same read.
+    '''
+    with open(file_path, 'rb') as file:
+        content = file.read()
+    return content, hashlib.sha1(content).hexdigest()
+
+class HashCache():
+    '''
+    Persistent cache of local file sha1 hashes keyed by (path, size, mtime_ns, inode).
+    A file whose stat matches the cached entry is known to be unchanged and is never read again.
+    The cache holds at most max_entries hashes, evicting the least recently used ones. The time of each hit is kept
+    in memory and written in batches (see flush), so a lookup of an unchanged file never writes to the database.
+    '''
+    db_path: str
+    max_entries: int
+    conn: sqlite3.Connection
+    lock: threading.RLock
+
+    def __init__(self, db_path: str, max_entries: int = 2_000_000, metrics=None) -> None:
+        '''
+        - db_path -> location of the SQLite database file
+        - max_entries -> maximum number of hashes kept before the least recently used are evicted
+        - metrics -> optional RunMetrics recording the files hashed (and bytes read) and the cache hits
+        '''
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.metrics = metrics
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._writes = 0
+        self._used = {}
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS hashes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    sha1 TEXT NOT NULL,
+                    used_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS hashes_used_at ON hashes (used_at);
+            ''')
+
+    def lookup(self, path: str, stat: Optional[os.stat_result] = None) -> Optional[str]:
+        '''
+        Returns the cached sha1 of path if the file has not changed since it was hashed, otherwise None.
+        '''
+        stat = stat or os.stat(path)
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT sha1 FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                (path, stat.st_size, stat.st_mtime_ns, stat.st_ino)).fetchone()
+            if row is None:
+                return None
+            self._used[path] = time.time()
+            if len(self._used) >= 1000:
+                self.flush()
+        return row[0]
+
+    def flush(self) -> None:
+        '''
+        Writes the times of the cache hits kept in memory (done every 1000 hits, before evicting and at the end of
+        a run).
+        '''
+        with self.lock:
+            if not self._used:
+                return
+            used, self._used = self._used, {}
+            with self.conn:
+                self.conn.executemany('UPDATE hashes SET used_at = ? WHERE path = ?',
+                                      [(used_at, path) for path, used_at in used.items()])
+
+    def store(self, path: str, sha1: str, stat: Optional[os.stat_result] = None) -> None:
+        '''
+        Saves the sha1 of path along with the stat it was computed for.
+        '''
+        stat = stat or os.stat(path)
+        with self.lock:
+            self._used.pop(path, None)
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+                                  (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, sha1, time.time()))
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self.evict()
+
+    def sha1(self, path: str) -> str:
+        '''
+        Returns the sha1 of path, only reading the file if it changed since it was last hashed.
+        '''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.lookup(path, stat)
+        if cached is not None:
+            if self.metrics:
+                self.metrics.observe('hash cache hit', 0.0)
+            return cached
+        if self.metrics:
+            with self.metrics.timed('hash', stat.st_size):
+                digest = compute_sha1(path)
+        else:
+            digest = compute_sha1(path)
+        self.store(path, digest, stat)
+        return digest
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+
+    def evict(self) -> int:
+        '''
+        Removes the least recently used hashes until the cache is back under max_entries. Returns the number removed.
+        '''
+        self.flush()
+        with self.lock, self.conn:
+            count = self.conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+            excess = count - self.max_entries
+            if excess <= 0:
+                return 0
+            self.conn.execute('''
+                DELETE FROM hashes WHERE path IN (SELECT path FROM hashes ORDER BY used_at LIMIT ?)
+            ''', (excess,))
+        return excess
+
+    def invalidate(self, path: Optional[str] = None) -> int:
+        '''
+        Drops the cached hashes of path and everything below it, or the whole cache if no path is given.
+        Returns the number of hashes dropped.
+        '''
+        with self.lock, self.conn:
+            if path is None:
+                return self.conn.execute('DELETE FROM hashes').rowcount
+            path = os.path.abspath(path)
+            prefix = path.rstrip(os.sep) + os.sep
+            return self.conn.execute(
+                'DELETE FROM hashes WHERE path = ? OR substr(path, 1, ?) = ?',
+                (path, len(prefix), prefix)).rowcount
+
+    def rebuild(self, root: str) -> int:
+        '''
+        Re-hashes every file under root (or root itself if it is a file) and stores the results.
+        Returns the number of files hashed.
+        '''
+        self.invalidate(root)
+        root = os.path.abspath(root)
+        if os.path.isfile(root):
+            self.sha1(root)
+            return 1
+
+        hashed = 0
+        for cur_root, _, files in os.walk(root):
+            for file in files:
+                try:
+                    self.sha1(os.path.join(cur_root, file))
+                    hashed += 1
+                except OSError:
+                    pass
+        return hashed
+
+
+if __name__ == "__main__":
+    '''
+    Maintenance commands for the hash cache:
+        - invalidate [PATH] -> drops the cached hashes below PATH (or all of them)
+        - rebuild PATH -> re-hashes everything below PATH
+    '''
+    parser = argparse.ArgumentParser(description='Manage the local sha1 hash cache.')
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hash_cache.db'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    invalidate = commands.add_parser('invalidate')
+    invalidate.add_argument('path', nargs='?')
+    rebuild = commands.add_parser('rebuild')
+    rebuild.add_argument('path')
+    args = parser.parse_args()
+
+    cache = HashCache(args.db)
+    if args.command == 'invalidate':
+        print(f'Invalidated {cache.invalidate(args.path)} hashes.')
+    else:
+        print(f'Hashed {cache.rebuild(args.path)} files.')
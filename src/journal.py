@@ -0,0 +1,173 @@
+from typing import Optional
+import json, os, threading, time
+
+class BackupJournal():
+    '''
+    Write-ahead journal of a backup run, stored as JSON lines.
+     - 'run' records the folders and files selected for the run
+     - 'plan' records an operation before it is sent to box
+     - 'done' records a completed operation with the id box returned for it ('root' once a selected folder/file
+       was fully backed up)
+     - 'failed' records a selected folder/file some files of which could not be backed up
+     - 'end' marks the run as finished, after which the journal is cleared
+    If the app dies partway, the next run reads the journal back and skips the work already done. The run only
+    finishes once every selected folder/file completed: failed ones stay in unfinished_run (and are carried into the
+    next run, even if other folders/files are selected) until they are backed up.
+    Every record is flushed to the OS immediately, and fsynced at most every sync_interval seconds.
+    '''
+    path: str
+    sync_interval: float
+    run: Optional[dict]
+    done: dict[tuple[str, str], dict]
+
+    def __init__(self, path: str, sync_interval: float = 1.0) -> None:
+        '''
+        - path -> location of the journal file
+        - sync_interval -> maximum number of seconds between fsyncs of the journal
+        - run -> the selections of the unfinished run found in the journal, if any
+        - done -> the completed operations of that run keyed by (operation, local path)
+        - failures -> the selected folders/files of that run that failed, with their error
+        '''
+        self.path = path
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.run = None
+        self.done = {}
+        self.failures = {}
+        self._last_sync = 0.0
+        self._load()
+        self._file = open(path, 'a')
+
+    def _load(self) -> None:
+        '''
+        Replays the journal file. A partially written last line (from a crash mid-write) is ignored.
+        '''
+        try:
+            with open(self.path, 'r') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if record['kind'] == 'run':
+                        self.run = {'folders': record['folders'], 'files': record['files']}
+                        self.done = {}
+                        self.failures = {path: error for path, error in self.failures.items()
+                                         if path in record['folders'] or path in record['files']}
+                    elif record['kind'] == 'done':
+                        self.done[(record['op'], record['path'])] = record
+                        if record['op'] == 'root':
+                            self.failures.pop(record['path'], None)
+                    elif record['kind'] == 'failed':
+                        self.failures[record['path']] = record['error']
+                        self.done.pop(('root', record['path']), None)
+                    elif record['kind'] == 'end':
+                        self.run = None
+                        self.done = {}
+                        self.failures = {}
+        except FileNotFoundError:
+            pass
+
+    def _write(self, record: dict, sync: bool = False) -> None:
+        with self.lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            if sync or time.monotonic() - self._last_sync >= self.sync_interval:
+                os.fsync(self._file.fileno())
+                self._last_sync = time.monotonic()
+
+    def unfinished_run(self) -> Optional[dict]:
+        '''
+        Returns the folders and files of the interrupted run that were not completed, or None if the last run finished.
+        '''
+        if self.run is None:
+            return None
+        return {
+            'folders': [path for path in self.run['folders'] if ('root', path) not in self.done],
+            'files': [path for path in self.run['files'] if ('root', path) not in self.done],
+        }
+
+    def start_run(self, folders: list[str], files: list[str]) -> None:
+        '''
+        Records the selections of a new run. Resuming the interrupted run keeps its completed operations.
+        The failed folders/files of the previous run are added to the selections of a new one.
+        '''
+        if self.run is not None:
+            folders = folders + [path for path in self.run['folders'] if path in self.failures and path not in folders]
+            files = files + [path for path in self.run['files'] if path in self.failures and path not in files]
+        if self.run is not None and self.run == {'folders': folders, 'files': files}:
+            return
+        resumed = self.unfinished_run()
+        if resumed is not None and set(folders) == set(resumed['folders']) and set(files) == set(resumed['files']):
+            return
+        with self.lock:
+            self.run = {'folders': folders, 'files': files}
+            self.done = {}
+            self.failures = {path: error for path, error in self.failures.items() if path in folders or path in files}
+        self._write({'kind': 'run', 'folders': folders, 'files': files, 'at': time.time()}, sync=True)
+
+    def planned(self, op: str, path: str, **details) -> None:
+        '''
+        Records an operation that is about to be sent to box.
+        '''
+        self._write({'kind': 'plan', 'op': op, 'path': path, **details})
+
+    def completed(self, op: str, path: str, remote_id: Optional[str] = None, **details) -> None:
+        '''
+        Records a completed operation along with the id of the box item it produced.
+        '''
+        record = {'kind': 'done', 'op': op, 'path': path, 'remote_id': remote_id, **details}
+        with self.lock:
+            self.done[(op, path)] = record
+            if op == 'root':
+                self.failures.pop(path, None)
+        self._write(record)
+
+    def failed(self, path: str, error: str) -> None:
+        '''
+        Records that a selected folder/file of the run was not fully backed up, so the run stays unfinished.
+        '''
+        with self.lock:
+            self.done.pop(('root', path), None)
+            self.failures[path] = error
+        self._write({'kind': 'failed', 'op': 'root', 'path': path, 'error': error}, sync=True)
+
+    def completed_file(self, path: str, remote_id: Optional[str]) -> None:
+        '''
+        Records that a file was backed up (or found up to date), along with the stat it was backed up at.
+        '''
+        stat = os.stat(path)
+        self.completed('file', path, remote_id, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    def is_done(self, op: str, path: str) -> Optional[dict]:
+        '''
+        Returns the record of a completed operation of the current run, or None.
+        '''
+        return self.done.get((op, path))
+
+    def file_is_done(self, path: str, stat: Optional[os.stat_result] = None) -> bool:
+        '''
+        Checks if a file was already backed up by the current run and has not changed since.
+        '''
+        record = self.done.get(('file', path))
+        if record is None:
+            return False
+        stat = stat or os.stat(path)
+        return record.get('size') == stat.st_size and record.get('mtime_ns') == stat.st_mtime_ns
+
+    def finish_run(self) -> bool:
+        '''
+        Marks the run as finished and clears the journal, unless some selected folder/file did not complete (the
+        journal is then kept for the next run). Returns whether the run was finished.
+        '''
+        unfinished = self.unfinished_run()
+        if unfinished is not None and (unfinished['folders'] or unfinished['files']):
+            return False
+        self._write({'kind': 'end', 'at': time.time()}, sync=True)
+        with self.lock:
+            self.run = None
+            self.done = {}
+            self.failures = {}
+            self._file.close()
+            self._file = open(self.path, 'w')
+        return True
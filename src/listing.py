@@ -0,0 +1,126 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple, Optional, Iterator, Iterable
+import threading, time
+
+class RemoteItem(NamedTuple):
+    '''
+    Compact record of a single item in a box folder listing.
+    '''
+    id: str
+    parent_id: Optional[str]
+    name: str
+    type: str
+    sha1: Optional[str]
+    size: Optional[int]
+    etag: Optional[str]
+
+LISTING_FIELDS = ['type', 'id', 'name', 'sha1', 'size', 'etag']
+PAGE_SIZE = 1000
+
+def to_record(box_item, parent_id: Optional[str]) -> RemoteItem:
+    '''
+    Converts a boxsdk File/Folder into a RemoteItem using only the fields already present on it (no API call).
+    '''
+    return RemoteItem(
+        box_item.object_id,
+        parent_id,
+        getattr(box_item, 'name', ''),
+        box_item.object_type,
+        getattr(box_item, 'sha1', None),
+        getattr(box_item, 'size', None),
+        getattr(box_item, 'etag', None),
+    )
+
+def list_folder(box_folder, item_type: Optional[str] = None, page_size: int = PAGE_SIZE) -> Iterator[RemoteItem]:
+    '''
+    Lists a box folder with a single paged request per page_size items:
+        - only the fields in LISTING_FIELDS are requested
+        - marker based pagination is used so very large folders are listed consistently
+        - items are yielded as RemoteItem records as each page arrives, so memory stays bounded by the page size
+    If item_type is given ('file' or 'folder'), only items of that type are yielded.
+    '''
+    parent_id = box_folder.object_id
+    for item in box_folder.get_items(limit=page_size, use_marker=True, fields=LISTING_FIELDS):
+        if item_type is None or item.type == item_type:
+            yield to_record(item, parent_id)
+
+class ListingCache():
+    '''
+    Per-session cache of box folder listings for browsing (BoxNav):
+     - a folder listed less than ttl seconds ago is answered from memory
+     - prefetch lists folders on background threads, so opening them afterwards is instant
+     - a folder being prefetched is waited for instead of listed a second time
+    Only items of item_type are kept ('folder' for browsing, None for everything).
+    '''
+    client: object
+    ttl: float
+    item_type: Optional[str]
+
+    def __init__(self, client, ttl: float = 300.0, prefetch_workers: int = 4, item_type: Optional[str] = 'folder') -> None:
+        self.client = client
+        self.ttl = ttl
+        self.item_type = item_type
+        self.lock = threading.Lock()
+        self.entries: dict[str, tuple[float, list[RemoteItem]]] = {}
+        self.pending: dict[str, Future] = {}
+        self.executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='listing-prefetch')
+
+    def fetch(self, folder_id: str) -> list[RemoteItem]:
+        '''
+        Lists the folder from box and caches the listing.
+        '''
+        try:
+            items = list(list_folder(self.client.folder(folder_id), self.item_type))
+            with self.lock:
+                self.entries[folder_id] = (time.monotonic(), items)
+            return items
+        finally:
+            with self.lock:
+                self.pending.pop(folder_id, None)
+
+    def cached(self, folder_id: str) -> Optional[list[RemoteItem]]:
+        with self.lock:
+            entry = self.entries.get(folder_id)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def get(self, folder_id: str) -> list[RemoteItem]:
+        '''
+        Returns the listing of a folder from the cache, from its prefetch in progress, or from box.
+        '''
+        items = self.cached(folder_id)
+        if items is not None:
+            return items
+        with self.lock:
+            future = self.pending.get(folder_id)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return self.fetch(folder_id)
+
+    def prefetch(self, folder_ids: Iterable[str]) -> None:
+        '''
+        Lists the folders not cached yet in the background.
+        '''
+        for folder_id in folder_ids:
+            if self.cached(folder_id) is not None:
+                continue
+            with self.lock:
+                if folder_id not in self.pending:
+                    self.pending[folder_id] = self.executor.submit(self.fetch, folder_id)
+
+    def invalidate(self, folder_id: Optional[str] = None) -> None:
+        '''
+        Drops the cached listing of a folder, or all of them.
+        '''
+        with self.lock:
+            if folder_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(folder_id, None)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,257 @@
+from typing import Optional, Callable
+import bisect, contextlib, contextvars, functools, json, os, re, threading, time
+
+'''
+Instrumentation of a backup run: every phase (walking, hashing, planning, uploads, box calls, ...) is recorded with
+its call count, errors, bytes and a latency histogram, in total and per top-level path being backed up.
+At the end of a run the numbers are written as a JSON report and as a Prometheus textfile (for the node_exporter
+textfile collector), and summarized for the log window.
+'''
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+class PhaseStats():
+    '''
+    Counters of a single phase:
+     - count -> number of times the phase ran
+     - errors -> number of times it raised
+     - bytes -> bytes transferred or hashed
+     - seconds -> total time spent
+     - buckets -> latency histogram, the number of runs that took at most each of LATENCY_BUCKETS seconds
+    '''
+    __slots__ = ('count', 'errors', 'bytes', 'seconds', 'buckets')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+        self.count += 1
+        self.errors += error
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def quantile(self, q: float) -> float:
+        '''
+        Upper bound of the latency bucket holding the q quantile.
+        '''
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 6),
+            'histogram': {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets)},
+        }
+
+class RunMetrics():
+    '''
+    Thread safe collector of the PhaseStats of a run, keyed by phase and by top-level path.
+    The top-level path is the one set with set_root by the thread backing it up. It is a context variable, so the
+    upload pool tasks submitted by that thread are attributed to it too, even while several roots are backed up at
+    once.
+    '''
+    phases: dict[str, PhaseStats]
+    roots: dict[str, dict[str, PhaseStats]]
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.root = contextvars.ContextVar('metrics_root', default=None)
+        self.start_run()
+
+    def start_run(self) -> None:
+        with self.lock:
+            self.phases = {}
+            self.roots = {}
+            self.started = time.time()
+
+    def set_root(self, root: Optional[str]) -> None:
+        self.root.set(root)
+
+    def observe(self, phase: str, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+        root = self.root.get()
+        with self.lock:
+            self.phases.setdefault(phase, PhaseStats()).observe(seconds, nbytes, error)
+            if root is not None:
+                self.roots.setdefault(root, {}).setdefault(phase, PhaseStats()).observe(seconds, nbytes, error)
+
+    @contextlib.contextmanager
+    def timed(self, phase: str, nbytes: int = 0):
+        '''
+        Records the time spent in the with block as one run of phase, as an error if the block raised.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(phase, time.perf_counter() - start, nbytes, error=True)
+            raise
+        self.observe(phase, time.perf_counter() - start, nbytes)
+
+    def box_call(self, kind: str, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+        '''
+        Records a call to box (or to a stand-in of box).
+        '''
+        self.observe(f'box {kind}', seconds, nbytes, error)
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                'started': self.started,
+                'duration': round(time.time() - self.started, 3),
+                'phases': {phase: stats.to_dict() for phase, stats in sorted(self.phases.items())},
+                'roots': {root: {phase: stats.to_dict() for phase, stats in sorted(phases.items())}
+                          for root, phases in self.roots.items()},
+            }
+
+    def summary(self) -> list[str]:
+        '''
+        One line per phase with its count, time, bytes and latency quantiles, slowest phases first.
+        '''
+        with self.lock:
+            phases = sorted(self.phases.items(), key=lambda phase: phase[1].seconds, reverse=True)
+            lines = []
+            for phase, stats in phases:
+                line = f'{phase}: {stats.count} x, {stats.seconds:.2f}s'
+                if stats.bytes:
+                    line += f', {stats.bytes / (1024 * 1024):.1f} MB'
+                if stats.errors:
+                    line += f', {stats.errors} errors'
+                line += f' (p50 <= {stats.quantile(0.5)}s, p99 <= {stats.quantile(0.99)}s)'
+                lines.append(line)
+        return lines
+
+    def prometheus(self) -> str:
+        '''
+        The metrics in the Prometheus text exposition format.
+        '''
+        lines = [
+            '# HELP box_backup_phase_seconds Time spent in each phase of the last backup run.',
+            '# TYPE box_backup_phase_seconds histogram',
+        ]
+        counters = [
+            ('box_backup_phase_bytes_total', 'Bytes transferred or hashed in each phase of the last backup run.', 'bytes'),
+            ('box_backup_phase_errors_total', 'Failures of each phase of the last backup run.', 'errors'),
+        ]
+        with self.lock:
+            series = [({'phase': phase}, stats) for phase, stats in sorted(self.phases.items())]
+            series += [({'phase': phase, 'root': root}, stats)
+                       for root, phases in sorted(self.roots.items()) for phase, stats in sorted(phases.items())]
+            for labels, stats in series:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append(f'box_backup_phase_seconds_bucket{prometheus_labels(labels, le=le)} {cumulative}')
+                lines.append(f'box_backup_phase_seconds_sum{prometheus_labels(labels)} {stats.seconds}')
+                lines.append(f'box_backup_phase_seconds_count{prometheus_labels(labels)} {stats.count}')
+            for name, help, attribute in counters:
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+                lines += [f'{name}{prometheus_labels(labels)} {getattr(stats, attribute)}' for labels, stats in series]
+            lines += [
+                '# HELP box_backup_last_run_timestamp_seconds Start time of the last backup run.',
+                '# TYPE box_backup_last_run_timestamp_seconds gauge',
+                f'box_backup_last_run_timestamp_seconds {self.started}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path: str, prometheus_path: str) -> None:
+        '''
+        Writes the JSON report and the Prometheus textfile, each replaced atomically so readers never see half a file.
+        '''
+        write_atomic(json_path, json.dumps(self.report(), indent=2))
+        write_atomic(prometheus_path, self.prometheus())
+
+def prometheus_labels(labels: dict, **extra: str) -> str:
+    labels = dict(labels, **extra)
+    escaped = (key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for key, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+def write_atomic(path: str, text: str) -> None:
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+def instrumented(phase: str) -> Callable:
+    '''
+    Decorator recording each call of a Backup method as one run of phase in self.metrics.
+    '''
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timed(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def request_phase(method: str, url: str) -> str:
+    '''
+    Name of the phase of a box API request, e.g. 'GET /folders/:id/items', with the ids taken out of the url.
+    '''
+    path = url.split('://', 1)[-1].split('?', 1)[0]
+    path = path[path.find('/2.0/') + 4:] if '/2.0/' in path else path[path.find('/'):]
+    return f'{method} {ID_SEGMENT.sub("/:id", path)}'
+
+def instrumented_network(metrics: RunMetrics, pool_size: int = 10,
+                         on_throttled: Optional[Callable[[Optional[float]], None]] = None):
+    '''
+    Returns a boxsdk network layer recording every request to box in metrics, with the bytes sent and received.
+    Its requests session keeps up to pool_size keep-alive connections per host, so the concurrent uploads and listings
+    reuse connections instead of opening (and TLS handshaking) a new one whenever the default pool of 10 is full.
+    on_throttled is called with the Retry-After delay of every 429 (e.g. UploadPool.throttled), including the ones
+    the boxsdk Session retries without raising them.
+    '''
+    from upload_pool import retry_after_seconds
+    from boxsdk.network.default_network import DefaultNetwork
+    from requests.adapters import HTTPAdapter
+
+    class InstrumentedNetwork(DefaultNetwork):
+        def __init__(self) -> None:
+            super().__init__()
+            self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+
+        def request(self, method: str, url: str, access_token: str, **kwargs):
+            start = time.perf_counter()
+            phase = request_phase(method, url)
+            try:
+                response = super().request(method, url, access_token, **kwargs)
+            except Exception:
+                metrics.box_call(phase, time.perf_counter() - start, error=True)
+                raise
+            if response.status_code == 429 and on_throttled is not None:
+                on_throttled(retry_after_seconds(response.headers.get('Retry-After')))
+            received = int(response.headers.get('Content-Length') or 0)
+            metrics.box_call(phase, time.perf_counter() - start, request_bytes(kwargs) + received, not response.ok)
+            return response
+
+    return InstrumentedNetwork()
+
+def request_bytes(kwargs: dict) -> int:
+    '''
+    Size of the body of a request made by boxsdk: raw bytes, or the file streams of a multipart upload (read by then).
+    '''
+    data = kwargs.get('data')
+    size = len(data) if isinstance(data, (bytes, str)) else 0
+    for file in (kwargs.get('files') or {}).values():
+        stream = file[1] if isinstance(file, tuple) and len(file) > 1 else None
+        if hasattr(stream, 'tell'):
+            try:
+                size += stream.tell()
+            except (OSError, ValueError):
+                pass
+    return size
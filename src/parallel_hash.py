@@ -0,0 +1,127 @@
+from hash_cache import HashCache, compute_sha1
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Iterator, Optional
+import multiprocessing, os, threading, time
+
+def hash_batch(paths: list[str]) -> tuple[list[tuple[str, Optional[str], Optional[os.stat_result]]], float]:
+    '''
+    Runs in a worker process: hashes a batch of files and returns (path, sha1, stat) for each, with the sha1 and stat
+    set to None for files that could not be read, along with the seconds spent.
+    '''
+    start = time.perf_counter()
+    results = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            results.append((path, compute_sha1(path), stat))
+        except OSError:
+            results.append((path, None, None))
+    return results, time.perf_counter() - start
+
+class ParallelHasher():
+    '''
+    Hashes many local files on all cores with a process pool (hashing is CPU bound, so threads would share one core).
+     - Files whose hash is cached are answered right away, the others are sent to the pool in batches of up to
+       batch_size files or batch_bytes bytes, so small files do not cost a round trip each and a huge file does not
+       hold back a whole batch.
+     - Results are yielded as batches complete, so the caller can act on them (e.g. queue uploads) while the rest is
+       still being hashed, and are stored in the hash cache.
+     - Few files are hashed in the calling thread instead, as starting the pool would cost more than it saves.
+    '''
+    hash_cache: HashCache
+    workers: int
+    batch_size: int
+    batch_bytes: int
+
+    def __init__(self, hash_cache: HashCache, workers: Optional[int] = None, batch_size: int = 64,
+                 batch_bytes: int = 64 * 1024 * 1024, metrics=None) -> None:
+        '''
+        - hash_cache -> cache answering unchanged files and storing the new hashes
+        - workers -> number of hashing processes, one per core by default
+        - batch_size/batch_bytes -> maximum number of files/bytes in a batch sent to a worker
+        - metrics -> optional RunMetrics recording the batches hashed
+        '''
+        self.hash_cache = hash_cache
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.metrics = metrics
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def pool(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    def batches(self, paths: Iterable[str]) -> Iterator[tuple]:
+        '''
+        Yields (path, sha1) for the cached paths and (batch, is_last) for the uncached ones, grouped in batches as
+        they fill up.
+        '''
+        batch, batch_bytes = [], 0
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                yield path, None
+                continue
+            cached = self.hash_cache.lookup(path, stat)
+            if cached is not None:
+                yield path, cached
+                continue
+            batch.append(path)
+            batch_bytes += stat.st_size
+            if len(batch) >= self.batch_size or batch_bytes >= self.batch_bytes:
+                yield batch, False
+                batch, batch_bytes = [], 0
+        if batch:
+            yield batch, True
+
+    def finish_batch(self, results: list, seconds: float) -> Iterator[tuple[str, Optional[str]]]:
+        hashed_bytes = 0
+        for path, sha1, stat in results:
+            if sha1 is not None:
+                self.hash_cache.store(path, sha1, stat)
+                hashed_bytes += stat.st_size
+            yield path, sha1
+        if self.metrics:
+            self.metrics.observe('hash', seconds, hashed_bytes)
+
+    def hash_paths(self, paths: Iterable[str]) -> Iterator[tuple[str, Optional[str]]]:
+        '''
+        Yields (absolute path, sha1) for every path as soon as it is known, in no particular order.
+        The sha1 is None for files that could not be read.
+        '''
+        pending = set()
+        submitted = False
+        for batch, value in self.batches(paths):
+            if pending:
+                # hand over the batches already hashed first, so their files do not wait for the queue to fill up
+                done, pending = wait(pending, timeout=0)
+                for future in done:
+                    yield from self.finish_batch(*future.result())
+            if not isinstance(batch, list):
+                yield batch, value
+                continue
+            if value and not submitted:
+                # the only batch
+                yield from self.finish_batch(*hash_batch(batch))
+                continue
+            submitted = True
+            pending.add(self.pool().submit(hash_batch, batch))
+            if len(pending) >= 2 * self.workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from self.finish_batch(*future.result())
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from self.finish_batch(*future.result())
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=not wait)
+            self.executor = None
@@ -0,0 +1,384 @@
+from __future__ import annotations
+from listing import RemoteItem
+from filters import relative_path
+from bundles import MANIFEST_NAME
+from walker import WalkItem, walk_tree
+from typing import Optional, Iterable, Iterator, TYPE_CHECKING
+import os
+
+if TYPE_CHECKING:
+    from backup import Backup
+
+CREATE_FOLDER = 'create folder'
+UPLOAD = 'upload'
+UPDATE = 'update'
+SKIP = 'skip'
+COMPARE = 'compare'
+COPY = 'copy'
+BUNDLE = 'bundle'
+
+class PlanEntry():
+    '''
+    A single operation of a backup plan.
+     - action -> CREATE_FOLDER, UPLOAD, UPDATE, COPY, BUNDLE or SKIP, or COMPARE until the file is hashed
+     - path -> the local path (the directory for BUNDLE)
+     - size -> bytes to transfer (0 for folders)
+     - parent_id -> id of the box folder the item goes in, if it already exists
+     - parent -> the CREATE_FOLDER entry of the box folder the item goes in, if it has to be created first
+     - remote -> the box file being updated/skipped, or the box file with the same content being copied
+     - remote_id -> id of the box item once the operation is done (or of the existing folder)
+     - bundle -> the DirectoryBundles of a BUNDLE entry (the small files of the directory to bundle)
+    '''
+    __slots__ = ('action', 'path', 'size', 'parent_id', 'parent', 'remote', 'remote_id', 'bundle')
+
+    def __init__(self, action: str, path: str, size: int = 0, parent_id: Optional[str] = None,
+                 parent: Optional['PlanEntry'] = None, remote: Optional[RemoteItem] = None) -> None:
+        self.action = action
+        self.path = path
+        self.size = size
+        self.parent_id = parent_id
+        self.parent = parent
+        self.remote = remote
+        self.remote_id = remote.id if remote else None
+        self.bundle = None
+
+    def folder_id(self) -> Optional[str]:
+        '''
+        Id of the box folder the item goes in, resolved once its parent folder was created.
+        '''
+        return self.parent_id or (self.parent.remote_id if self.parent else None)
+
+    def __repr__(self) -> str:
+        return f'{self.action}: {self.path}'
+
+class BackupPlan():
+    '''
+    The explicit diff between a local tree and box, built before anything is uploaded.
+    Keeps per-action counts and byte totals for dry runs and ETAs.
+     - keep_entries -> False to only keep the counts (a plan streamed to the PlanExecutor as the tree is walked)
+    '''
+    entries: list[PlanEntry]
+
+    def __init__(self, keep_entries: bool = True) -> None:
+        self.entries = []
+        self.keep_entries = keep_entries
+        self.counts = {CREATE_FOLDER: 0, UPLOAD: 0, UPDATE: 0, COPY: 0, BUNDLE: 0, SKIP: 0, COMPARE: 0}
+        self.bytes = {CREATE_FOLDER: 0, UPLOAD: 0, UPDATE: 0, COPY: 0, BUNDLE: 0, SKIP: 0, COMPARE: 0}
+
+    def add(self, entry: PlanEntry) -> PlanEntry:
+        if self.keep_entries:
+            self.entries.append(entry)
+        self.counts[entry.action] += 1
+        self.bytes[entry.action] += entry.size
+        return entry
+
+    def resolve(self, entry: PlanEntry, action: str) -> None:
+        '''
+        Changes the action of an entry of the plan once it is decided (e.g. a COMPARE entry once hashed).
+        '''
+        self.counts[entry.action] -= 1
+        self.bytes[entry.action] -= entry.size
+        entry.action = action
+        self.counts[action] += 1
+        self.bytes[action] += entry.size
+
+    def extend(self, plan: 'BackupPlan') -> None:
+        for entry in plan.entries:
+            self.add(entry)
+
+    def changes(self) -> list[PlanEntry]:
+        return [entry for entry in self.entries if entry.action != SKIP]
+
+    def changed(self) -> int:
+        '''
+        Number of entries with something to do, known even when only the counts are kept.
+        '''
+        return sum(count for action, count in self.counts.items() if action != SKIP)
+
+    def transfer_bytes(self) -> int:
+        return self.bytes[UPLOAD] + self.bytes[UPDATE] + self.bytes[BUNDLE]
+
+    def eta(self, bytes_per_second: float, seconds_per_request: float = 0.5) -> float:
+        '''
+        Estimated seconds to run the plan from the upload bandwidth and the per-request latency.
+        '''
+        requests = self.counts[CREATE_FOLDER] + self.counts[UPLOAD] + self.counts[UPDATE] + self.counts[COPY]
+        requests += sum(len(entry.bundle.changed) + 1 for entry in self.entries if entry.action == BUNDLE)
+        return self.transfer_bytes() / max(bytes_per_second, 1) + requests * seconds_per_request
+
+    def summary(self) -> str:
+        return (f'{self.counts[CREATE_FOLDER]} folders to create, '
+                f'{self.counts[UPLOAD]} files to upload ({format_bytes(self.bytes[UPLOAD])}), '
+                f'{self.counts[UPDATE]} files to update ({format_bytes(self.bytes[UPDATE])}), '
+                f'{self.counts[COPY]} files to copy on box ({format_bytes(self.bytes[COPY])}), ' +
+                (f'{self.counts[BUNDLE]} folders of small files to bundle ({format_bytes(self.bytes[BUNDLE])}), '
+                 if self.counts[BUNDLE] else '') +
+                f'{self.counts[SKIP]} unchanged' +
+                (f', {self.counts[COMPARE]} to compare' if self.counts[COMPARE] else ''))
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024 or unit == 'TB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} B'
+        size /= 1024
+
+class Planner():
+    '''
+    Planning phase of a backup: walks a local tree alongside the remote index and builds a BackupPlan without
+    changing anything on box (or streams its entries while walking). Unless offline, folders whose contents were
+    never indexed are listed from box.
+    The files and folders excluded by the filters of the backup root are left out of the plan, and excluded folders
+    are not walked at all. When the root bundles small files (bundle_below in its rules), the small files of each
+    directory that are not on box on their own are planned as a single BUNDLE entry, compared through the manifest of
+    the box folder.
+    '''
+    backup: Backup
+    offline: bool
+
+    def __init__(self, backup: Backup, offline: bool = False) -> None:
+        self.backup = backup
+        self.offline = offline
+
+    def children(self, folder_id: Optional[str]) -> tuple[dict[str, RemoteItem], dict[str, RemoteItem]]:
+        '''
+        Returns the files and folders indexed in a box folder, keyed by name.
+        '''
+        if folder_id is None:
+            return {}, {}
+        if not self.offline:
+            self.backup.index.ensure_folder(self.backup.client, folder_id)
+        elif not self.backup.index.is_listed(folder_id):
+            return {}, {}
+        return self.backup.index.children(folder_id, 'file'), self.backup.index.children(folder_id, 'folder')
+
+    def plan_file(self, path: str, parent_id: Optional[str], parent: Optional[PlanEntry],
+                  box_file: Optional[RemoteItem], stat: Optional[os.stat_result] = None) -> PlanEntry:
+        '''
+        Decides what to do with a single file. Files already backed up by the interrupted run being resumed are
+        skipped without being compared. Files that can only be compared by hashing them (same size as on box and no
+        cached hash) are planned as COMPARE, to be hashed in parallel (see resolve). So are new files with the size of a
+        file already on box, which are copied on box instead of uploaded if their content matches.
+        '''
+        stat = stat or os.stat(path)
+        if self.backup.journal.file_is_done(path):
+            return PlanEntry(SKIP, path, stat.st_size, parent_id, parent, box_file)
+        if box_file is None:
+            if not self.backup.may_copy(stat.st_size):
+                return PlanEntry(UPLOAD, path, stat.st_size, parent_id, parent)
+            sha1 = self.backup.hash_cache.lookup(os.path.abspath(path), stat)
+            if sha1 is None:
+                return PlanEntry(COMPARE, path, stat.st_size, parent_id, parent)
+            return self.plan_new_file(PlanEntry(UPLOAD, path, stat.st_size, parent_id, parent), sha1)
+        if box_file.size is not None and stat.st_size != box_file.size:
+            return PlanEntry(UPDATE, path, stat.st_size, parent_id, parent, box_file)
+        sha1 = self.backup.hash_cache.lookup(os.path.abspath(path), stat)
+        if sha1 is None:
+            return PlanEntry(COMPARE, path, stat.st_size, parent_id, parent, box_file)
+        return PlanEntry(SKIP if sha1 == box_file.sha1 else UPDATE, path, stat.st_size, parent_id, parent, box_file)
+
+    def plan_new_file(self, entry: PlanEntry, sha1: str) -> PlanEntry:
+        '''
+        Turns a new file into a COPY of the box file with the same content, if there is one in the backup tree.
+        '''
+        source = self.backup.find_copy_source(sha1, entry.size)
+        if source is not None:
+            entry.action = COPY
+            entry.remote = source
+        return entry
+
+    def compare(self, plan: BackupPlan) -> Iterator[PlanEntry]:
+        '''
+        Hashes the files of the COMPARE entries of the plan on all cores and resolves each into SKIP or UPDATE
+        (or COPY or UPLOAD for new files), yielding the entries as they are resolved so their transfers can start
+        while the rest is still hashed. Files that can no longer be read are skipped.
+        '''
+        entries = {os.path.abspath(entry.path): entry for entry in plan.entries if entry.action == COMPARE}
+        for path, sha1 in self.backup.hasher.hash_paths(list(entries)):
+            entry = entries[path]
+            self.resolve(plan, entry, sha1)
+            yield entry
+
+    def resolve(self, plan: BackupPlan, entry: PlanEntry, sha1: Optional[str]) -> None:
+        '''
+        Resolves a COMPARE entry of the plan from the sha1 of its file (None if it could not be read: skipped).
+        '''
+        if sha1 is None:
+            plan.resolve(entry, SKIP)
+        elif entry.remote is None:
+            source = self.backup.find_copy_source(sha1, entry.size)
+            entry.remote = source
+            plan.resolve(entry, COPY if source else UPLOAD)
+        else:
+            plan.resolve(entry, SKIP if sha1 == entry.remote.sha1 else UPDATE)
+
+    def compare_all(self, plan: BackupPlan) -> BackupPlan:
+        '''
+        Resolves all the COMPARE entries of the plan and returns it.
+        '''
+        for _ in self.compare(plan):
+            pass
+        return plan
+
+    def count(self, entries: Iterable[PlanEntry], compare: bool = True) -> BackupPlan:
+        '''
+        Adds the entries to a plan keeping only the counts as they come (e.g. from iter_folder), so memory stays flat
+        on huge trees. With compare, the files to compare are hashed on all cores and counted once resolved,
+        otherwise they stay COMPARE.
+        '''
+        plan = BackupPlan(keep_entries=False)
+        comparing = {}
+
+        def counted() -> Iterator[str]:
+            for entry in entries:
+                plan.add(entry)
+                if compare and entry.action == COMPARE:
+                    comparing[os.path.abspath(entry.path)] = entry
+                    yield entry.path
+
+        for path, sha1 in self.backup.hasher.hash_paths(counted()):
+            self.resolve(plan, comparing.pop(path), sha1)
+        return plan
+
+    def plan_folder(self, path: str, folder_id: Optional[str] = None, parent_id: Optional[str] = None) -> BackupPlan:
+        '''
+        Plans the backup of the local folder path into the existing box folder folder_id, or into a new folder
+        created in parent_id when folder_id is None. Parent folders always come before their contents in the plan.
+        '''
+        with self.backup.metrics.timed('plan'):
+            plan = BackupPlan()
+            for entry in self.iter_folder(path, folder_id, parent_id):
+                plan.add(entry)
+            return plan
+
+    def iter_folder(self, path: str, folder_id: Optional[str] = None, parent_id: Optional[str] = None,
+                    recursive: bool = True) -> Iterator[PlanEntry]:
+        '''
+        Yields the entries of the plan of plan_folder as the local tree is walked (see walk_tree), so they can be run
+        while the rest of the tree is still walked. Parent folders always come before their contents. Only the box
+        listing of the directory being walked is held, so memory does not grow with the size of the tree.
+         - recursive -> False to only plan the files directly in path
+        '''
+        filter_root, path_filter = self.backup.filters.for_path(path)
+        directory, box_files, box_folders, small = None, {}, {}, []
+        for item in walk_tree(path, path_filter, relative_path(filter_root, path)):
+            if item.parent is None:
+                root_entry = PlanEntry(CREATE_FOLDER, path, parent_id=parent_id) if folder_id is None else None
+                item.context = (folder_id, root_entry)
+                if root_entry is not None:
+                    yield root_entry
+                continue
+            if item.parent is not directory:
+                # the walk moved on to the next directory: the files of the previous one are all planned
+                if small:
+                    yield from self.plan_bundle(directory, small, box_files)
+                    small = []
+                directory = item.parent
+                box_files, box_folders = self.children(directory.context[0])
+            cur_id, cur_entry = directory.context
+
+            if item.is_dir:
+                if not recursive:
+                    item.descend = False
+                    continue
+                sub_folder = box_folders.get(item.name, None)
+                if sub_folder:
+                    item.context = (sub_folder.id, None)
+                else:
+                    entry = PlanEntry(CREATE_FOLDER, item.path, parent_id=cur_id, parent=cur_entry)
+                    item.context = (None, entry)
+                    yield entry
+            elif path_filter.bundles(item.stat) and item.name not in box_files:
+                small.append((item.name, item.stat))
+            else:
+                yield self.plan_file(item.path, cur_id, cur_entry, box_files.get(item.name, None), item.stat)
+        if small:
+            yield from self.plan_bundle(directory, small, box_files)
+
+    def plan_bundle(self, directory: WalkItem, small: list[tuple[str, os.stat_result]],
+                    box_files: dict[str, RemoteItem]) -> Iterator[PlanEntry]:
+        '''
+        Plans the small files of a single directory as a BUNDLE entry, unless they are all in its manifest already.
+        '''
+        folder_id, parent = directory.context
+        manifest = self.backup.bundler.load_manifest(folder_id, box_files.get(MANIFEST_NAME), self.offline)
+        bundles = self.backup.bundler.plan(directory.path, small, manifest)
+        if bundles is not None:
+            entry = PlanEntry(BUNDLE, directory.path, bundles.size(), folder_id, parent)
+            entry.bundle = bundles
+            yield entry
+
+class PlanExecutor():
+    '''
+    Execution phase of a backup: runs the entries of a plan as they are planned, so the transfers start while the
+    tree is still walked.
+     - Folders are created as soon as they are planned, parents before children (everything else depends on them).
+     - Transfers go to the upload pool in the order of the walk, with the files to compare once hashed.
+    '''
+    backup: Backup
+
+    def __init__(self, backup: Backup) -> None:
+        self.backup = backup
+
+    def create_folders(self, entries: Iterable[PlanEntry]) -> None:
+        for entry in entries:
+            parent_folder = self.backup.client.folder(entry.folder_id())
+            new_folder = self.backup.create_folder(parent_folder, os.path.split(entry.path)[1], entry.path)
+            entry.remote_id = new_folder.object_id
+
+    def transfer(self, entry: PlanEntry) -> None:
+        if entry.action == BUNDLE:
+            self.backup.bundler.upload(entry)
+            return
+        if entry.action == UPDATE and self.backup.update_file(entry.remote, entry.path):
+            return
+        if entry.action == COPY:
+            self.backup.copy_file(entry.remote, self.backup.client.folder(entry.folder_id()), entry.path)
+            return
+        self.backup.upload_file(self.backup.client.folder(entry.folder_id()), entry.path)
+
+    def stream(self, planner: Planner, entries: Iterable[PlanEntry]) -> BackupPlan:
+        '''
+        Runs the entries of a plan as they come (e.g. from Planner.iter_folder): folders are created right away (they
+        come before their contents), transfers are queued on the upload pool and the files to compare are hashed on
+        all cores, queued once found changed. Queuing blocks while the upload pool is full, which holds the walk back,
+        so memory stays flat on huge trees. Returns the plan, with its counts only.
+        The progress totals only grow while the entries come, so the walk is reported for them to show as provisional.
+        '''
+        plan = BackupPlan(keep_entries=False)
+        comparing = {}
+        progress = self.backup.progress
+
+        def decided() -> Iterator[str]:
+            for entry in entries:
+                plan.add(entry)
+                if entry.action == COMPARE:
+                    comparing[os.path.abspath(entry.path)] = entry
+                    yield entry.path
+                else:
+                    self.run_entry(entry)
+
+        if progress is not None:
+            progress.walk_started()
+        try:
+            for path, sha1 in self.backup.hasher.hash_paths(decided()):
+                entry = comparing.pop(path)
+                planner.resolve(plan, entry, sha1)
+                self.run_entry(entry)
+        finally:
+            if progress is not None:
+                progress.walk_done()
+        return plan
+
+    def run_entry(self, entry: PlanEntry) -> None:
+        if entry.action == CREATE_FOLDER:
+            self.create_folders([entry])
+        elif entry.action in (UPLOAD, UPDATE, COPY, BUNDLE):
+            self.report_planned([entry])
+            self.backup.upload_pool.submit(self.transfer, entry)
+
+    def report_planned(self, entries: list[PlanEntry]) -> None:
+        '''
+        Adds transfers to the progress totals (copies move no bytes).
+        '''
+        if self.backup.progress is not None and entries:
+            self.backup.progress.planned(len(entries), sum(entry.size for entry in entries if entry.action != COPY))
@@ -0,0 +1,119 @@
+from typing import Optional
+import collections, queue, time
+
+'''
+Progress of a backup run, passed from the threads doing the work to the window showing it. The worker threads only
+put events on a queue; the tkinter main loop drains it in batches (tkinter widgets must only be used from the main
+thread), so a run of hundreds of thousands of files neither blocks on nor floods the UI.
+'''
+
+class BackupProgress():
+    '''
+    Producer side (any thread): planned, file_done, walk_started/walk_done, log and finish put events on the queue.
+    Consumer side (a single thread, the tkinter main loop): drain applies them to the counters and keeps the latest
+    max_lines log lines in a ring buffer, and status formats the throughput and ETA.
+     - files_total/bytes_total -> transfers planned so far
+     - files_done/bytes_done -> transfers completed so far
+     - walks -> tree walks still running: their transfers are planned as they are found, so until they are done the
+       totals are only lower bounds and status shows them as such, without an ETA
+    '''
+    def __init__(self, max_lines: int = 1000, window: float = 10.0) -> None:
+        '''
+        - max_lines -> number of log lines kept
+        - window -> seconds of history the throughput is measured over
+        '''
+        self.events = queue.SimpleQueue()
+        self.lines = collections.deque(maxlen=max_lines)
+        self.window = window
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.walks = 0
+        self.finished = False
+        self.started = time.monotonic()
+        self.samples = collections.deque([(self.started, 0, 0)])
+
+    def planned(self, files: int, nbytes: int) -> None:
+        self.events.put(('planned', files, nbytes))
+
+    def file_done(self, path: str, nbytes: int, action: str) -> None:
+        self.events.put(('done', path, nbytes, action))
+
+    def walk_started(self) -> None:
+        self.events.put(('walk', 1))
+
+    def walk_done(self) -> None:
+        self.events.put(('walk', -1))
+
+    def log(self, line: str) -> None:
+        self.events.put(('log', line))
+
+    def finish(self) -> None:
+        self.events.put(('finish',))
+
+    def drain(self, max_events: int = 10000) -> list[str]:
+        '''
+        Applies up to max_events queued events and returns the new log lines (only the last max_lines of them).
+        '''
+        new_lines = collections.deque(maxlen=self.lines.maxlen)
+        for _ in range(max_events):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == 'planned':
+                self.files_total += event[1]
+                self.bytes_total += event[2]
+            elif event[0] == 'done':
+                self.files_done += 1
+                self.bytes_done += event[2]
+                new_lines.append(f"\t\t{event[3]}: {event[1]}")
+            elif event[0] == 'walk':
+                self.walks += event[1]
+            elif event[0] == 'log':
+                new_lines.append(event[1])
+            elif event[0] == 'finish':
+                self.finished = True
+        self.lines.extend(new_lines)
+
+        now = time.monotonic()
+        self.samples.append((now, self.files_done, self.bytes_done))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+            self.samples.popleft()
+        return list(new_lines)
+
+    def rates(self) -> tuple[float, float]:
+        '''
+        Files/s and bytes/s over the last window seconds.
+        '''
+        (first_time, first_files, first_bytes), (last_time, last_files, last_bytes) = self.samples[0], self.samples[-1]
+        elapsed = max(last_time - first_time, 1e-6)
+        return (last_files - first_files) / elapsed, (last_bytes - first_bytes) / elapsed
+
+    def eta(self) -> Optional[float]:
+        '''
+        Seconds left at the current throughput, from the bytes left or, for small files, the files left.
+        '''
+        files_per_second, bytes_per_second = self.rates()
+        remaining_files = max(self.files_total - self.files_done, 0)
+        remaining_bytes = max(self.bytes_total - self.bytes_done, 0)
+        estimates = []
+        if bytes_per_second > 0:
+            estimates.append(remaining_bytes / bytes_per_second)
+        if files_per_second > 0:
+            estimates.append(remaining_files / files_per_second)
+        return max(estimates) if estimates else None
+
+    def status(self) -> str:
+        files_per_second, bytes_per_second = self.rates()
+        remaining_bytes = max(self.bytes_total - self.bytes_done, 0)
+        eta = self.eta()
+        at_least = '≥' if self.walks and not self.finished else ''
+        status = (f'{self.files_done}/{at_least}{self.files_total} files, {files_per_second:.1f} files/s, '
+                  f'{bytes_per_second / (1024 * 1024):.1f} MB/s, {at_least}{remaining_bytes / (1024 * 1024):.1f} MB left')
+        if at_least:
+            status += ', scanning…'
+        elif eta is not None and not self.finished:
+            status += f', ETA {int(eta // 3600)}:{int(eta % 3600 // 60):02d}:{int(eta % 60):02d}'
+        return status
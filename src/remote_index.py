@@ -0,0 +1,276 @@
+from typing import Optional, Iterable
+from listing import RemoteItem, LISTING_FIELDS, list_folder, to_record
+import sqlite3, threading
+
+class RemoteIndex():
+    '''
+    Persistent on-disk (SQLite) index of the box backup tree. Lets the backup
+     - find files/folders by name without walking box
+     - resolve the children of a folder without listing it again
+     - find files by content (size and sha1), so content already on box can be copied instead of uploaded
+    Folders are only re-listed when their etag changes or when a refresh is forced.
+    '''
+    db_path: str
+    conn: sqlite3.Connection
+    lock: threading.RLock
+
+    def __init__(self, db_path: str) -> None:
+        '''
+        - db_path -> location of the SQLite database file
+        - conn -> connection shared by every thread of the app (guarded by lock)
+        '''
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS items (
+                    id TEXT PRIMARY KEY,
+                    parent_id TEXT,
+                    name TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    sha1 TEXT,
+                    size INTEGER,
+                    etag TEXT
+                );
+                CREATE INDEX IF NOT EXISTS items_parent_name ON items (parent_id, name);
+                CREATE INDEX IF NOT EXISTS items_name_type ON items (name, type);
+                CREATE INDEX IF NOT EXISTS items_content ON items (size, sha1);
+                CREATE TABLE IF NOT EXISTS listed_folders (
+                    id TEXT PRIMARY KEY,
+                    etag TEXT
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            ''')
+
+    def get(self, item_id: str) -> Optional[RemoteItem]:
+        '''
+        Returns the indexed item with the given id, or None.
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM items WHERE id = ?', (item_id,)).fetchone()
+        return RemoteItem(*row) if row else None
+
+    def child(self, parent_id: str, name: str, item_type: Optional[str] = None) -> Optional[RemoteItem]:
+        '''
+        Returns the direct child of parent_id with the given name (and type), or None.
+        '''
+        query = 'SELECT * FROM items WHERE parent_id = ? AND name = ?'
+        params = [parent_id, name]
+        if item_type:
+            query += ' AND type = ?'
+            params.append(item_type)
+        with self.lock:
+            row = self.conn.execute(query, params).fetchone()
+        return RemoteItem(*row) if row else None
+
+    def children(self, parent_id: str, item_type: Optional[str] = None) -> dict[str, RemoteItem]:
+        '''
+        Returns the direct children of parent_id keyed by name.
+        '''
+        query = 'SELECT * FROM items WHERE parent_id = ?'
+        params = [parent_id]
+        if item_type:
+            query += ' AND type = ?'
+            params.append(item_type)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return {row[2]: RemoteItem(*row) for row in rows}
+
+    def is_under(self, item_id: str, root_id: str) -> bool:
+        '''
+        Checks if item_id is root_id or is a descendant of it by following the parent links.
+        '''
+        with self.lock:
+            row = self.conn.execute('''
+                WITH RECURSIVE ancestors(id, parent_id) AS (
+                    SELECT id, parent_id FROM items WHERE id = ?
+                    UNION ALL
+                    SELECT items.id, items.parent_id FROM items JOIN ancestors ON items.id = ancestors.parent_id
+                )
+                SELECT 1 FROM ancestors WHERE id = ? OR parent_id = ? LIMIT 1
+            ''', (item_id, root_id, root_id)).fetchone()
+        return item_id == root_id or row is not None
+
+    def find(self, name: str, item_type: str, root_id: str) -> Optional[RemoteItem]:
+        '''
+        Returns an item with the given name and type anywhere in the subtree of root_id (the shallowest one), or None.
+        The subtree is searched top-down one level at a time, looking the name up in the (parent_id, name) index of
+        the folders of each level, so common names cost no more than rare ones.
+        '''
+        level = [root_id]
+        while level:
+            folders = []
+            for start in range(0, len(level), 500):
+                ids = level[start:start + 500]
+                marks = ', '.join('?' * len(ids))
+                with self.lock:
+                    row = self.conn.execute(f'SELECT * FROM items WHERE parent_id IN ({marks}) AND name = ? AND type = ? '
+                                            'ORDER BY parent_id, id LIMIT 1', (*ids, name, item_type)).fetchone()
+                    if row is not None:
+                        return RemoteItem(*row)
+                    folders += [row[0] for row in self.conn.execute(
+                        f"SELECT id FROM items WHERE parent_id IN ({marks}) AND type = 'folder'", ids)]
+            level = folders
+        return None
+
+    def has_file_size(self, size: int) -> bool:
+        '''
+        Checks if any indexed file has the given size (the only files whose content may match a local file's).
+        '''
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM items WHERE size = ? AND type = 'file' LIMIT 1", (size,)).fetchone()
+        return row is not None
+
+    def find_by_content(self, sha1: str, size: int, root_id: str) -> Optional[RemoteItem]:
+        '''
+        Returns a file with the given sha1 and size anywhere in the subtree of root_id, or None.
+        '''
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM items WHERE size = ? AND sha1 = ? AND type = 'file'",
+                                     (size, sha1)).fetchall()
+        for row in rows:
+            if self.is_under(row[0], root_id):
+                return RemoteItem(*row)
+        return None
+
+    def upsert(self, item: RemoteItem) -> None:
+        '''
+        Adds or replaces a single item.
+        '''
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)', tuple(item))
+
+    def record(self, box_item, parent_id: str) -> RemoteItem:
+        '''
+        Adds an item returned by the boxsdk (e.g. from upload, update_contents or create_subfolder) to the index.
+        '''
+        item = to_record(box_item, parent_id)
+        self.upsert(item)
+        if item.type == 'folder' and getattr(box_item, 'item_collection', {}).get('total_count') == 0:
+            self.mark_listed(item.id, item.etag)
+        return item
+
+    def remove(self, item_id: str) -> None:
+        '''
+        Removes an item and everything indexed below it.
+        '''
+        with self.lock, self.conn:
+            self.conn.execute('''
+                WITH RECURSIVE subtree(id) AS (
+                    SELECT ?
+                    UNION ALL
+                    SELECT items.id FROM items JOIN subtree ON items.parent_id = subtree.id
+                )
+                DELETE FROM items WHERE id IN (SELECT id FROM subtree)
+            ''', (item_id,))
+            self.conn.execute('DELETE FROM listed_folders WHERE id = ?', (item_id,))
+
+    def replace_children(self, parent_id: str, items: Iterable[RemoteItem], etag: Optional[str] = None) -> set[str]:
+        '''
+        Replaces the indexed children of parent_id with a fresh listing, writing it in batches as it streams in.
+        Children that disappeared are removed along with their subtrees. Returns the ids of the fresh children.
+        '''
+        fresh_ids = set()
+        batch = []
+        for item in items:
+            fresh_ids.add(item.id)
+            batch.append(tuple(item))
+            if len(batch) >= 1000:
+                self._insert_many(batch)
+                batch = []
+        self._insert_many(batch)
+
+        with self.lock:
+            known_ids = [row[0] for row in self.conn.execute('SELECT id FROM items WHERE parent_id = ?', (parent_id,))]
+        for stale_id in known_ids:
+            if stale_id not in fresh_ids:
+                self.remove(stale_id)
+        self.mark_listed(parent_id, etag)
+        return fresh_ids
+
+    def _insert_many(self, rows: list[tuple]) -> None:
+        if rows:
+            with self.lock, self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def mark_listed(self, folder_id: str, etag: Optional[str]) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO listed_folders VALUES (?, ?)', (folder_id, etag))
+
+    def listed_etag(self, folder_id: str) -> Optional[str]:
+        '''
+        Returns the etag the folder had when it was last listed, '' if it was listed without an etag,
+        or None if it was never listed.
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT etag FROM listed_folders WHERE id = ?', (folder_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0] or ''
+
+    def is_listed(self, folder_id: str) -> bool:
+        return self.listed_etag(folder_id) is not None
+
+    def sync_folder(self, client, folder_id: str, etag: Optional[str] = None) -> None:
+        '''
+        Lists a single folder from box and stores its children in the index.
+        '''
+        self.replace_children(folder_id, list_folder(client.folder(folder_id)), etag)
+
+    def sync_tree(self, client, root_id: str, force: bool = False) -> None:
+        '''
+        Brings the index of the subtree under root_id up to date. A subfolder is only listed again if it was never
+        listed or if its etag changed since it was last listed (or always when force is set).
+        '''
+        pending = [(root_id, None)]
+        while pending:
+            folder_id, etag = pending.pop()
+            known_etag = self.listed_etag(folder_id)
+            if force or known_etag is None or (etag is not None and etag != known_etag):
+                self.sync_folder(client, folder_id, etag)
+            pending.extend((item.id, item.etag) for item in self.children(folder_id, 'folder').values())
+
+    def ensure_tree(self, client, root_id: str) -> None:
+        '''
+        Builds the index of the subtree under root_id the first time it is needed.
+        '''
+        if not self.is_listed(root_id):
+            root = client.folder(root_id).get(fields=LISTING_FIELDS + ['parent'])
+            parent = getattr(root, 'parent', None)
+            self.record(root, parent.object_id if parent else None)
+            self.sync_tree(client, root_id)
+
+    def ensure_folder(self, client, folder_id: str) -> None:
+        '''
+        Lists a folder from box only if its children were never indexed.
+        '''
+        if not self.is_listed(folder_id):
+            self.sync_folder(client, folder_id)
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        '''
+        Returns a value saved alongside the index (e.g. the events stream position), or None.
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def clear(self) -> None:
+        '''
+        Drops everything in the index so that it is rebuilt on the next use.
+        '''
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM items')
+            self.conn.execute('DELETE FROM listed_folders')
@@ -0,0 +1,205 @@
+from __future__ import annotations
+from listing import RemoteItem
+from upload_pool import UploadPool
+from bundles import BUNDLE_PREFIX, MANIFEST_NAME
+from planner import format_bytes
+from typing import Optional, TYPE_CHECKING
+import hashlib, json, os, threading
+
+if TYPE_CHECKING:
+    from backup import Backup
+
+RANGED_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+RANGE_SIZE = 16 * 1024 * 1024
+
+class HashingWriter():
+    '''
+    Writable stream hashing what is written to the file it wraps, so a download is verified without reading it back.
+    '''
+    def __init__(self, file, sha1) -> None:
+        self.file = file
+        self.sha1 = sha1
+
+    def write(self, data: bytes) -> int:
+        self.sha1.update(data)
+        return self.file.write(data)
+
+class Restorer():
+    '''
+    Downloads a box folder of the backup back to a local folder:
+     - The tree comes from the remote index (folders never indexed are listed once), and the files are downloaded
+       by a pool of workers as soon as their folder is listed, with the same rate limit handling as the uploads.
+     - Files at least RANGED_DOWNLOAD_THRESHOLD bytes are fetched in RANGE_SIZE ranges into a .part file, so an
+       interrupted download continues where it stopped.
+     - Every file is checked against the sha1 box has for it before it replaces the local file, and local files
+       whose size and (cached) sha1 already match are skipped, so an interrupted restore is resumed by running it
+       again.
+     - Folders backed up with small file bundles are restored from their bundles, using the offsets of the manifest.
+       A bundled file that is also on box on its own (its bundle was left behind when the threshold changed) is
+       restored from the separate file.
+    '''
+    backup: Backup
+    pool: UploadPool
+
+    def __init__(self, backup: Backup, workers: Optional[int] = None, range_size: int = RANGE_SIZE) -> None:
+        '''
+        - workers -> number of concurrent downloads (twice the upload concurrency by default)
+        - range_size -> bytes fetched per request of a ranged download
+        '''
+        self.backup = backup
+        self.range_size = range_size
+        self.pool = UploadPool(max_workers=workers or 2 * backup.upload_workers)
+        self.lock = threading.Lock()
+        self.restored = 0
+        self.restored_bytes = 0
+        self.skipped = 0
+
+    def restore(self, folder_id: str, destination: str) -> str:
+        '''
+        Restores the contents of the box folder folder_id into destination and returns the status of the restore.
+        '''
+        pending = [(folder_id, destination)]
+        while pending:
+            cur_id, cur_path = pending.pop()
+            os.makedirs(cur_path, exist_ok=True)
+            with self.backup.metrics.timed('restore walk'):
+                self.backup.index.ensure_folder(self.backup.client, cur_id)
+                files = self.backup.index.children(cur_id, 'file')
+                folders = self.backup.index.children(cur_id, 'folder')
+
+            manifest = files.pop(MANIFEST_NAME, None)
+            bundles = self.load_manifest(manifest).get('bundles', {}) if manifest else {}
+            for name in [name for name in files if name.startswith(BUNDLE_PREFIX)]:
+                bundle = files.pop(name)
+                members = [member for member in bundles.get(name, {}).get('members', []) if member['path'] not in files]
+                if members:
+                    self.planned(members)
+                    self.pool.submit(self.restore_bundle, bundle, members, cur_path)
+
+            for name, item in files.items():
+                if is_safe_name(name):
+                    self.planned([{'size': item.size or 0}])
+                    self.pool.submit(self.restore_file, item, os.path.join(cur_path, name))
+            for name, item in folders.items():
+                if is_safe_name(name):
+                    pending.append((item.id, os.path.join(cur_path, name)))
+
+        errors = self.pool.wait()
+        self.pool.shutdown()
+        status = (f'Restored {self.restored} files ({format_bytes(self.restored_bytes)}), '
+                  f'{self.skipped} already up to date')
+        if errors:
+            status += f' ({len(errors)} files failed to restore)'
+        return status
+
+    def planned(self, members: list[dict]) -> None:
+        if self.backup.progress is not None:
+            self.backup.progress.planned(len(members), sum(member['size'] for member in members))
+
+    def load_manifest(self, item: RemoteItem) -> dict:
+        try:
+            return json.loads(self.backup.client.file(item.id).content())
+        except ValueError:
+            return {}
+
+    def is_restored(self, path: str, size: Optional[int], sha1: Optional[str]) -> bool:
+        '''
+        Whether the local file already has the content of the box file (its hash is cached for the next run).
+        '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return stat.st_size == size and sha1 is not None and self.backup.sha1_hash(path) == sha1
+
+    def skip(self, path: str, size: int) -> None:
+        with self.lock:
+            self.skipped += 1
+        if self.backup.progress is not None:
+            self.backup.progress.file_done(path, size, 'up to date')
+
+    def finish(self, part_path: str, path: str, sha1: str, size: int) -> None:
+        '''
+        Moves a verified download in place and caches its hash, so backing it up again does not re-hash it.
+        '''
+        os.replace(part_path, path)
+        self.backup.hash_cache.store(os.path.abspath(path), sha1, os.stat(path))
+        with self.lock:
+            self.restored += 1
+            self.restored_bytes += size
+        if self.backup.progress is not None:
+            self.backup.progress.file_done(path, size, 'restored')
+
+    def restore_file(self, item: RemoteItem, path: str, resume: bool = True) -> None:
+        '''
+        Downloads a box file to path through path.part, verifying its sha1. A ranged download continues from the
+        .part file left by an interrupted one; if the result does not match, it is downloaded again from scratch.
+        '''
+        size = item.size or 0
+        if self.is_restored(path, size, item.sha1):
+            self.skip(path, size)
+            return
+        part_path = path + '.part'
+        box_file = self.backup.client.file(item.id)
+        sha1 = hashlib.sha1()
+        offset = 0
+        ranged = size >= RANGED_DOWNLOAD_THRESHOLD
+        if ranged and resume and os.path.exists(part_path):
+            with open(part_path, 'rb') as part:
+                while data := part.read(1024 * 1024):
+                    sha1.update(data)
+                    offset += len(data)
+            if offset > size:
+                sha1, offset = hashlib.sha1(), 0
+
+        with self.backup.metrics.timed('download', size - offset), open(part_path, 'ab' if offset else 'wb') as part:
+            writer = HashingWriter(part, sha1)
+            if ranged:
+                while offset < size:
+                    end = min(offset + self.range_size, size) - 1
+                    box_file.download_to(writer, byte_range=(offset, end))
+                    part.flush()
+                    offset = end + 1
+            else:
+                box_file.download_to(writer)
+
+        if item.sha1 is not None and sha1.hexdigest() != item.sha1:
+            os.remove(part_path)
+            if ranged and resume:
+                return self.restore_file(item, path, resume=False)
+            raise ValueError(f'{path}: the download does not match the sha1 of the box file')
+        self.finish(part_path, path, sha1.hexdigest(), size)
+
+    def restore_bundle(self, item: RemoteItem, members: list[dict], directory: str) -> None:
+        '''
+        Restores the files of a small file bundle that are missing or changed locally, from a single download.
+        '''
+        needed = []
+        for member in members:
+            path = os.path.join(directory, member['path'])
+            if not is_safe_name(member['path']):
+                continue
+            if self.is_restored(path, member['size'], member['sha1']):
+                self.skip(path, member['size'])
+            else:
+                needed.append(member)
+        if not needed:
+            return
+
+        with self.backup.metrics.timed('download', item.size or 0):
+            content = self.backup.client.file(item.id).content()
+        for member in needed:
+            path = os.path.join(directory, member['path'])
+            data = content[member['offset']:member['offset'] + member['size']]
+            sha1 = hashlib.sha1(data).hexdigest()
+            if sha1 != member['sha1']:
+                raise ValueError(f'{path}: the bundled file does not match the sha1 of the manifest')
+            with open(path + '.part', 'wb') as part:
+                part.write(data)
+            self.finish(path + '.part', path, sha1, member['size'])
+
+def is_safe_name(name: str) -> bool:
+    '''
+    Whether a box item name can be used as a local file name without leaving the folder being restored.
+    '''
+    return name not in ('', '.', '..') and '/' not in name and os.sep not in name
@@ -0,0 +1,130 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TYPE_CHECKING
+import os, threading, time
+
+if TYPE_CHECKING:
+    from backup import Backup
+
+class BandwidthBudget():
+    '''
+    Token bucket shared by every upload: consume blocks until the bytes about to be sent fit in the budget of
+    rate bytes per second (with bursts of up to one second of budget). A rate of None means no limit.
+    '''
+    rate: Optional[float]
+
+    def __init__(self, rate: Optional[float] = None) -> None:
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.tokens = rate or 0.0
+        self.updated = time.monotonic()
+
+    def consume(self, nbytes: int) -> None:
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - nbytes
+            self.updated = now
+            # a part larger than the bucket goes into debt, paid back before the next send
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+
+class BackupJob():
+    '''
+    A selected file/folder to back up:
+     - priority -> jobs with a higher priority start first (and their transfers go first in the upload pool)
+     - size -> estimated bytes to transfer, used to run the shortest jobs first
+     - status -> 'queued', 'running', 'done' or 'failed' (raised, or some of its transfers failed), with the backup
+       response (or error) in response
+    '''
+    path: str
+    priority: int
+    size: Optional[int]
+    status: str
+    response: str
+
+    def __init__(self, path: str, priority: int = 0, size: Optional[int] = None) -> None:
+        self.path = path
+        self.priority = priority
+        self.size = size
+        self.status = 'queued'
+        self.response = ''
+        self.started = None
+        self.finished = None
+
+    def duration(self) -> float:
+        return (self.finished or time.monotonic()) - (self.started or time.monotonic())
+
+class JobScheduler():
+    '''
+    Runs the backup of several selected files/folders as jobs sharing the resources of a Backup:
+     - up to max_jobs jobs plan and run at once, so a huge folder does not hold back the small ones and one job's
+       planning overlaps another's transfers
+     - jobs start by priority, then (with shortest_first) by estimated size, then in the order they were added
+     - the transfers of every job share the upload pool (the concurrency budget, with each job's transfers queued by
+       its rank) and the backup's bandwidth budget
+     - on_done is called with each job as soon as it completes
+    '''
+    backup: Backup
+    jobs: list[BackupJob]
+
+    def __init__(self, backup: Backup, max_jobs: int = 2, shortest_first: bool = False,
+                 on_done: Optional[Callable[[BackupJob], None]] = None) -> None:
+        self.backup = backup
+        self.max_jobs = max_jobs
+        self.shortest_first = shortest_first
+        self.on_done = on_done
+        self.jobs = []
+
+    def add(self, path: str, priority: int = 0, size: Optional[int] = None) -> BackupJob:
+        '''
+        Adds a job. Without a size, shortest_first estimates it from the local tree and the remote index.
+        '''
+        if size is None and self.shortest_first:
+            size = self.backup.estimate_transfer(path)
+        job = BackupJob(path, priority, size)
+        self.jobs.append(job)
+        return job
+
+    def order(self) -> list[BackupJob]:
+        def key(indexed: tuple[int, BackupJob]):
+            index, job = indexed
+            size = job.size if self.shortest_first and job.size is not None else 0
+            return (-job.priority, size, index)
+        return [job for _, job in sorted(enumerate(self.jobs), key=key)]
+
+    def run(self) -> list[BackupJob]:
+        '''
+        Runs every job and returns them in the order they were started.
+        '''
+        jobs = self.order()
+        with ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='backup-job') as executor:
+            for rank, job in enumerate(jobs):
+                executor.submit(self.run_job, job, rank)
+        return jobs
+
+    def run_job(self, job: BackupJob, rank: int) -> None:
+        job.status = 'running'
+        job.started = time.monotonic()
+        self.backup.metrics.set_root(job.path)
+        try:
+            with self.backup.upload_pool.scope(priority=rank) as task_scope:
+                if os.path.isdir(job.path):
+                    job.response = self.backup.backup_folders(job.path)
+                else:
+                    job.response = self.backup.backup_files(job.path)
+            if task_scope.failed:
+                job.status = 'failed'
+                self.backup.journal.failed(job.path, job.response)
+            else:
+                self.backup.journal.completed('root', job.path)
+                job.status = 'done'
+        except Exception as e:
+            job.response = f'Failed: {e}'
+            job.status = 'failed'
+            self.backup.journal.failed(job.path, job.response)
+        job.finished = time.monotonic()
+        if self.on_done is not None:
+            self.on_done(job)
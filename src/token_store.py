@@ -0,0 +1,89 @@
+from typing import Optional
+import json, os
+
+KEYRING_SERVICE = 'box-backup'
+
+class TokenStore():
+    '''
+    Keeps the box access and refresh tokens between runs, so the app and the command line only need the browser
+    authorization once (box refresh tokens are valid for 60 days and each refresh returns a new one).
+     - The tokens go in the system keyring if the optional keyring package is installed and has a usable backend.
+     - Otherwise they go in a json file only readable by the user (mode 0600).
+    save has the signature of the boxsdk OAuth2 store_tokens callback, so every refresh is persisted.
+    '''
+    path: str
+    client_id: str
+
+    def __init__(self, path: str, client_id: str) -> None:
+        '''
+        - path -> location of the token file used without a keyring
+        - client_id -> box app the tokens belong to (the keyring entry name)
+        '''
+        self.path = path
+        self.client_id = client_id
+
+    def keyring(self):
+        '''
+        Returns the keyring module if it is installed and has a usable backend, otherwise None.
+        '''
+        try:
+            import keyring
+            from keyring.backends import fail
+        except ImportError:
+            return None
+        if isinstance(keyring.get_keyring(), fail.Keyring):
+            return None
+        return keyring
+
+    def load(self) -> tuple[Optional[str], Optional[str]]:
+        '''
+        Returns the stored (access_token, refresh_token), or (None, None).
+        '''
+        keyring = self.keyring()
+        try:
+            if keyring is not None:
+                stored = keyring.get_password(KEYRING_SERVICE, self.client_id)
+            else:
+                with open(self.path, 'r') as token_file:
+                    stored = token_file.read()
+            tokens = json.loads(stored) if stored else {}
+        except (OSError, ValueError):
+            return None, None
+        except Exception:
+            # keyring backend errors (locked or unavailable keyring)
+            return None, None
+        return tokens.get('access_token'), tokens.get('refresh_token')
+
+    def save(self, access_token: Optional[str], refresh_token: Optional[str]) -> None:
+        '''
+        Stores the tokens, or clears them when both are None (e.g. when they are revoked).
+        '''
+        if access_token is None and refresh_token is None:
+            self.clear()
+            return
+        stored = json.dumps({'access_token': access_token, 'refresh_token': refresh_token})
+        keyring = self.keyring()
+        if keyring is not None:
+            try:
+                keyring.set_password(KEYRING_SERVICE, self.client_id, stored)
+                return
+            except Exception:
+                pass
+        temp_path = self.path + '.tmp'
+        descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w') as token_file:
+            token_file.write(stored)
+        os.chmod(temp_path, 0o600)
+        os.replace(temp_path, self.path)
+
+    def clear(self) -> None:
+        keyring = self.keyring()
+        if keyring is not None:
+            try:
+                keyring.delete_password(KEYRING_SERVICE, self.client_id)
+            except Exception:
+                pass
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
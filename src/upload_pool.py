@@ -0,0 +1,219 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional
+import contextlib, contextvars, heapq, itertools, random, threading, time
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class TaskScope():
+    '''
+    The tasks submitted within UploadPool.scope (e.g. the transfers of one backup job):
+     - priority -> tasks with a lower priority value start first, tasks of the same priority in submission order
+     - futures -> the tasks not finished yet
+     - errors -> the errors of the tasks that failed, until wait returns them
+     - failed -> the number of tasks that failed in the scope so far (kept when wait returns their errors)
+    '''
+    def __init__(self, priority: int = 0) -> None:
+        self.priority = priority
+        self.futures: set[Future] = set()
+        self.errors: list[Exception] = []
+        self.failed = 0
+
+def retry_after_seconds(value) -> Optional[float]:
+    '''
+    The delay of a Retry-After header, or None if there is none (or it is not a number of seconds).
+    '''
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+current_scope: contextvars.ContextVar[Optional[TaskScope]] = contextvars.ContextVar('upload_scope', default=None)
+
+class UploadPool():
+    '''
+    Bounded pool of worker threads for uploads/updates.
+     - At most `limit` tasks run at once. The limit is halved whenever box answers 429 (rate limited) and grows back
+       by one after every `grow_after` consecutive successes, up to max_workers. The 429s are reported by the network
+       layer (see throttled) as they happen, including the ones boxsdk retries itself, and no task starts until their
+       Retry-After delay passed.
+     - boxsdk retries every request failing with a 429 or a 5xx itself; a task still failing with one once those
+       retries are used up is run again up to max_retries times, after a jittered exponential backoff.
+     - Waiting tasks start by priority: the tasks submitted within a scope (see scope) carry its priority, so
+       several jobs can share the pool without the first one queued holding back the others.
+    Tasks run in the context (contextvars) they were submitted from, e.g. with the root their metrics belong to.
+    '''
+    max_workers: int
+    min_workers: int
+    limit: int
+
+    def __init__(self, max_workers: int = 4, min_workers: int = 1, max_retries: int = 2,
+                 base_delay: float = 1.0, max_delay: float = 60.0, grow_after: int = 20, max_queued: int = 1000) -> None:
+        '''
+        - max_workers -> maximum number of concurrent uploads
+        - min_workers -> the concurrency is never reduced below this
+        - max_retries -> number of times a task is run again once boxsdk gave up on a rate limited/failed request
+        - base_delay, max_delay -> bounds of the exponential backoff in seconds
+        - grow_after -> number of consecutive successes before the concurrency is raised again
+        - max_queued -> submit blocks once this many tasks are waiting, so huge trees don't queue up in memory
+        '''
+        self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.grow_after = grow_after
+        self.limit = max_workers
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload')
+        self._slots = threading.Condition()
+        self._active = 0
+        self._successes = 0
+        self._resume_at = 0.0
+        self._pending: set[Future] = set()
+        self._pending_lock = threading.Lock()
+        self._queue_slots = threading.BoundedSemaphore(max_queued)
+        self._queue: list[tuple] = []
+        self._sequence = itertools.count()
+        self.errors: list[Exception] = []
+
+    @contextlib.contextmanager
+    def scope(self, priority: int = 0):
+        '''
+        Within the with block, the tasks submitted by this thread (and by the tasks it submitted) get priority and
+        are tracked apart: wait then only waits for them and returns their errors.
+        '''
+        task_scope = TaskScope(priority)
+        token = current_scope.set(task_scope)
+        try:
+            yield task_scope
+        finally:
+            current_scope.reset(token)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        '''
+        Queues fn(*args, **kwargs) to run on the pool with rate-limit aware retries.
+        '''
+        self._queue_slots.acquire()
+        task_scope = current_scope.get()
+        future = Future()
+        future.scope = task_scope
+        with self._pending_lock:
+            self._pending.add(future)
+            if task_scope is not None:
+                task_scope.futures.add(future)
+            heapq.heappush(self._queue, (task_scope.priority if task_scope else 0, next(self._sequence), future,
+                                         contextvars.copy_context(), fn, args, kwargs))
+        future.add_done_callback(self._done)
+        self._executor.submit(self._run_next)
+        return future
+
+    def wait(self) -> list[Exception]:
+        '''
+        Blocks until every submitted task finished (or, within a scope, every task of the scope). Returns (and clears)
+        the errors of the tasks that failed.
+        '''
+        task_scope = current_scope.get()
+        while True:
+            with self._pending_lock:
+                pending = list(task_scope.futures if task_scope is not None else self._pending)
+            if not pending:
+                break
+            for future in pending:
+                future.exception()
+        with self._pending_lock:
+            if task_scope is not None:
+                errors, task_scope.errors = task_scope.errors, []
+            else:
+                errors, self.errors = self.errors, []
+        return errors
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _done(self, future: Future) -> None:
+        with self._pending_lock:
+            self._pending.discard(future)
+            if future.scope is not None:
+                future.scope.futures.discard(future)
+            if future.exception() is not None:
+                (future.scope.errors if future.scope is not None else self.errors).append(future.exception())
+                if future.scope is not None:
+                    future.scope.failed += 1
+        self._queue_slots.release()
+
+    def _run_next(self) -> None:
+        '''
+        Runs on a worker thread: every submit queues one call, which runs the waiting task with the best priority.
+        '''
+        with self._pending_lock:
+            _, _, future, context, fn, args, kwargs = heapq.heappop(self._queue)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(self._run, fn, args, kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def throttled(self, retry_after: Optional[float] = None) -> None:
+        '''
+        Called whenever box answers 429: halves the limit (once per Retry-After window, so the 429s of the tasks
+        running at the same time count once) and holds back new tasks until the retry_after seconds passed.
+        '''
+        with self._slots:
+            now = time.monotonic()
+            if now >= self._resume_at:
+                self.limit = max(self.min_workers, self.limit // 2)
+                self._successes = 0
+            self._resume_at = max(self._resume_at, now + (retry_after if retry_after is not None else self.base_delay))
+
+    def _acquire(self) -> None:
+        with self._slots:
+            while True:
+                paused = self._resume_at - time.monotonic()
+                if paused > 0:
+                    self._slots.wait(paused)
+                elif self._active >= self.limit:
+                    self._slots.wait()
+                else:
+                    break
+            self._active += 1
+
+    def _release(self, succeeded: bool = True) -> None:
+        with self._slots:
+            self._active -= 1
+            if succeeded:
+                self._successes += 1
+                if self._successes >= self.grow_after and self.limit < self.max_workers:
+                    self.limit += 1
+                    self._successes = 0
+            self._slots.notify_all()
+
+    def backoff(self, attempt: int) -> float:
+        '''
+        Returns how long to wait before running a task again: exponential backoff with random jitter, so failed
+        workers don't retry in lockstep (a Retry-After delay already holds back every task, see throttled).
+        '''
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def _run(self, fn, args, kwargs):
+        from boxsdk.exception import BoxAPIException
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except BoxAPIException as e:
+                self._release(succeeded=False)
+                if e.status == 429:
+                    self.throttled(retry_after_seconds((e.headers or {}).get('Retry-After')))
+                if e.status not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+                    raise
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            except Exception:
+                self._release(succeeded=False)
+                raise
+            self._release()
+            return result
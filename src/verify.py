@@ -0,0 +1,178 @@
+from __future__ import annotations
+from listing import RemoteItem
+from filters import relative_path
+from bundles import BUNDLE_PREFIX, MANIFEST_NAME
+from typing import Optional, Iterator, TYPE_CHECKING
+import json, os, threading
+
+if TYPE_CHECKING:
+    from backup import Backup
+
+MISSING = 'missing'
+STALE = 'stale'
+EXTRA = 'extra'
+UNREADABLE = 'unreadable'
+
+class Verifier():
+    '''
+    Read-only audit of a backup: walks local roots alongside their box folders and reports
+     - missing -> local files/folders that are not on box
+     - stale -> files whose size or sha1 on box differs from the local file
+     - extra -> box files/folders with no local counterpart (e.g. deleted locally)
+     - unreadable -> local files that could not be read
+    The box side comes from the remote index (folders never indexed are listed, nothing is ever written to box),
+    sizes are compared first and only files of the same size are hashed: cached hashes are reused and the others are
+    hashed on all cores while the walk continues. Each finding is appended to the report (JSON lines) as soon as it
+    is found, so a long audit can be followed (and is not lost) while it runs.
+    Files left out by the filters of the root are not checked, and small file bundles are checked through their
+    manifest.
+    '''
+    backup: Backup
+    report_path: str
+    counts: dict[str, int]
+
+    def __init__(self, backup: Backup, report_path: str) -> None:
+        self.backup = backup
+        self.report_path = report_path
+        self.lock = threading.Lock()
+        self.counts = {'checked': 0, MISSING: 0, STALE: 0, EXTRA: 0, UNREADABLE: 0}
+        self.report = None
+
+    def verify(self, paths: list[str]) -> dict[str, str]:
+        '''
+        Audits each local root against the box folder it is backed up to and returns the status of each root.
+        '''
+        responses = {}
+        with open(self.report_path, 'w') as self.report:
+            for path in paths:
+                before = dict(self.counts)
+                self.check_root(os.path.abspath(path))
+                responses[path] = self.status({key: self.counts[key] - before[key] for key in self.counts})
+        return responses
+
+    def status(self, counts: dict[str, int]) -> str:
+        return (f"{counts['checked']} files checked: {counts[MISSING]} missing, {counts[STALE]} stale, "
+                f"{counts[EXTRA]} extra on box" + (f", {counts[UNREADABLE]} unreadable" if counts[UNREADABLE] else ''))
+
+    def found(self, status: str, path: str, item: Optional[RemoteItem] = None, **details) -> None:
+        record = {'status': status, 'path': path}
+        if item is not None:
+            record.update(box_id=item.id, box_size=item.size, box_sha1=item.sha1)
+        record.update(details)
+        with self.lock:
+            self.counts[status] += 1
+            self.report.write(json.dumps(record) + '\n')
+            self.report.flush()
+
+    def check_root(self, path: str) -> None:
+        if not os.path.exists(path):
+            self.found(MISSING, path, reason='not found in local drive')
+            return
+        root_id = self.backup.backup_folder_id()
+        if os.path.isfile(path):
+            item = self.backup.index.find(os.path.basename(path), 'file', root_id)
+            self.compare_files(iter([self.check_file(path, os.stat(path), item)]))
+            return
+        folder = self.backup.find_indexed_folder(path)
+        if folder is None:
+            self.found(MISSING, path)
+            return
+        self.compare_files(self.walk(path, folder.id))
+
+    def check_file(self, path: str, stat: os.stat_result, item: Optional[RemoteItem]) -> Optional[tuple[str, str, RemoteItem]]:
+        '''
+        Compares the sizes of a local file and its box counterpart. Returns (path, expected sha1, item) if the file
+        has to be hashed to be compared, otherwise reports it right away.
+        '''
+        with self.lock:
+            self.counts['checked'] += 1
+        if item is None:
+            self.found(MISSING, path, size=stat.st_size)
+            return None
+        if item.size is not None and item.size != stat.st_size:
+            self.found(STALE, path, item, size=stat.st_size)
+            return None
+        return path, item.sha1, item
+
+    def walk(self, path: str, folder_id: str) -> Iterator[tuple[str, str, RemoteItem]]:
+        '''
+        Walks the local tree and the indexed box tree together, reporting the missing and extra items, and yields the
+        files of the same size on both sides.
+        '''
+        filter_root, path_filter = self.backup.filters.for_path(path)
+        pending = [(path, folder_id)]
+        while pending:
+            cur_path, cur_id = pending.pop()
+            self.backup.index.ensure_folder(self.backup.client, cur_id)
+            box_files = self.backup.index.children(cur_id, 'file')
+            box_folders = self.backup.index.children(cur_id, 'folder')
+            bundled = self.manifest_members(cur_id, box_files)
+            relative = relative_path(filter_root, cur_path)
+            prefix = relative + '/' if relative else ''
+            try:
+                entries = list(os.scandir(cur_path))
+            except OSError:
+                self.found(UNREADABLE, cur_path)
+                continue
+            local_names = {entry.name for entry in entries}
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if path_filter.skip_dir(prefix + entry.name):
+                        continue
+                    sub_folder = box_folders.get(entry.name)
+                    if sub_folder is None:
+                        self.found(MISSING, entry.path)
+                    else:
+                        pending.append((entry.path, sub_folder.id))
+                elif entry.is_file():
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        self.found(UNREADABLE, entry.path)
+                        continue
+                    if path_filter.skip_file(prefix + entry.name, stat):
+                        continue
+                    candidate = self.check_file(entry.path, stat, box_files.get(entry.name) or bundled.get(entry.name))
+                    if candidate is not None:
+                        yield candidate
+
+            for name, item in list(box_files.items()) + list(box_folders.items()):
+                if name not in local_names and name != MANIFEST_NAME and not name.startswith(BUNDLE_PREFIX):
+                    self.found(EXTRA, os.path.join(cur_path, name), item)
+            for name, item in bundled.items():
+                if name not in local_names:
+                    self.found(EXTRA, os.path.join(cur_path, name), item, bundled=True)
+
+    def manifest_members(self, folder_id: str, box_files: dict[str, RemoteItem]) -> dict[str, RemoteItem]:
+        '''
+        The files bundled in a box folder, keyed by name, as their bundle with the size and sha1 of the file.
+        The manifest is only downloaded if the local copy kept by the bundler does not match the one on box.
+        '''
+        try:
+            manifest = self.backup.bundler.load_manifest(folder_id, box_files.get(MANIFEST_NAME))
+        except ValueError:
+            return {}
+        return {member['path']: box_files[name]._replace(size=member['size'], sha1=member['sha1'])
+                for name, bundle in manifest.get('bundles', {}).items() if name in box_files
+                for member in bundle['members']}
+
+    def compare_files(self, candidates: Iterator[Optional[tuple[str, str, RemoteItem]]]) -> None:
+        '''
+        Hashes the candidate files in parallel (cached hashes are reused) and reports the ones that differ.
+        '''
+        expected = {}
+
+        def paths():
+            for candidate in candidates:
+                if candidate is not None:
+                    path, sha1, item = candidate
+                    expected[os.path.abspath(path)] = (sha1, item)
+                    yield path
+
+        for path, sha1 in self.backup.hasher.hash_paths(paths()):
+            box_sha1, item = expected.pop(path)
+            if sha1 is None:
+                self.found(UNREADABLE, path)
+            elif box_sha1 is not None and sha1 != box_sha1:
+                self.found(STALE, path, item, sha1=sha1)
@@ -0,0 +1,69 @@
+from filters import PathFilter
+from typing import Iterator, Optional
+import os
+
+class WalkItem():
+    '''
+    A file or directory found by walk_tree:
+     - path/name -> its local path and name
+     - relative -> its path relative to the backup root, with / separators (as the filters match it)
+     - stat -> the stat of a file (from the directory scan), None for directories
+     - parent -> the WalkItem of the directory it is in (None for the root)
+     - context -> set by the consumer on a directory (e.g. the box folder it maps to), for the items inside it
+     - descend -> cleared by the consumer to not walk into a directory
+    '''
+    __slots__ = ('path', 'name', 'relative', 'stat', 'is_dir', 'parent', 'context', 'descend')
+
+    def __init__(self, path: str, name: str, relative: str, stat: Optional[os.stat_result], is_dir: bool,
+                 parent: Optional['WalkItem']) -> None:
+        self.path = path
+        self.name = name
+        self.relative = relative
+        self.stat = stat
+        self.is_dir = is_dir
+        self.parent = parent
+        self.context = None
+        self.descend = True
+
+def walk_tree(root: str, path_filter: Optional[PathFilter] = None, relative: str = '') -> Iterator[WalkItem]:
+    '''
+    Iterative os.scandir walk of the tree under root, yielding the root directory first, then every file and directory
+    as it is read (a directory always comes before its contents), so the consumer can start working before the walk
+    finishes. Nothing is recursive and no directory listing is ever held in full: memory only grows with the number of
+    directories still to walk.
+     - Files come with the stat of the scan. Files and directories excluded by path_filter are skipped and excluded
+       directories are never entered. Symbolic links to directories are not followed.
+     - The consumer can set context on a directory item before asking for the next item, and clear descend to
+       leave it out.
+     - relative -> path of root relative to the backup root the filters apply to
+    Directories that cannot be read are skipped.
+    '''
+    root_item = WalkItem(root, os.path.basename(root), relative, None, True, None)
+    yield root_item
+    stack = [root_item] if root_item.descend else []
+    while stack:
+        directory = stack.pop()
+        prefix = directory.relative + '/' if directory.relative else ''
+        subdirectories = []
+        try:
+            entries = os.scandir(directory.path)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if path_filter is not None and path_filter.skip_dir(prefix + entry.name):
+                            continue
+                        item = WalkItem(entry.path, entry.name, prefix + entry.name, None, True, directory)
+                        yield item
+                        if item.descend:
+                            subdirectories.append(item)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        if path_filter is not None and path_filter.skip_file(prefix + entry.name, stat):
+                            continue
+                        yield WalkItem(entry.path, entry.name, prefix + entry.name, stat, False, directory)
+                except OSError:
+                    continue
+        stack.extend(reversed(subdirectories))
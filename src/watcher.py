@@ -0,0 +1,326 @@
+from typing import Callable, Optional
+import ctypes, ctypes.util, errno, os, select, struct, sys, threading, time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+class InotifyWatcher():
+    '''
+    Watches directory trees with Linux inotify (through libc, no extra dependency).
+    Reports every file written and closed, moved in, or directory created. New directories are watched as they appear.
+    A directory that cannot be watched is reported to on_unwatched. Once the watch limit of the user is reached
+    (fs.inotify.max_user_watches), the whole root is given up, its watches freed for the other roots, and reported so
+    it can be polled instead.
+    The watch of a deleted directory is dropped once the kernel removed it (IN_IGNORED), since its descriptor may be
+    reused for a new directory. A deleted root is reported to on_unwatched.
+    '''
+    def __init__(self, roots: list[str], on_change: Callable[[str], None],
+                 on_unwatched: Optional[Callable[[str, str], None]] = None) -> None:
+        '''
+        - roots -> directories to watch recursively
+        - on_change -> called with the path of every changed file/directory
+        - on_unwatched -> called with each directory (or root, at the watch limit) that is not watched and why
+        '''
+        self.roots = roots
+        self.on_change = on_change
+        self.on_unwatched = on_unwatched
+        self.limited: set[str] = set()
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.watches: dict[int, str] = {}
+        for root in roots:
+            self.add_tree(root)
+
+    def root_of(self, path: str) -> str:
+        for root in self.roots:
+            if path == root or path.startswith(root + os.sep):
+                return root
+        return path
+
+    def add_tree(self, directory: str) -> None:
+        root = self.root_of(directory)
+        if root in self.limited:
+            return
+        for cur_root, _, _ in os.walk(directory):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(cur_root), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = cur_root
+                continue
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                self.give_up(root)
+                return
+            if error != errno.ENOENT and self.on_unwatched is not None:
+                self.on_unwatched(cur_root, os.strerror(error))
+
+    def give_up(self, root: str) -> None:
+        '''
+        Removes the watches of root after the watch limit was reached in its tree, and reports it.
+        '''
+        self.limited.add(root)
+        prefix = root + os.sep
+        for wd, directory in list(self.watches.items()):
+            if directory == root or directory.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+        if self.on_unwatched is not None:
+            self.on_unwatched(root, 'inotify watch limit reached (fs.inotify.max_user_watches)')
+
+    def run(self, stop: threading.Event) -> None:
+        '''
+        Reads inotify events until stop is set.
+        '''
+        try:
+            while not stop.is_set():
+                ready, _, _ = select.select([self.fd], [], [], 0.5)
+                if not ready:
+                    continue
+                buffer = os.read(self.fd, 64 * 1024)
+                offset = 0
+                while offset < len(buffer):
+                    wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                    name = buffer[offset + EVENT_HEADER.size: offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                    offset += EVENT_HEADER.size + length
+                    if mask & IN_Q_OVERFLOW:
+                        for root in self.roots:
+                            self.on_change(root)
+                        continue
+                    directory = self.watches.get(wd)
+                    if mask & IN_IGNORED:
+                        self.watches.pop(wd, None)
+                        continue
+                    if mask & IN_DELETE_SELF:
+                        if directory in self.roots and self.on_unwatched is not None:
+                            self.on_unwatched(directory, 'deleted')
+                        continue
+                    if directory is None or not name:
+                        continue
+                    path = os.path.join(directory, os.fsdecode(name))
+                    if mask & IN_ISDIR:
+                        self.add_tree(path)
+                        self.on_change(path)
+                    elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        self.on_change(path)
+        finally:
+            os.close(self.fd)
+
+class PollingWatcher():
+    '''
+    Fallback watcher for systems without inotify (or roots past the inotify watch limit): rescans the trees every
+    interval seconds and reports the files whose size or mtime changed, and the files and directories that appeared.
+    Roots can be added while it runs.
+    '''
+    def __init__(self, roots: list[str], on_change: Callable[[str], None], interval: float = 10.0) -> None:
+        self.roots = list(roots)
+        self.on_change = on_change
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.snapshot = self.scan(self.roots)
+
+    def add_root(self, root: str) -> None:
+        with self.lock:
+            if root not in self.roots:
+                self.roots.append(root)
+                self.snapshot.update(self.scan([root]))
+
+    def scan(self, roots: list[str]) -> dict[str, tuple]:
+        snapshot = {}
+        pending = list(roots)
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            snapshot[entry.path] = None
+                            pending.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                pass
+        return snapshot
+
+    def run(self, stop: threading.Event) -> None:
+        while not stop.wait(self.interval):
+            with self.lock:
+                snapshot = self.scan(self.roots)
+                changed = [path for path, signature in snapshot.items()
+                           if path not in self.snapshot or self.snapshot[path] != signature]
+                self.snapshot = snapshot
+            for path in changed:
+                self.on_change(path)
+
+class ChangeDebouncer():
+    '''
+    Collects changed paths and hands them over in batches once changes stop for `quiet` seconds
+    (or at the latest `max_wait` seconds after the first change of a burst). Duplicates and paths inside
+    a changed directory are coalesced.
+    '''
+    def __init__(self, on_batch: Callable[[list[str]], None], quiet: float = 2.0, max_wait: float = 30.0) -> None:
+        self.on_batch = on_batch
+        self.quiet = quiet
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.paths: set[str] = set()
+        self.first_change = 0.0
+        self.last_change = 0.0
+
+    def add(self, path: str) -> None:
+        with self.lock:
+            now = time.monotonic()
+            if not self.paths:
+                self.first_change = now
+            self.last_change = now
+            self.paths.add(path)
+
+    def take(self) -> list[str]:
+        '''
+        Returns the coalesced batch if it is due, otherwise an empty list.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            if not self.paths or (now - self.last_change < self.quiet and now - self.first_change < self.max_wait):
+                return []
+            paths, self.paths = self.paths, set()
+        directories = [path + os.sep for path in paths if os.path.isdir(path)]
+        return sorted(path for path in paths if not any(path.startswith(directory) for directory in directories))
+
+    def run(self, stop: threading.Event) -> None:
+        while not stop.wait(0.5):
+            batch = self.take()
+            if batch:
+                self.on_batch(batch)
+
+class WatchDaemon():
+    '''
+    Continuous backup: watches the selected folders and pushes only the changed paths through the Backup
+    upload/update logic. Uses inotify on Linux and polling elsewhere (or if inotify is unavailable). The roots past the
+    inotify watch limit are polled, and the directories left unwatched are kept in unwatched with the reason.
+    '''
+    def __init__(self, backup, roots: list[str], on_backed_up: Optional[Callable[[str, str], None]] = None,
+                 quiet: float = 2.0, poll_interval: float = 10.0, journal_runs: bool = False) -> None:
+        '''
+        - backup -> the Backup instance used to back up changes
+        - roots -> the local folders to watch
+        - on_backed_up -> called with each changed path and the backup response once it is backed up
+        - quiet -> seconds without changes before a burst of changes is backed up
+        - poll_interval -> seconds between rescans when polling
+        - journal_runs -> True to record each batch as a run of the backup journal (see backup_batch)
+        '''
+        self.backup = backup
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.on_backed_up = on_backed_up
+        self.journal_runs = journal_runs
+        self.batch_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.debouncer = ChangeDebouncer(self.backup_batch, quiet=quiet)
+        self.poll_interval = poll_interval
+        self.unwatched: dict[str, str] = {}
+        self.poller = None
+        self.lock = threading.Lock()
+        self.threads: list[threading.Thread] = []
+        self.watcher = None
+        if sys.platform.startswith('linux'):
+            try:
+                self.watcher = InotifyWatcher(self.roots, self.debouncer.add, on_unwatched=self.not_watched)
+            except (OSError, AttributeError):
+                self.watcher = None
+        if self.watcher is None:
+            self.watcher = PollingWatcher(self.roots, self.debouncer.add, poll_interval)
+
+    def root_of(self, path: str) -> Optional[str]:
+        for root in self.roots:
+            if path == root or path.startswith(root + os.sep):
+                return root
+        return None
+
+    def not_watched(self, path: str, reason: str) -> None:
+        '''
+        Records a directory inotify does not watch. A root given up at the watch limit (or deleted) is polled from
+        then on, which also notices a deleted root coming back.
+        '''
+        self.unwatched[path] = reason
+        if path not in self.roots:
+            return
+        with self.lock:
+            if self.poller is None:
+                self.poller = PollingWatcher([path], self.debouncer.add, self.poll_interval)
+                if self.threads:
+                    self.start_thread(self.poller.run)
+            else:
+                self.poller.add_root(path)
+
+    def backup_batch(self, paths: list[str]) -> None:
+        '''
+        Backs up each changed path within its own upload pool scope, so the transfers (and failures) of a change are
+        told apart from the ones of a backup run sharing the pool. Batches run one at a time.
+        With journal_runs, each batch is a journal run of the roots it changed: a root some changes of which could not
+        be backed up is recorded as failed, and the run stays unfinished. The watched roots left unfinished (by a
+        failed or interrupted batch) are backed up whole by the next batch, and the other ones stay in the run for
+        the command line run to resume.
+        '''
+        changed: dict[str, list[str]] = {}
+        for path in paths:
+            root = self.root_of(path)
+            if root is None or not os.path.exists(path) or self.backup.filters.excludes(path, root):
+                continue
+            changed.setdefault(root, []).append(path)
+
+        with self.batch_lock:
+            journal = self.backup.journal if self.journal_runs else None
+            if journal is not None:
+                unfinished = journal.unfinished_run() or {'folders': [], 'files': []}
+                for root in unfinished['folders']:
+                    if root in self.roots and os.path.isdir(root):
+                        changed[root] = [root]
+                if not changed:
+                    return
+                others = [path for path in unfinished['folders'] if path not in changed]
+                journal.start_run(list(changed) + others, unfinished['files'])
+
+            for root, root_paths in changed.items():
+                failed = False
+                for path in root_paths:
+                    with self.backup.upload_pool.scope() as task_scope:
+                        try:
+                            self.backup.metrics.set_root(root)
+                            response = self.backup.backup_changed(root, path)
+                        except Exception as e:
+                            response = f"Failed: {e}" + self.backup.failed_uploads()
+                            failed = True
+                    failed = failed or task_scope.failed > 0
+                    if self.on_backed_up:
+                        self.on_backed_up(path, response)
+                if journal is not None:
+                    if failed:
+                        journal.failed(root, response)
+                    else:
+                        journal.completed('root', root)
+
+            if journal is not None:
+                journal.finish_run()
+
+    def start_thread(self, target: Callable[[threading.Event], None]) -> None:
+        thread = threading.Thread(target=target, args=(self.stop_event,), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def start(self) -> None:
+        with self.lock:
+            for target in (self.watcher.run, self.debouncer.run):
+                self.start_thread(target)
+            if self.poller is not None:
+                self.start_thread(self.poller.run)
+
+    def stop(self) -> None:
+        self.stop_event.set()
@@ -0,0 +1,76 @@
+import hashlib, os
+import pytest
+
+pytest.importorskip('boxsdk')
+
+from chunked_upload import ResumableUpload
+from fake_box import FakeBox, FakeClient, FakeUploadSession
+
+'''
+Chunked uploads interrupted by a failed part, resumed from the parts the session already has.
+'''
+
+PART_SIZE = 1024
+
+@pytest.fixture
+def box() -> FakeBox:
+    return FakeBox(root_id='555', root_name='Backup', part_size=PART_SIZE, retry_after=0, retry_base_interval=0, seed=0)
+
+@pytest.fixture
+def large_file(tmp_path) -> str:
+    path = tmp_path / 'large.bin'
+    path.write_bytes(os.urandom(5 * PART_SIZE + 100))
+    return str(path)
+
+@pytest.fixture
+def failing_part(monkeypatch):
+    '''
+    Makes the first upload of the part at offset 2 * PART_SIZE fail, as a dropped connection would.
+    '''
+    from boxsdk.exception import BoxAPIException
+    upload_part_bytes = FakeUploadSession.upload_part_bytes
+    failures = [2 * PART_SIZE]
+
+    def upload_part(session, part_bytes, offset, total_size, part_content_sha1=None):
+        if offset in failures:
+            failures.remove(offset)
+            raise BoxAPIException(403, code='injected_failure', message='Injected failure of upload_part')
+        return upload_part_bytes(session, part_bytes, offset, total_size, part_content_sha1)
+
+    monkeypatch.setattr(FakeUploadSession, 'upload_part_bytes', upload_part)
+
+def uploaded_content(box: FakeBox, uploaded) -> bytes:
+    return box.read_content(uploaded.object_id)
+
+@pytest.mark.parametrize('known_sha1', [False, True])
+def test_resume_after_failed_part(box, large_file, tmp_path, failing_part, known_sha1):
+    uploader = ResumableUpload(FakeClient(box), str(tmp_path / 'uploads'), part_workers=1)
+    with open(large_file, 'rb') as file:
+        content = file.read()
+    sha1 = hashlib.sha1(content).hexdigest() if known_sha1 else None
+
+    from boxsdk.exception import BoxAPIException
+    with pytest.raises(BoxAPIException):
+        uploader.upload(large_file, sha1, folder_id='555')
+    assert os.path.exists(uploader.state_path(large_file))
+
+    uploaded = uploader.upload(large_file, sha1, folder_id='555')
+    assert uploaded_content(box, uploaded) == content
+    assert uploaded.sha1 == hashlib.sha1(content).hexdigest()
+    assert box.calls['create_upload_session'] == 1
+    # every one of the 6 parts reached box once: the resumed upload only sent the ones the session did not have
+    assert box.calls['upload_part'] == 6
+    assert not os.path.exists(uploader.state_path(large_file))
+
+def test_changed_file_starts_over(box, large_file, tmp_path, failing_part):
+    uploader = ResumableUpload(FakeClient(box), str(tmp_path / 'uploads'), part_workers=1)
+    from boxsdk.exception import BoxAPIException
+    with pytest.raises(BoxAPIException):
+        uploader.upload(large_file, folder_id='555')
+
+    with open(large_file, 'ab') as file:
+        file.write(b'appended since')
+    uploaded = uploader.upload(large_file, folder_id='555')
+    with open(large_file, 'rb') as file:
+        assert uploaded_content(box, uploaded) == file.read()
+    assert box.calls['create_upload_session'] == 2
@@ -0,0 +1,97 @@
+from typing import Optional
+import pytest
+
+pytest.importorskip('boxsdk')
+
+from event_sync import EventSync, ListEventSource
+from fake_box import FakeBox, FakeClient
+from listing import RemoteItem
+from remote_index import RemoteIndex
+
+'''
+Events replayed by a ListEventSource into the remote index: created, renamed, moved and trashed items, and the full
+re-listing once box no longer accepts the stored stream position.
+'''
+
+ROOT_ID = '555'
+
+class ExpiredEventSource(ListEventSource):
+    '''
+    Event source whose stream positions have all expired, as box answers after a long time offline.
+    '''
+    def get_events(self, stream_position: str, limit: int) -> dict:
+        from boxsdk.exception import BoxAPIException
+        raise BoxAPIException(410, code='stream_position_expired')
+
+def event(event_type: str, item_id: str, item_type: str, name: str, parent_id: str, inside: bool = True, **fields) -> dict:
+    path_ids = ['0', ROOT_ID] if inside else ['0', 'elsewhere']
+    if parent_id not in path_ids:
+        path_ids.append(parent_id)
+    source = {'type': item_type, 'id': item_id, 'name': name, 'parent': {'id': parent_id},
+              'path_collection': {'entries': [{'id': path_id} for path_id in path_ids]}, 'etag': '0'}
+    source.update(fields)
+    return {'event_type': event_type, 'source': source}
+
+@pytest.fixture
+def index(tmp_path) -> RemoteIndex:
+    return RemoteIndex(str(tmp_path / 'remote_index.db'))
+
+def synced(index: RemoteIndex, events: list[dict], applied: Optional[int] = None) -> EventSync:
+    sync = EventSync(index, ListEventSource(events), ROOT_ID)
+    index.set_meta(sync.position_key, '0')
+    assert sync.sync() == (len(events) if applied is None else applied)
+    assert index.get_meta(sync.position_key) == str(len(events))
+    return sync
+
+def test_create_events(index):
+    synced(index, [
+        event('ITEM_CREATE', '10', 'folder', 'docs', ROOT_ID),
+        event('ITEM_UPLOAD', '11', 'file', 'a.txt', '10', sha1='aa', size=3),
+    ])
+    assert index.get('10') == RemoteItem('10', ROOT_ID, 'docs', 'folder', None, None, '0')
+    assert index.get('11') == RemoteItem('11', '10', 'a.txt', 'file', 'aa', 3, '0')
+    # created empty, so its children are known without listing it
+    assert index.is_listed('10')
+
+def test_rename_and_move_events(index):
+    synced(index, [
+        event('ITEM_CREATE', '10', 'folder', 'docs', ROOT_ID),
+        event('ITEM_UPLOAD', '11', 'file', 'a.txt', ROOT_ID, sha1='aa', size=3),
+        event('ITEM_UPLOAD', '12', 'file', 'b.txt', ROOT_ID, sha1='bb', size=3),
+        event('ITEM_RENAME', '11', 'file', 'renamed.txt', ROOT_ID, sha1='aa', size=3),
+        event('ITEM_MOVE', '11', 'file', 'renamed.txt', '10', sha1='aa', size=3),
+        event('ITEM_MOVE', '12', 'file', 'b.txt', 'elsewhere', inside=False, sha1='bb', size=3),
+    ])
+    assert index.child(ROOT_ID, 'a.txt') is None
+    assert index.child(ROOT_ID, 'renamed.txt') is None
+    assert index.child('10', 'renamed.txt').id == '11'
+    # moved out of the backup root
+    assert index.get('12') is None
+    assert set(index.children(ROOT_ID)) == {'docs'}
+
+def test_trash_events(index):
+    synced(index, [
+        event('ITEM_CREATE', '10', 'folder', 'docs', ROOT_ID),
+        event('ITEM_UPLOAD', '11', 'file', 'a.txt', '10', sha1='aa', size=3),
+        event('ITEM_TRASH', '11', 'file', 'a.txt', '10'),
+        event('ITEM_TRASH', '99', 'file', 'unknown.txt', ROOT_ID),
+    ], applied=3)
+    assert index.get('11') is None
+    assert index.children('10') == {}
+
+def test_expired_position_relists(index):
+    box = FakeBox(root_id=ROOT_ID, root_name='Backup', retry_after=0, retry_base_interval=0, seed=0)
+    client = FakeClient(box)
+    kept = box.create_file(ROOT_ID, 'kept.txt', b'kept')
+    removed = box.create_file(ROOT_ID, 'removed.txt', b'removed')
+    sync = EventSync(index, ListEventSource(), ROOT_ID, client=client)
+    assert sync.sync() == -1
+    assert set(index.children(ROOT_ID)) == {'kept.txt', 'removed.txt'}
+
+    box.delete(removed['id'])
+    added = box.create_file(ROOT_ID, 'added.txt', b'added')
+    sync.source = ExpiredEventSource([{}, {}, {}])
+    assert sync.sync() == -1
+    assert {name: item.id for name, item in index.children(ROOT_ID).items()} == {'kept.txt': kept['id'],
+                                                                                 'added.txt': added['id']}
+    assert index.get_meta(sync.position_key) == '3'
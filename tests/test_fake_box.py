@@ -0,0 +1,134 @@
+import filecmp, os
+import pytest
+
+pytest.importorskip('boxsdk')
+
+from backup import Backup
+from fake_box import FakeBox, FakeClient
+from scheduler import JobScheduler
+from watcher import WatchDaemon
+
+'''
+End to end runs of the app against the fake box: backup, no-op rerun, update, verify, restore, watched changes and
+runs with injected failures. The fake answers instantly and retries without waiting, so every run takes a fraction of a second.
+'''
+
+@pytest.fixture
+def tree(tmp_path) -> str:
+    root = tmp_path / 'data'
+    (root / 'sub' / 'deeper').mkdir(parents=True)
+    (root / 'a.txt').write_text('first file\n')
+    (root / 'sub' / 'b.bin').write_bytes(os.urandom(64 * 1024))
+    (root / 'sub' / 'deeper' / 'c.txt').write_text('deeper file\n')
+    return str(root)
+
+@pytest.fixture
+def backup(tmp_path):
+    credential_path = tmp_path / 'credential.txt'
+    credential_path.write_text('client id\nclient secret\n555\nhttp://localhost:7000\n')
+    state_dir = tmp_path / 'state'
+    state_dir.mkdir()
+    backup = Backup(credential_path=str(credential_path), state_dir=str(state_dir))
+    backup.upload_pool.base_delay = 0
+    box = FakeBox(root_id=backup.BACKUPFOLDERID, root_name='Backup', retry_after=0, retry_base_interval=0, seed=0,
+                  on_throttled=backup.upload_pool.throttled)
+    backup.connect(FakeClient(box))
+    yield backup
+    backup.upload_pool.shutdown()
+
+def run(backup: Backup, path: str) -> list:
+    '''
+    Backs up path as the command line run does and returns the jobs.
+    '''
+    backup.journal.start_run([path], [])
+    backup.refresh_remote()
+    scheduler = JobScheduler(backup)
+    scheduler.add(path)
+    jobs = scheduler.run()
+    if all(job.status == 'done' for job in jobs):
+        backup.journal.finish_run()
+    return jobs
+
+def verified(backup: Backup, path: str) -> str:
+    backup.refresh_remote()
+    return backup.verify([path])[path]
+
+def test_run(backup, tree):
+    jobs = run(backup, tree)
+    assert [job.status for job in jobs] == ['done']
+    assert backup.client.box.calls['upload'] == 3
+    assert backup.journal.unfinished_run() is None
+    assert verified(backup, tree) == '3 files checked: 0 missing, 0 stale, 0 extra on box'
+
+def test_rerun_without_changes(backup, tree):
+    run(backup, tree)
+    assert backup.local_plan(tree).changes() == []
+    assert backup.local_plan(tree, keep_entries=False).changed() == 0
+    calls = backup.client.box.calls.copy()
+    assert [job.status for job in run(backup, tree)] == ['done']
+    assert backup.client.box.calls['upload'] == calls['upload']
+    assert backup.client.box.calls['update_contents'] == calls['update_contents']
+
+def test_update(backup, tree):
+    run(backup, tree)
+    path = os.path.join(tree, 'sub', 'deeper', 'c.txt')
+    with open(path, 'a') as changed:
+        changed.write('one more line\n')
+    assert [entry.path for entry in backup.local_plan(tree).changes()] == [path]
+    assert backup.local_plan(tree, keep_entries=False).changed() == 1
+    assert [job.status for job in run(backup, tree)] == ['done']
+    assert backup.client.box.calls['update_contents'] == 1
+    assert verified(backup, tree) == '3 files checked: 0 missing, 0 stale, 0 extra on box'
+
+def test_verify_finds_changes(backup, tree):
+    run(backup, tree)
+    with open(os.path.join(tree, 'a.txt'), 'a') as changed:
+        changed.write('not backed up yet\n')
+    with open(os.path.join(tree, 'new.txt'), 'w') as new:
+        new.write('new file\n')
+    assert verified(backup, tree) == '4 files checked: 1 missing, 1 stale, 0 extra on box'
+
+def test_restore(backup, tree, tmp_path):
+    run(backup, tree)
+    destination = str(tmp_path / 'restored')
+    assert backup.restore_folder(backup.BACKUPFOLDERID, destination).startswith('Restored 3 files')
+    comparison = filecmp.dircmp(tree, os.path.join(destination, 'data'))
+    assert not comparison.left_only and not comparison.right_only and not comparison.diff_files
+    assert not filecmp.dircmp(os.path.join(tree, 'sub'), os.path.join(destination, 'data', 'sub')).diff_files
+    assert filecmp.cmp(os.path.join(tree, 'sub', 'b.bin'), os.path.join(destination, 'data', 'sub', 'b.bin'),
+                       shallow=False)
+
+def test_retried_failures(backup, tree):
+    backup.client.box.inject('upload', 429, times=2)
+    backup.client.box.inject('get_items', 500, times=2)
+    assert [job.status for job in run(backup, tree)] == ['done']
+    assert backup.client.box.calls['upload'] == 5
+    assert verified(backup, tree) == '3 files checked: 0 missing, 0 stale, 0 extra on box'
+
+def test_failed_run(backup, tree):
+    backup.client.box.inject('upload', 403)
+    jobs = run(backup, tree)
+    assert [job.status for job in jobs] == ['failed']
+    assert backup.journal.unfinished_run() == {'folders': [tree], 'files': []}
+    assert verified(backup, tree) == '3 files checked: 1 missing, 0 stale, 0 extra on box'
+
+    assert [job.status for job in run(backup, tree)] == ['done']
+    assert backup.journal.unfinished_run() is None
+    assert verified(backup, tree) == '3 files checked: 0 missing, 0 stale, 0 extra on box'
+
+def test_watch_batch_resumes_failed_root(backup, tree):
+    run(backup, tree)
+    responses = []
+    daemon = WatchDaemon(backup, [tree], on_backed_up=lambda path, response: responses.append(response),
+                         journal_runs=True)
+    path = os.path.join(tree, 'sub', 'new.txt')
+    with open(path, 'w') as new:
+        new.write('new file\n')
+    backup.client.box.inject('upload', 403)
+    daemon.backup_batch([path])
+    assert responses == ['Backed up changes (1 files failed to upload)']
+    assert backup.journal.unfinished_run() == {'folders': [tree], 'files': []}
+
+    daemon.backup_batch([])
+    assert backup.journal.unfinished_run() is None
+    assert verified(backup, tree) == '4 files checked: 0 missing, 0 stale, 0 extra on box'
@@ -0,0 +1,71 @@
+import os, re, time
+
+from filters import PathFilter, translate
+
+'''
+Gitignore-style patterns of the backup roots: how a pattern translates to a regular expression, and which files and
+directories a root's rules skip.
+'''
+
+def matches(pattern: str, relative: str) -> bool:
+    return re.fullmatch(translate(pattern), relative) is not None
+
+def stat_of(size: int = 0, age: float = 0) -> os.stat_result:
+    mtime = time.time() - age
+    return os.stat_result((0o100644, 0, 0, 1, 0, 0, size, mtime, mtime, mtime))
+
+def test_translate_unanchored_matches_at_any_depth():
+    assert matches('*.tmp', 'a.tmp')
+    assert matches('*.tmp', 'deep/er/a.tmp')
+    assert not matches('*.tmp', 'a.tmp/b')
+    assert matches('cache', 'x/cache')
+
+def test_translate_anchored_and_wildcards():
+    assert matches('/build', 'build')
+    assert not matches('/build', 'src/build')
+    assert matches('src/*.py', 'src/a.py')
+    assert not matches('src/*.py', 'src/sub/a.py')
+    assert matches('src/**/*.py', 'src/a.py')
+    assert matches('src/**/*.py', 'src/sub/deeper/a.py')
+    assert matches('logs/**', 'logs/a/b.log')
+    assert matches('file?.txt', 'file1.txt')
+    assert not matches('file?.txt', 'file/.txt')
+
+def test_translate_character_classes_and_escapes():
+    assert matches('[ab].txt', 'a.txt')
+    assert not matches('[ab].txt', 'c.txt')
+    assert matches('[!ab].txt', 'c.txt')
+    assert not matches('[!ab].txt', 'a.txt')
+    assert matches(r'\*.txt', '*.txt')
+    assert not matches(r'\*.txt', 'a.txt')
+
+def test_last_matching_pattern_wins():
+    path_filter = PathFilter(exclude=['*.tmp', '!keep.tmp', '# comment', ''])
+    assert path_filter.skip_file('a.tmp')
+    assert not path_filter.skip_file('keep.tmp')
+    assert not path_filter.skip_file('sub/keep.tmp')
+    assert not path_filter.skip_file('a.txt')
+
+def test_directory_only_patterns():
+    path_filter = PathFilter(exclude=['.git/', '__pycache__/'])
+    assert path_filter.skip_dir('.git')
+    assert path_filter.skip_dir('sub/__pycache__')
+    assert not path_filter.skip_file('.git')
+    assert path_filter.skip_path('sub/.git/config', is_dir=False)
+    assert not path_filter.skip_path('sub/config', is_dir=False)
+
+def test_include_and_stat_rules():
+    path_filter = PathFilter(include=['*.csv'], max_size=100, max_age=3600, min_age=60)
+    assert not path_filter.skip_file('data/a.csv', stat_of(size=10, age=600))
+    assert path_filter.skip_file('data/a.txt', stat_of(size=10, age=600))
+    assert path_filter.skip_file('data/a.csv', stat_of(size=101, age=600))
+    assert path_filter.skip_file('data/a.csv', stat_of(size=10, age=7200))
+    assert path_filter.skip_file('data/a.csv', stat_of(size=10, age=1))
+
+def test_inactive_filter_skips_nothing():
+    path_filter = PathFilter(bundle_below=1024)
+    assert not path_filter.active
+    assert not path_filter.skip_dir('.git')
+    assert not path_filter.skip_file('a.tmp', stat_of(size=10 ** 9))
+    assert path_filter.bundles(stat_of(size=10))
+    assert not path_filter.bundles(stat_of(size=1024))
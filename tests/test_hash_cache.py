@@ -0,0 +1,61 @@
+import hashlib, itertools
+import pytest
+
+import hash_cache
+from hash_cache import HashCache
+
+'''
+The stat-keyed sha1 cache: hits and misses, least recently used eviction and invalidation of a path and its tree.
+'''
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+    Makes every time.time() of the cache one second later than the last, so the use order is never a tie.
+    '''
+    ticks = itertools.count(1)
+    monkeypatch.setattr(hash_cache.time, 'time', lambda: float(next(ticks)))
+
+@pytest.fixture
+def cache(tmp_path) -> HashCache:
+    return HashCache(str(tmp_path / 'hash_cache.db'), max_entries=2)
+
+def write(path, content: bytes) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+def test_hit_until_changed(cache, tmp_path):
+    path = write(tmp_path / 'a.txt', b'first')
+    assert cache.lookup(path) is None
+    assert cache.sha1(path) == hashlib.sha1(b'first').hexdigest()
+    assert cache.lookup(path) == hashlib.sha1(b'first').hexdigest()
+    write(tmp_path / 'a.txt', b'second version')
+    assert cache.lookup(path) is None
+    assert cache.sha1(path) == hashlib.sha1(b'second version').hexdigest()
+
+def test_evicts_least_recently_used(cache, tmp_path, clock):
+    paths = [write(tmp_path / name, name.encode()) for name in ('a', 'b', 'c')]
+    for path in paths:
+        cache.store(path, 'sha1 of ' + path)
+    # a hit makes a the most recently used, so b is the oldest
+    assert cache.lookup(paths[0]) == 'sha1 of ' + paths[0]
+    assert cache.evict() == 1
+    assert cache.count() == 2
+    assert cache.lookup(paths[1]) is None
+    assert cache.lookup(paths[0]) is not None and cache.lookup(paths[2]) is not None
+    assert cache.evict() == 0
+
+def test_invalidate_tree(tmp_path):
+    cache = HashCache(str(tmp_path / 'hash_cache.db'))
+    inside = [write(tmp_path / 'dir' / 'a', b'a'), write(tmp_path / 'dir' / 'sub' / 'b', b'b')]
+    sibling = write(tmp_path / 'dir2' / 'c', b'c')
+    for path in inside + [sibling]:
+        cache.sha1(path)
+    assert cache.invalidate(str(tmp_path / 'dir')) == 2
+    assert all(cache.lookup(path) is None for path in inside)
+    assert cache.lookup(sibling) is not None
+    assert cache.invalidate(sibling) == 1
+    cache.sha1(inside[0])
+    assert cache.invalidate() == 1
+    assert cache.count() == 0
@@ -0,0 +1,64 @@
+import os
+
+from journal import BackupJournal
+
+'''
+The write-ahead journal of a run: what an interrupted run resumes with, and the failed folders/files carried into the
+next run until they are backed up.
+'''
+
+def test_resume_interrupted_run(tmp_path):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    done_file = tmp_path / 'a' / 'done.txt'
+    done_file.parent.mkdir()
+    done_file.write_text('backed up')
+    journal = BackupJournal(journal_path)
+    journal.start_run(['/a', '/b'], ['/c.txt'])
+    journal.completed_file(str(done_file), 'box id')
+    journal.completed('root', '/a')
+
+    # the app died here: a new journal reads the run back
+    resumed = BackupJournal(journal_path)
+    assert resumed.unfinished_run() == {'folders': ['/b'], 'files': ['/c.txt']}
+    assert resumed.file_is_done(str(done_file))
+    resumed.start_run(['/b'], ['/c.txt'])
+    assert resumed.file_is_done(str(done_file))
+    done_file.write_text('changed since')
+    assert not resumed.file_is_done(str(done_file))
+
+    assert not resumed.finish_run()
+    resumed.completed('root', '/b')
+    resumed.completed('root', '/c.txt')
+    assert resumed.finish_run()
+    assert resumed.unfinished_run() is None
+    assert os.path.getsize(journal_path) == 0
+    assert BackupJournal(journal_path).unfinished_run() is None
+
+def test_failed_roots_carry_over(tmp_path):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    journal = BackupJournal(journal_path)
+    journal.start_run(['/a', '/b'], ['/c.txt'])
+    journal.completed('root', '/a')
+    journal.completed('root', '/c.txt')
+    journal.failed('/b', 'Failed: 403')
+    assert not journal.finish_run()
+
+    journal = BackupJournal(journal_path)
+    assert journal.failures == {'/b': 'Failed: 403'}
+    journal.start_run(['/d'], [])
+    assert journal.unfinished_run() == {'folders': ['/d', '/b'], 'files': []}
+    journal.completed('root', '/d')
+    assert not journal.finish_run()
+
+    journal.completed('root', '/b')
+    assert journal.failures == {}
+    assert journal.finish_run()
+
+def test_partial_last_line_ignored(tmp_path):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    journal = BackupJournal(journal_path)
+    journal.start_run(['/a'], [])
+    journal.completed('root', '/a')
+    with open(journal_path, 'a') as partial:
+        partial.write('{"kind": "failed", "op": "ro')
+    assert BackupJournal(journal_path).unfinished_run() == {'folders': [], 'files': []}
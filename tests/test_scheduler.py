@@ -0,0 +1,68 @@
+import pytest
+
+import scheduler
+from scheduler import BandwidthBudget, JobScheduler
+
+'''
+The shared bandwidth budget and the order the backup jobs start in.
+'''
+
+class Clock():
+    '''
+    Stand-in for time.monotonic and time.sleep: sleeping only moves the clock forward, and is recorded.
+    '''
+    def __init__(self) -> None:
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(scheduler.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(scheduler.time, 'sleep', clock.sleep)
+    return clock
+
+def test_unlimited_budget_never_waits(clock):
+    budget = BandwidthBudget()
+    budget.consume(10 ** 12)
+    assert clock.sleeps == []
+
+def test_budget_bursts_then_waits(clock):
+    budget = BandwidthBudget(rate=1000)
+    budget.consume(600)
+    budget.consume(400)
+    assert clock.sleeps == []
+    budget.consume(500)
+    assert clock.sleeps == [0.5]
+    # the time slept paid the debt back, and idle time refills the bucket up to one second of budget
+    clock.now += 10
+    budget.consume(1000)
+    assert clock.sleeps == [0.5]
+
+def test_part_larger_than_bucket_goes_into_debt(clock):
+    budget = BandwidthBudget(rate=1000)
+    budget.consume(3000)
+    assert clock.sleeps == [2.0]
+    budget.consume(100)
+    assert clock.sleeps == [2.0, 0.1]
+
+def order(shortest_first: bool, jobs: list[tuple]) -> list[str]:
+    job_scheduler = JobScheduler(None, shortest_first=shortest_first)
+    for path, priority, size in jobs:
+        job_scheduler.add(path, priority, size)
+    return [job.path for job in job_scheduler.order()]
+
+def test_order_by_priority_then_added():
+    jobs = [('big', 0, 500), ('small', 0, 10), ('urgent', 5, 900), ('unknown', 0, None)]
+    assert order(False, jobs) == ['urgent', 'big', 'small', 'unknown']
+
+def test_order_shortest_first():
+    jobs = [('big', 0, 500), ('small', 0, 10), ('urgent', 5, 900), ('medium', 0, 100), ('later', -1, 1)]
+    assert order(True, jobs) == ['urgent', 'small', 'medium', 'big', 'later']
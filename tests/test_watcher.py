@@ -0,0 +1,53 @@
+import pytest
+
+import watcher
+from watcher import ChangeDebouncer
+
+'''
+Batching of the watched changes: a burst is handed over once changes stop for quiet seconds (or after max_wait), with
+duplicates and the paths inside a changed directory coalesced.
+'''
+
+class Clock():
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(watcher.time, 'monotonic', clock)
+    return clock
+
+@pytest.fixture
+def debouncer() -> ChangeDebouncer:
+    return ChangeDebouncer(lambda batch: None, quiet=2.0, max_wait=30.0)
+
+def test_batch_waits_for_quiet(debouncer, clock, tmp_path):
+    path = str(tmp_path / 'a.txt')
+    debouncer.add(path)
+    clock.now += 1.5
+    assert debouncer.take() == []
+    debouncer.add(path)
+    clock.now += 1.5
+    assert debouncer.take() == []
+    clock.now += 0.5
+    assert debouncer.take() == [path]
+    assert debouncer.take() == []
+
+def test_batch_due_after_max_wait(debouncer, clock, tmp_path):
+    for i in range(31):
+        debouncer.add(str(tmp_path / f'{i}.txt'))
+        clock.now += 1.0
+    assert len(debouncer.take()) == 31
+
+def test_coalesces_duplicates_and_changed_directories(debouncer, clock, tmp_path):
+    directory = tmp_path / 'new'
+    (directory / 'sub').mkdir(parents=True)
+    outside = str(tmp_path / 'newer.txt')
+    for path in [str(directory / 'a.txt'), str(directory), str(directory / 'sub' / 'b.txt'), outside, outside]:
+        debouncer.add(path)
+    clock.now += 2.0
+    assert debouncer.take() == [str(directory), outside]